@@ -83,6 +83,21 @@ class AudioController:
             else:
                 messagebox.showerror("خطأ", msg)
 
+    def recover_autosave(self):
+        """عرض استرجاع التعديلات غير المحفوظة إذا أُغلق البرنامج بشكل غير طبيعي في المرة السابقة."""
+        records = self.model.read_recovery()
+        if records is None: return
+        if not messagebox.askyesno("محرر الصوت", "توجد تعديلات غير محفوظة من الجلسة السابقة. هل تريد استرجاعها؟"):
+            self.model.journal.discard()
+            return
+        success, msg = self.model.recover(records)
+        if success:
+            self.current_position_sec = 0
+            self.view.file_label.configure(text=os.path.basename(self.model.audio_path))
+            self.update_view()
+        else:
+            messagebox.showerror("خطأ", msg)
+
     # --- دوال التحرير ---
     def get_selection_times(self):
         """الحصول على أزمنة البداية والنهاية للتحديد."""
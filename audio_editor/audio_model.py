@@ -2,6 +2,7 @@
 import soundfile as sf
 import numpy as np
 import os
+from utils.autosave import AutosaveJournal
 
 
 class AudioModel:
@@ -16,6 +17,8 @@ class AudioModel:
         self.duration = 0
         self.clipboard_data = None
         self.unsaved_changes = False
+        # سجل الحفظ التلقائي: كل عملية تُسجل مع العينات التي تغيرت فقط
+        self.journal = AutosaveJournal('audio')
 
     def load_audio(self, file_path):
         """تحميل ملف صوتي من مسار."""
@@ -27,6 +30,7 @@ class AudioModel:
                 self.audio_data = np.mean(self.audio_data, axis=1)
             self.duration = len(self.audio_data) / self.sample_rate
             self.unsaved_changes = False
+            self.journal.start({'editor': 'audio', 'path': os.path.abspath(file_path)})
             return True, "تم تحميل الملف."
         except Exception as e:
             return False, f"فشل تحميل الملف: {e}"
@@ -38,6 +42,8 @@ class AudioModel:
         try:
             sf.write(file_path, self.audio_data, self.sample_rate)
             self.unsaved_changes = False
+            # ما قبل هذه النقطة محفوظ في الملف، فيبدأ سجل جديد منه (العمليات السابقة لا تُعاد مرة أخرى)
+            self.journal.start({'editor': 'audio', 'path': os.path.abspath(file_path)})
             return True, "تم حفظ الملف."
         except Exception as e:
             return False, f"فشل الحفظ: {e}"
@@ -54,9 +60,8 @@ class AudioModel:
         if start_sample == end_sample: return False
         
         self.clipboard_data = self.audio_data[start_sample:end_sample].copy()
-        self.audio_data = np.delete(self.audio_data, np.arange(start_sample, end_sample))
-        self.duration = len(self.audio_data) / self.sample_rate
-        self.unsaved_changes = True
+        self.delete_samples(start_sample, end_sample)
+        self.journal.record({'kind': 'delete', 'start': start_sample, 'end': end_sample})
         return True
 
     def copy_audio(self, start_sec, end_sec):
@@ -72,9 +77,9 @@ class AudioModel:
         if self.clipboard_data is None: return False
         
         insert_sample = int(position_sec * self.sample_rate)
-        self.audio_data = np.insert(self.audio_data, insert_sample, self.clipboard_data)
-        self.duration = len(self.audio_data) / self.sample_rate
-        self.unsaved_changes = True
+        self.insert_samples(insert_sample, self.clipboard_data)
+        # الحافظة لا تُعدل في مكانها (كل قص/نسخ ينشئ مصفوفة جديدة) فتُسلم للسجل بدون نسخ
+        self.journal.record({'kind': 'insert', 'position': insert_sample}, [self.clipboard_data])
         return True
 
     def apply_effect(self, effect_name, start_sec, end_sec):
@@ -106,10 +111,66 @@ class AudioModel:
                 processed_audio = processed_audio / max_val
             
             if is_full_track:
-                self.audio_data = processed_audio
-            else:
-                self.audio_data[start_sample:end_sample] = processed_audio
-            
-            self.unsaved_changes = True
+                start_sample, end_sample = None, None
+            self.replace_samples(start_sample, end_sample, processed_audio)
+            # نسخة لأن الكتابة تتم في الخلفية والمصفوفة قد تكون جزءاً من الصوت الذي سيُعدل لاحقاً
+            self.journal.record({'kind': 'replace', 'start': start_sample, 'end': end_sample},
+                                [np.array(processed_audio)])
             return True
         return False
+
+    # --- تعديلات العينات (مشتركة بين العمليات واسترجاع السجل) ---
+    def delete_samples(self, start_sample, end_sample):
+        self.audio_data = np.delete(self.audio_data, np.arange(start_sample, end_sample))
+        self.samples_changed()
+
+    def insert_samples(self, position, samples):
+        self.audio_data = np.insert(self.audio_data, position, samples)
+        self.samples_changed()
+
+    def replace_samples(self, start_sample, end_sample, samples):
+        """استبدال جزء من الصوت، أو الصوت كله إذا كان start_sample هو None."""
+        if start_sample is None:
+            self.audio_data = samples
+        else:
+            self.audio_data[start_sample:end_sample] = samples
+        self.samples_changed()
+
+    def samples_changed(self):
+        self.duration = len(self.audio_data) / self.sample_rate
+        self.unsaved_changes = True
+
+    # --- الحفظ التلقائي ---
+    def read_recovery(self):
+        """قراءة سجل الحفظ التلقائي المتبقي من جلسة سابقة. يرجع None إذا لم يوجد عمل غير محفوظ فيه."""
+        if not self.journal.exists(): return None
+        try:
+            records = self.journal.read()
+        except (OSError, ValueError):
+            return None
+        if len(records) < 2 or records[0][0].get('editor') != 'audio' or records[-1][0]['kind'] == 'saved':
+            return None
+        return records
+
+    def recover(self, records):
+        """فتح الملف الأصلي ثم إعادة العمليات المسجلة عليه بالترتيب. يرجع (نجاح, رسالة)."""
+        success, msg = self.load_audio(records[0][0]['path'])
+        if not success: return success, msg
+        for meta, blobs in records[1:]:
+            kind = meta['kind']
+            if kind == 'delete':
+                self.delete_samples(meta['start'], meta['end'])
+            elif kind == 'insert':
+                self.insert_samples(meta['position'], blobs[0])
+            elif kind == 'replace':
+                self.replace_samples(meta['start'], meta['end'], blobs[0])
+            else:
+                continue
+            # السجل الجديد (من الملف الأصلي) يجب أن يحتوي العمليات المسترجعة أيضاً
+            self.journal.record(meta, [blob.copy() for blob in blobs])
+        return True, "تم استرجاع التعديلات غير المحفوظة."
+
+    def close_journal(self):
+        """حذف سجل الحفظ التلقائي عند الخروج الطبيعي."""
+        self.journal.discard()
+        self.journal.flush()
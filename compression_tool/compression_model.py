@@ -3,7 +3,7 @@ import zipfile
 import os
 import wave
 import struct
-from PIL import Image
+from photo_editor.batch_engine import run_recipe
 
 class CompressionModel:
     """
@@ -43,35 +43,26 @@ class CompressionModel:
             return False, f"فشل الضغط: {e}"
 
     def compress_images(self, files, output_dir, quality, output_format, resize_factor, progress_callback):
-        try:
-            total_files = len(files)
-            for i, file_path in enumerate(files):
-                if not self.is_compressing:
-                    raise InterruptedError("تم إلغاء العملية.")
-                
-                file_name = os.path.basename(file_path)
-                progress_callback((i / total_files) * 100, f"جاري ضغط {file_name}...")
+        """
+        ضغط الصور بوصفة (تصغير ثم حفظ) عبر محرك المعالجة الدفعية، فتُعالج الصور بالتوازي
+        وتُفك كل صورة مرة واحدة (مصغرة أثناء الفك إن أمكن). كل تشغيل يضغط كل الصور (بدون سجل تشغيلات
+        في مجلد المستخدم).
+        """
+        recipe = [('resize', resize_factor)] if resize_factor != 1.0 else []
+        output_ext = f".{output_format.lower()}" if output_format != "نفس التنسيق الأصلي" else None
+        recipe.append(('encode', "{stem}_compressed{ext}", output_ext, quality))
 
-                with Image.open(file_path) as img:
-                    if resize_factor != 1.0:
-                        new_size = (int(img.width * resize_factor), int(img.height * resize_factor))
-                        img = img.resize(new_size, Image.Resampling.LANCZOS)
-                    
-                    base_name, old_ext = os.path.splitext(file_name)
-                    output_ext = f".{output_format.lower()}" if output_format != "نفس التنسيق الأصلي" else old_ext.lower()
-                    output_path = os.path.join(output_dir, f"{base_name}_compressed{output_ext}")
-                    
-                    if output_ext in ['.jpg', '.jpeg'] and img.mode in ('RGBA', 'P'):
-                        img = img.convert('RGB')
-                    
-                    save_params = {'quality': quality}
-                    if output_ext == '.webp':
-                        save_params['method'] = 6
-                    
-                    img.save(output_path, **save_params)
-            
-            if not self.is_compressing: return False, "تم إلغاء العملية."
-            return True, f"تم ضغط {total_files} صورة بنجاح."
+        def report(done, total, file_name, error):
+            if not self.is_compressing:
+                raise InterruptedError("تم إلغاء العملية.")
+            progress_callback((done / total) * 100, f"جاري ضغط {file_name}...")
+
+        try:
+            summary = run_recipe(files, recipe, output_dir, report, use_manifest=False)
+            if summary['failed']:
+                file_name, error = summary['failed'][0]
+                return False, f"فشل ضغط {len(summary['failed'])} صورة ({file_name}: {error})"
+            return True, f"تم ضغط {summary['total']} صورة بنجاح."
         except Exception as e:
             return False, f"فشل ضغط الصور: {e}"
 
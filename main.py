@@ -18,6 +18,8 @@ class MainApplication:
         self.setup_ui()
         # ربط دالة الإغلاق الآمن
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        # استرجاع العمل غير المحفوظ بعد ظهور النافذة
+        self.root.after(200, self.recover_autosave)
 
     def setup_ui(self):
         self.tab_view = ctk.CTkTabview(self.root)
@@ -36,6 +38,11 @@ class MainApplication:
         self.compression_tab_parent = self.tab_view.add("🗜️ أداة الضغط")
         self.compression_controller = CompressionController(self.compression_tab_parent)
 
+    def recover_autosave(self):
+        """إذا انتهت الجلسة السابقة بانهيار، يُعرض استرجاع التعديلات من سجلات الحفظ التلقائي."""
+        self.photo_controller.recover_autosave()
+        self.audio_controller.recover_autosave()
+
     def on_closing(self):
         """
         دالة يتم استدعاؤها عند محاولة إغلاق التطبيق.
@@ -57,6 +64,10 @@ class MainApplication:
             if not messagebox.askyesno("محرر الصوت", "لديك تعديلات في محرر الصوت غير محفوظة. هل تريد الخروج على أي حال؟", icon='warning'):
                 return # إلغاء عملية الخروج
         
+        # الخروج الطبيعي: سجلات الحفظ التلقائي لم تعد مطلوبة
+        self.photo_controller.model.close_journal()
+        self.audio_controller.model.close_journal()
+
         # إذا وافق المستخدم على كل شيء، يتم تدمير النافذة
         self.root.destroy()
 
@@ -0,0 +1,71 @@
+# /photo_editor/adjustments.py
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+# معاملات تحويل RGB إلى رمادي كما في Pillow (L = R*299/1000 + G*587/1000 + B*114/1000)
+L_WEIGHTS = (19595, 38470, 7471)
+
+
+def adjust_image(image, brightness, contrast, saturation, sharpness, progress_callback=None):
+    """
+    تطبيق التعديلات (سطوع، تباين، تشبع، حدة) على صورة RGBA وإرجاع صورة جديدة.
+    بدلاً من أربع مراحل ImageEnhance (كل منها تنشئ صورة كاملة حتى لو كانت القيمة 1.0):
+    - السطوع والتباين يُدمجان في جدول بحث (LUT) واحد لكل قناة ويُطبقان بمرور واحد.
+    - التشبع يُطبق بمزج واحد مع النسخة الرمادية.
+    - الحدة (المرشح الالتفافي) تُطبق مرة واحدة فقط.
+    وأي تعديل قيمته 1.0 لا يُنفذ أصلاً.
+    النتيجة مطابقة لسلسلة ImageEnhance. لا تعدل الصورة الأصلية، لذلك يمكن استدعاؤها من خيط منفصل.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+
+    def report(progress):
+        if progress_callback:
+            progress_callback(progress)
+
+    # 1. السطوع + التباين: جدول بحث واحد
+    if brightness != 1.0 or contrast != 1.0:
+        brightness_lut = blend_lut(0, brightness)
+        if contrast != 1.0:
+            # التباين يمزج مع متوسط الرمادي للصورة بعد تطبيق السطوع
+            mean = int(luminance_mean(image, brightness_lut) + 0.5)
+            lut = blend_lut(mean, contrast)[brightness_lut]
+        else:
+            lut = brightness_lut
+        # قناة الشفافية لا تتغير
+        image = image.point(lut.tolist() * 3 + list(range(256)))
+    report(0.4)
+
+    # 2. التشبع: مزج كل بكسل مع قيمته الرمادية
+    if saturation != 1.0:
+        gray = image.convert('L')
+        degenerate = Image.merge('RGBA', (gray, gray, gray, image.getchannel('A')))
+        image = Image.blend(degenerate, image, saturation)
+    report(0.7)
+
+    # 3. الحدة: المرشح الالتفافي مرة واحدة
+    if sharpness != 1.0:
+        image = ImageEnhance.Sharpness(image).enhance(sharpness)
+    report(1.0)
+    return image
+
+
+def blend_lut(base, factor):
+    """جدول بحث لعملية Image.blend بين قيمة ثابتة (base) والقيمة الأصلية، بنفس دقة Pillow."""
+    values = np.arange(256, dtype=np.float32)
+    mixed = np.float32(base) + np.float32(factor) * (values - np.float32(base))
+    return np.clip(mixed, 0, 255).astype(np.uint8)
+
+
+def luminance_mean(image, lut):
+    """
+    متوسط الرمادي للصورة بعد تطبيق جدول البحث، محسوب من مدرج القنوات (Histogram)
+    بدون إنشاء الصورة الوسيطة.
+    """
+    histogram = np.array(image.histogram(), dtype=np.float64).reshape(-1, 256)
+    count = histogram[0].sum()
+    if count == 0: return 0
+    mapped = lut.astype(np.float64)
+    channel_means = [(histogram[band] * mapped).sum() / count for band in range(3)]
+    return sum(w * m for w, m in zip(L_WEIGHTS, channel_means)) / 65536
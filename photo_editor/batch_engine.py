@@ -0,0 +1,477 @@
+# /photo_editor/batch_engine.py
+"""
+محرك المعالجة الدفعية للصور بدون واجهة.
+كل دفعة تُوصف بوصفة (Recipe): قائمة مراحل تُطبق بالترتيب على كل صورة داخل نفس العملية العاملة،
+فكل صورة تُفك مرة واحدة وتُرمز مرة واحدة مهما كان عدد المراحل. مثال:
+
+    [('fit', 2048), ('adjust', 1.1, 1.0, 1.0, 1.0), ('watermark', 'logo.png', 'bottom_right'),
+     ('encode', 'marked_{name}', None, None)]
+
+يعمل من البرنامج أو من سطر الأوامر (إضافة شعار لمجلد):
+
+    python -m photo_editor.batch_engine SOURCE_FOLDER WATERMARK SAVE_FOLDER [--position bottom_right] [--workers N]
+                                        [--max-size PIXELS] [--force]
+
+كل تشغيل يسجل الملفات المكتملة في ملف manifest داخل مجلد الحفظ، فإعادة التشغيل (أو استكمال تشغيل
+توقف) تتخطى الصور التي لم يتغير محتواها ولا الوصفة.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, UnidentifiedImageError
+from .layer_ops import apply_op
+from .macro import replay_macro
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+POSITIONS = ("top_left", "top_right", "bottom_left", "bottom_right")
+
+# عرض الشعار كنسبة من عرض الصورة، والمسافة من الحافة بالبكسل
+WATERMARK_SCALE = 0.15
+WATERMARK_MARGIN = 20
+
+# عدد أحجام الشعار المختلفة التي تُحفظ (صور الدفعة عادة بعدد قليل من الأبعاد)
+MAX_CACHED_WATERMARKS = 16
+
+# ملف سجل الملفات المكتملة (سطر JSON لكل ملف ناتج) داخل مجلد الحفظ
+MANIFEST_NAME = ".batch_manifest.jsonl"
+# يتغير عند تغيير طريقة المعالجة نفسها، فتُعاد معالجة كل الصور
+ENGINE_VERSION = 2
+
+# صيغ الحفظ التي لا تدعم الشفافية
+OPAQUE_EXTENSIONS = ('.jpg', '.jpeg', '.bmp')
+
+
+class WatermarkCache:
+    """
+    الشعار بعد تغيير حجمه لكل حجم مطلوب، مع قناة الشفافية كقناع جاهز للصق.
+    (resize في Pillow يعمل على الألوان مضروبة في الشفافية داخلياً، فالنتيجة المحفوظة جاهزة للصق مباشرة.)
+    """
+    def __init__(self, watermark, max_sizes=MAX_CACHED_WATERMARKS):
+        self.watermark = watermark
+        self.max_sizes = max_sizes
+        # size -> (الشعار, قناع الشفافية)، الأحدث استخداماً في النهاية
+        self.entries = OrderedDict()
+
+    def get(self, size):
+        entry = self.entries.pop(size, None)
+        if entry is None:
+            resized = self.watermark.resize(size, Image.Resampling.LANCZOS)
+            entry = (resized, resized.getchannel('A'))
+            while len(self.entries) >= self.max_sizes:
+                self.entries.popitem(last=False)
+        self.entries[size] = entry
+        return entry
+
+
+# الشعارات المحملة في هذه العملية (Process): المسار -> WatermarkCache
+_watermarks = {}
+
+
+def load_watermark(path):
+    cache = _watermarks.get(path)
+    if cache is None:
+        with Image.open(path) as watermark:
+            cache = _watermarks[path] = WatermarkCache(watermark.convert('RGBA'))
+    return cache
+
+
+# --- المراحل ---
+# كل مرحلة tuple أول عنصر فيها اسمها والباقي معاملاتها (مثل سلسلة عمليات الطبقات).
+# دالة المرحلة: stage(image, context, *args) وترجع الصورة الجديدة.
+STAGES = {}
+# معاملات المراحل التي هي مسارات ملفات يؤثر محتواها على الناتج: اسم المرحلة -> مواضع المعاملات
+STAGE_FILE_ARGS = {}
+
+
+def register_stage(name, file_args=()):
+    """
+    إضافة نوع مرحلة جديد للوصفات. file_args مواضع المعاملات التي هي ملفات (مثل صورة الشعار)
+    حتى يتغير سجل التشغيلات إذا تغير محتواها.
+    المرحلة يجب أن تكون معرفة في وحدة (module) يتم استيرادها في العمليات العاملة أيضاً.
+    """
+    def decorator(function):
+        STAGES[name] = function
+        STAGE_FILE_ARGS[name] = tuple(file_args)
+        return function
+    return decorator
+
+
+def fit_size(size, max_size):
+    """أبعاد الصورة بعد تصغيرها (إن لزم) بحيث لا يتجاوز أكبر بعد max_size."""
+    width, height = size
+    scale = min(1.0, max_size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def scaled_size(size, factor):
+    return max(1, int(size[0] * factor)), max(1, int(size[1] * factor))
+
+
+@register_stage('fit')
+def fit_stage(image, context, max_size):
+    """تصغير الصورة بحيث لا يتجاوز أكبر بعد max_size (مع الحفاظ على النسبة)."""
+    size = fit_size(context['source_size'], max_size)
+    if size == image.size: return image
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    return image
+
+
+@register_stage('resize')
+def resize_stage(image, context, factor):
+    """تغيير الأبعاد بنسبة من أبعاد الصورة الأصلية (قبل أي تصغير أثناء الفك)."""
+    size = scaled_size(context['source_size'], factor)
+    if size == image.size: return image
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def _layer_op(image, op):
+    # الفلاتر والتعديلات هي نفس عمليات طبقات المحرر (layer_ops)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    return apply_op(image, op)
+
+
+@register_stage('adjust')
+def adjust_stage(image, context, brightness, contrast, saturation, sharpness):
+    return _layer_op(image, ('adjust', brightness, contrast, saturation, sharpness))
+
+
+@register_stage('filter')
+def filter_stage(image, context, name):
+    return _layer_op(image, ('filter', name))
+
+
+@register_stage('threshold')
+def threshold_stage(image, context, value):
+    return _layer_op(image, ('threshold', value))
+
+
+@register_stage('watermark', file_args=(0,))
+def watermark_stage(image, context, watermark_path, position):
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    return apply_watermark(image, load_watermark(watermark_path), position)
+
+
+@register_stage('macro')
+def macro_stage(image, context, steps):
+    """إعادة خطوات ماكرو مسجل من محرر الصور (انظر macro.py)."""
+    return replay_macro(image, steps)
+
+
+@register_stage('encode')
+def encode_stage(image, context, name_template, extension=None, quality=None):
+    """
+    حفظ الصورة في مجلد الحفظ. name_template يستخدم {name} (اسم الملف الأصلي) و {stem} و {ext}
+    (امتداد الناتج)، و extension (مثل '.webp') None = نفس امتداد الأصل. الصيغة تُحدد من الامتداد.
+    """
+    save_path = output_path(context['source_path'], context['save_folder'], name_template, extension)
+    if save_path.lower().endswith(OPAQUE_EXTENSIONS) and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    options = {}
+    if quality is not None:
+        options['quality'] = quality
+    if save_path.lower().endswith('.webp'):
+        options['method'] = 6
+    image.save(save_path, **options)
+    return image
+
+
+def output_path(source_path, save_folder, name_template, extension=None):
+    name = os.path.basename(source_path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(save_folder, name_template.format(name=name, stem=stem, ext=(extension or ext).lower()))
+
+
+def recipe_output(recipe, source_path, save_folder):
+    """مسار الناتج لصورة (من مرحلة encode الأخيرة في الوصفة)."""
+    for stage in reversed(recipe):
+        if stage[0] == 'encode':
+            return output_path(source_path, save_folder, *stage[1:3])
+    raise ValueError("الوصفة يجب أن تنتهي بمرحلة encode")
+
+
+def decode(source, recipe):
+    """
+    فك الصورة مرة واحدة لكل الوصفة. إذا كانت أول مرحلة تصغيراً (fit أو resize) تُفك JPEG مباشرة
+    بأصغر مقياس (1/2 أو 1/4 أو 1/8) لا يقل عن الحجم المطلوب، فلا تُفك الصور الكبيرة كاملة لمجرد تصغيرها.
+    يرجع (الصورة, أبعادها الأصلية).
+    """
+    with Image.open(source) as image:
+        source_size = image.size
+        target = None
+        if recipe and recipe[0][0] == 'fit':
+            target = fit_size(source_size, recipe[0][1])
+        elif recipe and recipe[0][0] == 'resize':
+            target = scaled_size(source_size, recipe[0][1])
+        if target and target[0] < source_size[0]:
+            # draft صريح بالحجم المطلوب نفسه (thumbnail وحده يطلب ضعف الحجم فيفقد غالباً مقياس 1/2)
+            image.draft('RGB', target)
+        image.load()
+        return image, source_size
+
+
+def run_recipe_on(source, source_path, recipe, save_folder):
+    """تطبيق كل مراحل الوصفة على صورة واحدة (source مسار أو ملف مفتوح)."""
+    try:
+        image, source_size = decode(source, recipe)
+    except UnidentifiedImageError as e:
+        # رسالة Pillow لملف مفتوح تعرض كائن الملف بدلاً من اسمه
+        raise UnidentifiedImageError(f"cannot identify image file {source_path!r}") from e
+    context = {'source_path': source_path, 'source_size': source_size, 'save_folder': save_folder}
+    for stage in recipe:
+        image = STAGES[stage[0]](image, context, *stage[1:])
+    return image
+
+
+def list_images(source_folder):
+    """مسارات ملفات الصور في المجلد بترتيب ثابت."""
+    return [os.path.join(source_folder, f) for f in sorted(os.listdir(source_folder))
+            if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def watermark_box(image_size, watermark_size, position):
+    """أبعاد الشعار بعد تغيير حجمه وموضعه على صورة بحجم معين."""
+    width, height = image_size
+    wm_width = max(1, int(width * WATERMARK_SCALE))
+    wm_height = max(1, int(watermark_size[1] * (wm_width / watermark_size[0])))
+    margin = WATERMARK_MARGIN
+    positions = {
+        "top_left": (margin, margin),
+        "top_right": (width - wm_width - margin, margin),
+        "bottom_left": (margin, height - wm_height - margin),
+        "bottom_right": (width - wm_width - margin, height - wm_height - margin),
+    }
+    return (wm_width, wm_height), positions.get(position, positions["bottom_right"])
+
+
+def apply_watermark(image, watermarks, position):
+    """لصق الشعار (بحجم مناسب لعرض الصورة من WatermarkCache) على صورة RGBA في مكانها."""
+    size, pos = watermark_box(image.size, watermarks.watermark.size, position)
+    wm_resized, mask = watermarks.get(size)
+    image.paste(wm_resized, pos, mask)
+    return image
+
+
+def watermark_recipe(watermark_path, position="bottom_right", max_size=None):
+    """وصفة إضافة الشعار (مع تصغير اختياري) كما في نافذة المعالجة الدفعية."""
+    recipe = [('fit', max_size)] if max_size else []
+    return recipe + [('watermark', watermark_path, position), ('encode', "marked_{name}", None, None)]
+
+
+def macro_recipe(steps):
+    """وصفة تطبيق ماكرو على الصور، والناتج بنفس صيغة كل صورة أصلية."""
+    return [('macro', steps), ('encode', "macro_{name}", None, None)]
+
+
+# --- سجل التشغيلات ---
+class BatchManifest:
+    """
+    سجل الملفات التي اكتملت معالجتها: لكل ملف ناتج (المصدر، الحجم، وقت التعديل، بصمة المحتوى،
+    بصمة الوصفة). الملف يُضاف إليه سطر بعد كل صورة، فإذا توقف التشغيل لا تضيع
+    إلا الصور التي كانت قيد المعالجة.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.file = None
+
+    def load(self):
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # آخر سطر قد يكون ناقصاً إذا توقف التشغيل أثناء كتابته
+                        continue
+                    self.entries[entry['output']] = entry
+                    lines += 1
+        # التشغيلات المتكررة تضيف أسطراً لنفس الملفات، فيُعاد كتابة السجل بآخر سطر لكل ملف فقط
+        if lines > len(self.entries):
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(temp_path, self.path)
+        return self
+
+    def is_unchanged(self, entry, source_path, stat, settings_hash, output_path):
+        """تحقق سريع بدون قراءة الصورة: نفس المصدر وحجمه ووقت تعديله والوصفة، والناتج موجود."""
+        return (entry is not None and entry['source'] == source_path and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns and entry['params'] == settings_hash
+                and os.path.exists(output_path))
+
+    def add(self, entry):
+        self.entries[entry['output']] = entry
+        if self.file is None:
+            self.file = open(self.path, "a", encoding='utf-8')
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def recipe_hash(recipe):
+    """بصمة كل ما يؤثر على الناتج غير الصورة نفسها (الوصفة ومحتوى الملفات المستخدمة فيها مثل الشعار)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([ENGINE_VERSION, WATERMARK_SCALE, WATERMARK_MARGIN, recipe]).encode())
+    for stage in recipe:
+        for index in STAGE_FILE_ARGS.get(stage[0], ()):
+            with open(stage[1 + index], "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+# --- التنفيذ ---
+def _process_file(source_path, save_path, recipe, save_folder, previous_hash):
+    """
+    يُنفذ في عملية عاملة. يرجع (بصمة المحتوى, الخطأ, تم التخطي): الصورة لا تُعالج إذا كانت بصمتها
+    مطابقة للتشغيل السابق (مثلاً تغير وقت التعديل فقط). الخطأ يُرجع كنص بدلاً من إيقاف الدفعة كلها.
+    """
+    try:
+        with open(source_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if digest == previous_hash and os.path.exists(save_path):
+            return digest, None, True
+        run_recipe_on(io.BytesIO(data), source_path, recipe, save_folder)
+        return digest, None, False
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", False
+
+
+def run_recipe(files, recipe, save_folder, progress_callback=None, workers=None, max_pending=None, force=False,
+               use_manifest=True):
+    """
+    تطبيق وصفة على قائمة صور باستخدام عدة عمليات (Processes) بعدد أنوية المعالج.
+
+    - عدد الملفات قيد المعالجة محدود (max_pending، افتراضياً ضعف عدد العمليات)، فلا تُنشأ مهام
+      لعشرات آلاف الملفات دفعة واحدة.
+    - progress_callback(done, total, filename, error) يُستدعى بترتيب الملفات نفسه؛ error نص الخطأ أو None.
+      إذا رفعت استثناءً (مثلاً عند الإلغاء) تتوقف الدفعة ولا تبدأ الملفات المتبقية.
+    - الصور التي لم يتغير محتواها ولا الوصفة منذ تشغيل سابق تُتخطى (حسب سجل MANIFEST_NAME
+      في مجلد الحفظ)، إلا إذا كان force=True. use_manifest=False: لا يُقرأ السجل ولا يُكتب في مجلد الحفظ
+      (كل الصور تُعالج).
+    - يرجع {'total', 'succeeded', 'skipped', 'failed': [(filename, error), ...]}.
+    """
+    for stage in recipe:
+        if stage[0] not in STAGES:
+            raise ValueError(f"مرحلة غير معروفة: {stage[0]}")
+    recipe = [list(stage) for stage in recipe]
+    settings_hash = recipe_hash(recipe)
+    os.makedirs(save_folder, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    manifest = BatchManifest(os.path.join(save_folder, MANIFEST_NAME)).load() if use_manifest else None
+
+    failed, skipped = [], 0
+    if not files:
+        return {'total': 0, 'succeeded': 0, 'skipped': 0, 'failed': failed}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(files)
+        pending = deque()
+
+        def submit_next():
+            source_path = next(remaining, None)
+            if source_path is None: return
+            source_path = os.path.abspath(source_path)
+            filename = os.path.basename(source_path)
+            try:
+                save_path = recipe_output(recipe, source_path, save_folder)
+                stat = os.stat(source_path)
+            except (OSError, KeyError, IndexError) as e:
+                pending.append((filename, None, None, None, f"{type(e).__name__}: {e}"))
+                return
+            entry = None if force or manifest is None else manifest.entries.get(os.path.basename(save_path))
+            if entry is not None and manifest.is_unchanged(entry, source_path, stat, settings_hash, save_path):
+                # لم يتغير شيء: لا حاجة حتى لقراءة الصورة
+                pending.append((filename, None, None, None, None))
+                return
+            previous_hash = entry['hash'] if entry and entry['params'] == settings_hash else None
+            future = pool.submit(_process_file, source_path, save_path, recipe, save_folder, previous_hash)
+            pending.append((filename, future, {'source': source_path, 'size': stat.st_size,
+                                               'mtime_ns': stat.st_mtime_ns, 'params': settings_hash,
+                                               'output': os.path.basename(save_path)}, None, None))
+
+        for _ in range(max_pending):
+            submit_next()
+        done = 0
+        try:
+            while pending:
+                filename, future, entry, _, error = pending.popleft()
+                was_skipped = future is None and error is None
+                if future is not None:
+                    digest, error, was_skipped = future.result()
+                    if error is None and manifest is not None:
+                        manifest.add({**entry, 'hash': digest})
+                submit_next()
+                done += 1
+                if error:
+                    failed.append((filename, error))
+                elif was_skipped:
+                    skipped += 1
+                if progress_callback:
+                    progress_callback(done, len(files), filename, error)
+        except BaseException:
+            for item in pending:
+                if item[1] is not None:
+                    item[1].cancel()
+            raise
+        finally:
+            if manifest is not None:
+                manifest.close()
+    return {'total': len(files), 'succeeded': len(files) - len(failed) - skipped,
+            'skipped': skipped, 'failed': failed}
+
+
+def run_batch(source_folder, watermark_path, save_folder, position="bottom_right",
+              progress_callback=None, workers=None, max_pending=None, max_size=None, force=False):
+    """
+    إضافة الشعار لكل صور المجلد (وصفة watermark_recipe). max_size: أقصى عرض/ارتفاع للصور الناتجة
+    (None = بالأبعاد الأصلية). باقي المعاملات والنتيجة كما في run_recipe.
+    """
+    # التأكد من أن الشعار صالح قبل بدء العمليات
+    with Image.open(watermark_path) as watermark:
+        watermark.verify()
+    return run_recipe(list_images(source_folder), watermark_recipe(watermark_path, position, max_size),
+                      save_folder, progress_callback, workers, max_pending, force)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="إضافة شعار مائي لكل صور مجلد")
+    parser.add_argument("source_folder")
+    parser.add_argument("watermark")
+    parser.add_argument("save_folder")
+    parser.add_argument("--position", choices=POSITIONS, default="bottom_right")
+    parser.add_argument("--workers", type=int, default=None, help="عدد العمليات (افتراضياً عدد الأنوية)")
+    parser.add_argument("--max-size", type=int, default=None, help="أقصى عرض/ارتفاع للصور الناتجة بالبكسل")
+    parser.add_argument("--force", action="store_true", help="إعادة معالجة كل الصور وتجاهل سجل التشغيلات السابقة")
+    args = parser.parse_args(argv)
+
+    def report(done, total, filename, error):
+        if error:
+            print(f"[{done}/{total}] {filename}: {error}", file=sys.stderr)
+        else:
+            print(f"[{done}/{total}] {filename}")
+
+    summary = run_batch(args.source_folder, args.watermark, args.save_folder, args.position,
+                        progress_callback=report, workers=args.workers, max_size=args.max_size,
+                        force=args.force)
+    print(f"{summary['total']} files: {summary['succeeded']} processed, {summary['skipped']} unchanged, "
+          f"{len(summary['failed'])} failed")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
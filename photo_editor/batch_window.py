@@ -2,9 +2,12 @@
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import os
 import threading
-from PIL import Image
+from .batch_engine import run_batch
+
+class BatchCancelled(Exception):
+    """تُرفع من دالة التقدم لإيقاف الدفعة عند إغلاق النافذة."""
+
 
 class BatchWindow(ctk.CTkToplevel):
     """
@@ -16,6 +19,8 @@ class BatchWindow(ctk.CTkToplevel):
         self.geometry("550x500")
         self.transient(parent)
         self.grab_set()
+        self.cancelled = False
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.setup_ui()
 
@@ -58,6 +63,11 @@ class BatchWindow(ctk.CTkToplevel):
         save_entry = ctk.CTkEntry(save_frame, textvariable=self.save_path)
         save_entry.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 5))
         ctk.CTkButton(save_frame, text="اختيار...", command=self.select_save_folder).pack(side=tk.LEFT)
+
+        # --- تصغير الصور (اختياري) ---
+        ctk.CTkLabel(main_frame, text="5. أقصى عرض/ارتفاع للصور الناتجة (اختياري):").pack(anchor=tk.W, pady=(10, 0))
+        self.max_size = tk.StringVar()
+        ctk.CTkEntry(main_frame, textvariable=self.max_size).pack(fill=tk.X, pady=5)
         
         # --- شريط التقدم والبدء ---
         self.progress_bar = ctk.CTkProgressBar(main_frame)
@@ -89,59 +99,57 @@ class BatchWindow(ctk.CTkToplevel):
         if not all([folder, watermark_file, save_folder]):
             messagebox.showerror("خطأ", "الرجاء ملء جميع الحقول", parent=self)
             return
+        max_size = self.max_size.get().strip()
+        if max_size and not (max_size.isdigit() and int(max_size) > 0):
+            messagebox.showerror("خطأ", "أقصى بعد يجب أن يكون عدداً صحيحاً موجباً", parent=self)
+            return
         
         self.start_button.configure(state="disabled", text="جاري المعالجة...")
         # تشغيل العملية في خيط منفصل لتجنب تجميد الواجهة
-        thread = threading.Thread(target=self.process_images_thread, args=(folder, watermark_file, save_folder), daemon=True)
+        thread = threading.Thread(target=self.process_images_thread, args=(folder, watermark_file, save_folder, int(max_size) if max_size else None), daemon=True)
         thread.start()
         
-    def process_images_thread(self, folder, watermark_file, save_folder):
-        try:
-            watermark = Image.open(watermark_file).convert('RGBA')
-            image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
-            image_files = [f for f in os.listdir(folder) if f.lower().endswith(image_extensions)]
-            
-            if not image_files:
-                messagebox.showwarning("تحذير", "لا توجد صور في المجلد المحدد.", parent=self)
-                self.start_button.configure(state="normal", text="بدء المعالجة")
-                return
+    def process_images_thread(self, folder, watermark_file, save_folder, max_size=None):
+        """يُنفذ في خيط منفصل: المعالجة الفعلية في محرك الدفعات، وتحديث الواجهة ينقل للخيط الرئيسي."""
+        position_choice = self.position_var.get()
 
-            total_images = len(image_files)
-            position_choice = self.position_var.get()
-            
-            for i, filename in enumerate(image_files):
-                self.progress_label.configure(text=f"جاري معالجة: {filename} ({i+1}/{total_images})")
-                
-                image_path = os.path.join(folder, filename)
-                with Image.open(image_path).convert('RGBA') as image:
-                    # تغيير حجم الشعار ليكون مناسباً (مثلاً 15% من عرض الصورة)
-                    wm_width = int(image.size[0] * 0.15)
-                    wm_height = int(watermark.size[1] * (wm_width / watermark.size[0]))
-                    wm_resized = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-                    
-                    margin = 20
-                    positions = {
-                        "top_left": (margin, margin),
-                        "top_right": (image.size[0] - wm_width - margin, margin),
-                        "bottom_left": (margin, image.size[1] - wm_height - margin),
-                        "bottom_right": (image.size[0] - wm_width - margin, image.size[1] - wm_height - margin)
-                    }
-                    pos = positions.get(position_choice)
-                    
-                    # لصق الشعار على الصورة
-                    image.paste(wm_resized, pos, wm_resized)
-                    
-                    # حفظ الصورة (مع تحويلها لـ RGB إذا كانت ستحفظ كـ JPG)
-                    save_path = os.path.join(save_folder, f"marked_{filename}")
-                    final_image = image.convert('RGB') if save_path.lower().endswith('.jpg') else image
-                    final_image.save(save_path)
+        def progress(done, total, filename, error):
+            if self.cancelled:
+                raise BatchCancelled()
+            self.after(0, lambda: self.show_progress(done, total, filename))
 
-                progress = (i + 1) / total_images
-                self.progress_bar.set(progress)
-            
-            messagebox.showinfo("نجاح", f"تمت معالجة {total_images} صورة بنجاح.", parent=self)
+        try:
+            summary = run_batch(folder, watermark_file, save_folder, position_choice,
+                                progress_callback=progress, max_size=max_size)
+        except BatchCancelled:
+            return
         except Exception as e:
-            messagebox.showerror("خطأ", f"حدث خطأ: {str(e)}", parent=self)
-        finally:
-            # التأكد من أن تدمير النافذة يحدث في الخيط الرئيسي
-            self.after(0, self.destroy)
+            message = f"حدث خطأ: {str(e)}"
+            self.after(0, lambda: self.finish(messagebox.showerror, message))
+            return
+
+        if summary['total'] == 0:
+            self.after(0, lambda: self.finish(messagebox.showwarning, "لا توجد صور في المجلد المحدد."))
+        elif summary['failed']:
+            errors = "\n".join(f"{name}: {error}" for name, error in summary['failed'][:10])
+            self.after(0, lambda: self.finish(
+                messagebox.showwarning,
+                f"تمت معالجة {summary['succeeded']} من {summary['total']} صورة (ولم تتغير {summary['skipped']}). "
+                f"فشلت {len(summary['failed'])}:\n{errors}"))
+        else:
+            self.after(0, lambda: self.finish(
+                messagebox.showinfo,
+                f"تمت معالجة {summary['succeeded']} صورة بنجاح (ولم تتغير {summary['skipped']} منذ آخر تشغيل)."))
+
+    def show_progress(self, done, total, filename):
+        self.progress_label.configure(text=f"تمت معالجة: {filename} ({done}/{total})")
+        self.progress_bar.set(done / total)
+
+    def finish(self, show_message, text):
+        show_message("نتيجة المعالجة", text, parent=self)
+        self.destroy()
+
+    def on_close(self):
+        """إغلاق النافذة أثناء المعالجة يلغي الملفات المتبقية."""
+        self.cancelled = True
+        self.destroy()
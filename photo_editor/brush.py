@@ -0,0 +1,92 @@
+# /photo_editor/brush.py
+
+import math
+from PIL import ImageDraw
+
+# حجم المربعات التي تُحفظ حالتها قبل الرسم (للتراجع)
+PATCH_TILE_SIZE = 64
+
+
+class BrushStroke:
+    """
+    ضربة فرشاة واحدة (من الضغط حتى رفع الفأرة).
+    تجمع النقاط وتنعّم المسار بينها بمنحنيات تربيعية، وترسم فقط داخل المستطيل الذي يغطيه
+    المقطع الجديد. قبل أول رسم في أي مربع تُحفظ حالته الأصلية، وعند انتهاء الضربة
+    تتحول المربعات المعدلة إلى رُقع (Patches) تُضاف للتاريخ كخطوة واحدة.
+    """
+    def __init__(self, image, size, color):
+        self.image = image
+        self.size = size
+        self.color = color
+        self.points = []
+        self.saved_tiles = {}
+        self.draw = ImageDraw.Draw(image)
+
+    def add_point(self, point):
+        """إضافة نقطة جديدة للضربة. يرجع المستطيل الذي تغير (بإحداثيات الصورة) أو None."""
+        if self.points and point == self.points[-1]: return None
+        self.points.append(point)
+
+        p = self.points
+        if len(p) == 1:
+            return self._render([point])
+        if len(p) == 2:
+            return self._render([p[0], midpoint(p[0], p[1])])
+        # منحنى من منتصف المقطع السابق إلى منتصف المقطع الحالي، والنقطة السابقة هي نقطة التحكم
+        return self._render(quadratic_curve(midpoint(p[-3], p[-2]), p[-2], midpoint(p[-2], p[-1])))
+
+    def finish(self):
+        """إنهاء الضربة. يرجع (آخر مستطيل تغير, قائمة الرُقع للتاريخ)."""
+        box = None
+        if len(self.points) >= 2:
+            box = self._render([midpoint(self.points[-2], self.points[-1]), self.points[-1]])
+
+        patches = []
+        for box_tile, before in self.saved_tiles.values():
+            patches.append((self.image, box_tile, before, self.image.crop(box_tile)))
+        self.saved_tiles = {}
+        return box, patches
+
+    def _render(self, path):
+        """رسم مسار (خط بنهايات دائرية) بعد حفظ المربعات التي سيغيرها لأول مرة."""
+        radius = self.size / 2
+        xs = [pt[0] for pt in path]
+        ys = [pt[1] for pt in path]
+        box = (max(0, int(min(xs) - radius - 1)), max(0, int(min(ys) - radius - 1)),
+               min(self.image.width, int(max(xs) + radius + 2)),
+               min(self.image.height, int(max(ys) + radius + 2)))
+        if box[0] >= box[2] or box[1] >= box[3]: return None
+
+        self._save_tiles(box)
+        if len(path) > 1:
+            self.draw.line(path, fill=self.color, width=self.size, joint='curve')
+        for x, y in (path[0], path[-1]):
+            self.draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=self.color)
+        return box
+
+    def _save_tiles(self, box):
+        """حفظ الحالة الأصلية للمربعات التي يلمسها المستطيل لأول مرة في هذه الضربة."""
+        ts = PATCH_TILE_SIZE
+        for ty in range(box[1] // ts, (box[3] - 1) // ts + 1):
+            for tx in range(box[0] // ts, (box[2] - 1) // ts + 1):
+                if (tx, ty) in self.saved_tiles: continue
+                tile_box = (tx * ts, ty * ts, min((tx + 1) * ts, self.image.width),
+                            min((ty + 1) * ts, self.image.height))
+                self.saved_tiles[(tx, ty)] = (tile_box, self.image.crop(tile_box))
+
+
+def midpoint(a, b):
+    return ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+
+
+def quadratic_curve(start, control, end):
+    """تقسيم منحنى بيزيه تربيعي إلى نقاط متقاربة (كل 4 بكسل تقريباً)."""
+    length = math.dist(start, control) + math.dist(control, end)
+    steps = max(2, int(length / 4))
+    points = []
+    for i in range(steps + 1):
+        t = i / steps
+        u = 1 - t
+        points.append((u * u * start[0] + 2 * u * t * control[0] + t * t * end[0],
+                       u * u * start[1] + 2 * u * t * control[1] + t * t * end[1]))
+    return points
@@ -0,0 +1,193 @@
+# /photo_editor/compositor.py
+
+from functools import lru_cache
+from PIL import Image
+
+# حجم المربع (Tile) بالبكسل
+TILE_SIZE = 256
+
+
+class TileCompositor:
+    """
+    محرك دمج الطبقات على شكل مربعات (Tiles).
+    يقسم الصورة إلى مربعات ثابتة الحجم، ويتتبع المربعات التي تغيرت (المتسخة)،
+    ويعيد دمج هذه المربعات فقط مع الاحتفاظ بآخر صورة مدمجة بين الاستدعاءات.
+
+    أثناء التعديل التفاعلي لطبقة واحدة (الطبقة النشطة) يحتفظ أيضاً بنسختين مسطحتين:
+    كل ما تحت الطبقة النشطة وكل ما فوقها، فيكلف كل تحديث دمج الطبقة النشطة مرة واحدة فقط.
+    """
+    def __init__(self, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.composite = None
+        self.dirty_tiles = set()
+        self.all_dirty = True
+        # المناطق التي أعيد دمجها في آخر استدعاء (None = الصورة كاملة)
+        self.changed_boxes = None
+
+        # --- ذاكرة الطبقات المسطحة حول الطبقة النشطة ---
+        self.active_index = None
+        self.below = None
+        self.above = None
+        self.stack_cache_valid = False
+        self.only_active_dirty = True
+
+    # --- دوال تتبع المناطق المتسخة ---
+    def invalidate(self, box=None, layer_index=None):
+        """
+        تعليم منطقة (x1, y1, x2, y2) كمنطقة تحتاج إعادة دمج. بدون box يتم تعليم الصورة كاملة.
+        layer_index هو رقم الطبقة التي تغيرت؛ أي تغيير خارج الطبقة النشطة يلغي الطبقات المسطحة.
+        """
+        if layer_index is None or layer_index != self.active_index:
+            self.stack_cache_valid = False
+            self.only_active_dirty = False
+
+        if box is None:
+            self.all_dirty = True
+            return
+        if self.all_dirty: return
+
+        x1, y1, x2, y2 = box
+        if x2 <= x1 or y2 <= y1: return
+        ts = self.tile_size
+        for ty in range(max(0, int(y1) // ts), int(y2 - 1) // ts + 1):
+            for tx in range(max(0, int(x1) // ts), int(x2 - 1) // ts + 1):
+                self.dirty_tiles.add((tx, ty))
+
+    def invalidate_layer(self, layer, layer_index=None):
+        """تعليم المنطقة التي تغطيها طبقة معينة."""
+        self.invalidate(layer_box(layer), layer_index)
+
+    def set_active_layer(self, layer_index):
+        """تحديد الطبقة التي يتم تعديلها تفاعلياً (يلغي الطبقات المسطحة إذا تغيرت)."""
+        if layer_index != self.active_index:
+            self.active_index = layer_index
+            self.stack_cache_valid = False
+            self.only_active_dirty = False
+
+    # --- دالة الدمج ---
+    def render(self, layers, region=None):
+        """
+        إعادة دمج المربعات المتسخة فقط وإرجاع الصورة المدمجة المخزنة (يجب عدم تعديلها).
+        region (x1, y1, x2, y2): دمج المربعات المتسخة داخل هذه المنطقة فقط (الجزء الظاهر في العرض)،
+        وباقي المربعات تبقى متسخة حتى تُطلب، فالصورة المرجعة صحيحة داخل region فقط.
+        """
+        if not layers: return None
+
+        size = layers[0]['image'].size
+        if self.composite is None or self.composite.size != size:
+            self.composite = Image.new('RGBA', size, (0, 0, 0, 0))
+            self.all_dirty = True
+            self.stack_cache_valid = False
+
+        ts = self.tile_size
+        columns = (size[0] + ts - 1) // ts
+        rows = (size[1] + ts - 1) // ts
+        if region is not None and self.all_dirty:
+            # الدمج الجزئي يحتاج قائمة المربعات المتسخة صراحة (ما لم يُدمج الآن يبقى فيها)
+            self.dirty_tiles = {(tx, ty) for ty in range(rows) for tx in range(columns)}
+            self.all_dirty = False
+        if self.all_dirty:
+            tiles = [(tx, ty) for ty in range(rows) for tx in range(columns)]
+            self.changed_boxes = None
+        else:
+            tiles = [(tx, ty) for tx, ty in self.dirty_tiles if tx < columns and ty < rows]
+            if region is not None:
+                tiles = [(tx, ty) for tx, ty in tiles
+                         if tx * ts < region[2] and (tx + 1) * ts > region[0]
+                         and ty * ts < region[3] and (ty + 1) * ts > region[1]]
+            self.changed_boxes = []
+
+        # إذا كانت التغييرات كلها في الطبقة النشطة نستخدم الطبقات المسطحة
+        use_stack = (tiles and self.only_active_dirty and not self.all_dirty
+                     and self.active_index is not None and 0 <= self.active_index < len(layers))
+        if use_stack and not self.stack_cache_valid:
+            self._build_stack_cache(layers, size)
+
+        for tx, ty in tiles:
+            box = (tx * ts, ty * ts, min((tx + 1) * ts, size[0]), min((ty + 1) * ts, size[1]))
+            if use_stack:
+                tile = self._render_tile_from_stack(layers[self.active_index], box)
+            else:
+                tile = self._render_tile(layers, box)
+            self.composite.paste(tile, box[:2])
+            if self.changed_boxes is not None:
+                self.changed_boxes.append(box)
+
+        if region is None:
+            self.dirty_tiles.clear()
+        else:
+            self.dirty_tiles.difference_update(tiles)
+        self.all_dirty = False
+        # المربعات المتبقية قد تكون تغيرت خارج الطبقة النشطة
+        self.only_active_dirty = not self.dirty_tiles
+        return self.composite
+
+    def _render_tile(self, layers, box):
+        """دمج جزء الطبقات المرئية الذي يقع داخل مربع واحد."""
+        tile = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        for layer in layers:
+            blend_layer(tile, layer, box)
+        return tile
+
+    def _render_tile_from_stack(self, active_layer, box):
+        """دمج مربع واحد كـ: (ما تحت) + الطبقة النشطة + (ما فوق)."""
+        if self.below is not None:
+            tile = self.below.crop(box)
+        else:
+            tile = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        blend_layer(tile, active_layer, box)
+        if self.above is not None:
+            tile.alpha_composite(self.above, source=box)
+        return tile
+
+    def _build_stack_cache(self, layers, size):
+        """تسطيح الطبقات تحت الطبقة النشطة وفوقها في صورتين منفصلتين."""
+        index = self.active_index
+        self.below = flatten_layers(layers[:index], size) if index > 0 else None
+        self.above = flatten_layers(layers[index + 1:], size) if index < len(layers) - 1 else None
+        self.stack_cache_valid = True
+
+
+def layer_box(layer):
+    """حساب المستطيل الذي تغطيه الطبقة على الكانفاس."""
+    width, height = layer['image'].size
+    return (layer['x'], layer['y'], layer['x'] + width, layer['y'] + height)
+
+
+def blend_layer(target, layer, box):
+    """
+    دمج جزء الطبقة الواقع داخل box فوق الصورة target (التي تمثل المنطقة box)
+    باستخدام عملية "over" حتى يمكن تسطيح مجموعة طبقات ثم دمجها لاحقاً بنفس النتيجة.
+    """
+    if not layer['visible']: return
+
+    lx1, ly1, lx2, ly2 = layer_box(layer)
+    x1, y1 = max(box[0], lx1), max(box[1], ly1)
+    x2, y2 = min(box[2], lx2), min(box[3], ly2)
+    if x1 >= x2 or y1 >= y2: return
+
+    source = (x1 - lx1, y1 - ly1, x2 - lx1, y2 - ly1)
+    dest = (x1 - box[0], y1 - box[1])
+    if layer['opacity'] < 1.0:
+        # قص الجزء المطلوب فقط وضرب قناة الشفافية في العتامة بجدول بحث بمرور واحد
+        region = layer['image'].crop(source).point(opacity_lut(layer['opacity']))
+        target.alpha_composite(region, dest)
+    else:
+        # بدون نسخ: الدمج مباشرة من الطبقة
+        target.alpha_composite(layer['image'], dest, source)
+
+
+@lru_cache(maxsize=64)
+def opacity_lut(opacity):
+    """جدول بحث لصورة RGBA يترك الألوان كما هي ويضرب الشفافية في opacity (بنفس تقريب ImageEnhance)."""
+    identity = list(range(256))
+    alpha = [min(255, max(0, int(a * opacity))) for a in identity]
+    return identity * 3 + alpha
+
+
+def flatten_layers(layers, size):
+    """دمج مجموعة طبقات في صورة واحدة شفافة بحجم الكانفاس."""
+    flat = Image.new('RGBA', size, (0, 0, 0, 0))
+    for layer in layers:
+        blend_layer(flat, layer, (0, 0, size[0], size[1]))
+    return flat
@@ -0,0 +1,93 @@
+# /photo_editor/executor.py
+
+import threading
+
+
+class OperationCancelled(Exception):
+    """تُرفع داخل العملية (من دالة التقدم) عندما يتم إلغاؤها."""
+
+
+class OperationExecutor:
+    """
+    منفذ العمليات الثقيلة في الخلفية لمحرر الصور.
+    العملية (Job) هي (compute, commit): compute(progress_callback) تُنفذ في خيط منفصل ولا تعدل حالة
+    النموذج، و commit(result) تُنفذ في الخيط الرئيسي لتطبيق النتيجة.
+
+    - عملية واحدة فقط تعمل في أي وقت (Single-flight) وطلب واحد فقط ينتظر بعدها:
+      أي طلب جديد يستبدل الطلب المنتظر (لأنه أحدث منه).
+    - الطلب المنتظر لا يُجهز إلا عند بدء تنفيذه، فيُحسب من حالة النموذج بعد العملية السابقة.
+    - الإلغاء: تُرفع OperationCancelled عند أول تقرير تقدم بعد الإلغاء، وتُتجاهل نتيجة أي عملية ملغاة.
+    - التقدم والنتيجة والأخطاء تُنقل للخيط الرئيسي عبر schedule (مثل widget.after).
+    """
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.running = None
+        self.pending = None
+
+    def submit(self, make_job, on_done=None, on_progress=None, on_error=None):
+        """
+        طلب عملية جديدة (من الخيط الرئيسي فقط).
+        make_job() يرجع (compute, commit) أو None إذا لم يعد هناك ما يُنفذ.
+        """
+        request = {
+            'make_job': make_job, 'on_done': on_done, 'on_progress': on_progress,
+            'on_error': on_error, 'cancelled': False,
+        }
+        if self.running:
+            self.pending = request
+        else:
+            self._start(request)
+
+    def cancel(self):
+        """إلغاء العملية الجارية والطلب المنتظر."""
+        if self.running:
+            self.running['cancelled'] = True
+        self.pending = None
+
+    def is_busy(self):
+        return self.running is not None and not self.running['cancelled']
+
+    def _start(self, request):
+        job = request['make_job']()
+        if job is None:
+            if request['on_done']:
+                request['on_done'](None)
+            return
+        compute, commit = job
+        request['commit'] = commit
+        self.running = request
+
+        def report(progress):
+            if request['cancelled']:
+                raise OperationCancelled()
+            if request['on_progress']:
+                self.schedule(lambda: request['cancelled'] or request['on_progress'](progress))
+
+        def worker():
+            result, error = None, None
+            try:
+                result = compute(report)
+            except OperationCancelled:
+                pass
+            except Exception as e:
+                error = e
+            self.schedule(lambda: self._finish(request, result, error))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def _finish(self, request, result, error):
+        """يُنفذ في الخيط الرئيسي بعد انتهاء العملية، ثم يبدأ الطلب المنتظر إن وجد."""
+        self.running = None
+        if not request['cancelled']:
+            if error is not None:
+                if request['on_error']:
+                    request['on_error'](error)
+            else:
+                committed = request['commit'](result)
+                if request['on_done']:
+                    request['on_done'](committed)
+
+        if self.pending and not self.running:
+            request, self.pending = self.pending, None
+            self._start(request)
@@ -0,0 +1,90 @@
+# /photo_editor/export.py
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+
+# صيغ الحفظ حسب الامتداد، والصيغ التي لا تدعم الشفافية
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'BMP': '.bmp'}
+OPAQUE_FORMATS = {'JPEG', 'BMP'}
+# خيارات الترميز الافتراضية لكل صيغة
+FORMAT_OPTIONS = {'JPEG': {'optimize': True}, 'WEBP': {'method': 4}}
+
+# مجموعة تصدير للويب: الصورة كاملة (2x) ونصفها (1x) بصيغتي JPEG و WebP، وصورة مصغرة
+WEB_EXPORT_TARGETS = [
+    {'name': 'full', 'format': 'JPEG', 'quality': 90},
+    {'name': '2x', 'format': 'WEBP', 'quality': 82},
+    {'name': '1x', 'format': 'WEBP', 'quality': 80, 'scale': 0.5},
+    {'name': '1x', 'format': 'JPEG', 'quality': 85, 'scale': 0.5},
+    {'name': 'thumb', 'format': 'JPEG', 'quality': 80, 'max_size': (320, 320)},
+]
+
+
+def target_size(size, target):
+    """أبعاد الصورة لهدف تصدير: scale نسبة من الأبعاد، و max_size حد أقصى مع الحفاظ على النسبة."""
+    width, height = size
+    scale = target.get('scale', 1.0)
+    if 'max_size' in target:
+        max_width, max_height = target['max_size']
+        scale = min(scale, max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def target_path(folder, base_name, target):
+    return os.path.join(folder, f"{base_name}_{target['name']}{FORMAT_EXTENSIONS[target['format']]}")
+
+
+def encode_target(image, target, path):
+    """تصغير الصورة (إن لزم) وترميزها لهدف واحد. يرجع (الحجم بالبايت, الزمن بالثواني)."""
+    start = time.perf_counter()
+    size = target_size(image.size, target)
+    if size != image.size:
+        factor = image.width // size[0]
+        if factor > 1 and image.width == size[0] * factor and image.height == size[1] * factor:
+            image = image.reduce(factor)
+        else:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+    if target['format'] in OPAQUE_FORMATS and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    options = dict(FORMAT_OPTIONS.get(target['format'], {}))
+    if 'quality' in target:
+        options['quality'] = target['quality']
+    image.save(path, target['format'], **options)
+    return os.path.getsize(path), time.perf_counter() - start
+
+
+def export_targets(image, targets, folder, base_name, max_workers=None, progress_callback=None):
+    """
+    ترميز صورة واحدة (مدمجة مسبقاً) لعدة أهداف بالتوازي.
+    الخيوط كافية هنا لأن Pillow يحرر الـ GIL أثناء التصغير والترميز.
+    يرجع قائمة نتائج بنفس ترتيب الأهداف: {'target', 'path', 'bytes', 'seconds'}.
+    """
+    results = [None] * len(targets)
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, min(len(targets), os.cpu_count() or 1))) as pool:
+        futures = {}
+        for i, target in enumerate(targets):
+            path = target_path(folder, base_name, target)
+            futures[pool.submit(encode_target, image, target, path)] = (i, target, path)
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                i, target, path = futures[future]
+                size, seconds = future.result()
+                results[i] = {'target': target, 'path': path, 'bytes': size, 'seconds': seconds}
+                if progress_callback:
+                    progress_callback(done / len(targets))
+        except BaseException:
+            # عند الإلغاء أو الخطأ لا تبدأ الأهداف المتبقية
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
+
+def format_report(results):
+    """نص مختصر لنتائج التصدير (اسم الملف، الحجم، الزمن)."""
+    lines = []
+    for result in results:
+        lines.append(f"{os.path.basename(result['path'])}: {result['bytes'] / 1024:.1f} KB، {result['seconds']:.2f} ث")
+    return "\n".join(lines)
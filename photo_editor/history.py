@@ -0,0 +1,282 @@
+# /photo_editor/history.py
+
+import mmap
+import tempfile
+import zlib
+from PIL import Image
+
+# الحد الافتراضي لحجم التاريخ في الذاكرة (بالبايت)
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+class History:
+    """
+    نظام التاريخ (التراجع/الإعادة) لمحرر الصور.
+    بدلاً من نسخ كل الطبقات نسخاً عميقاً في كل خطوة، تحفظ كل خطوة نسخة سطحية من قائمة الطبقات
+    تشارك نفس كائنات الصور (نسخ عند الكتابة: العمليات تستبدل الصورة بصورة جديدة ولا تعدل القديمة).
+    التعديلات التي تكتب داخل الصورة نفسها (مثل الرسم) تُحفظ كرُقع (Patches) تحتوي فقط على
+    المنطقة التي تغيرت قبل التعديل وبعده.
+
+    عند تجاوز حجم البيانات في الذاكرة للحد المسموح (memory_budget) تُحذف أولاً النتائج الأقدم استخداماً
+    من ذاكرة سلاسل العمليات (cache، وحجمها جزء من الحد)، ثم الصور المشتقة (نتائج سلسلة عمليات الطبقة
+    التي يمكن إعادة حسابها من source و ops، وتصبح None)، ثم تُضغط الصور الأقدم وتُنقل إلى ملف مؤقت
+    على القرص وتُقرأ من جديد (عبر mmap) عند الرجوع إليها.
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, cache=None):
+        self.entries = []
+        self.index = -1
+        self.memory_budget = memory_budget
+        self.spill_store = None
+        # OpStackCache (اختياري) تُحسب صوره ضمن الحد
+        self.cache = cache
+
+    def clear(self):
+        """حذف كل الخطوات."""
+        self.entries = []
+        self.index = -1
+        if self.spill_store:
+            self.spill_store.close()
+            self.spill_store = None
+
+    def set_memory_budget(self, memory_budget):
+        """تغيير الحد الأقصى لحجم التاريخ في الذاكرة (None = بدون حد)."""
+        self.memory_budget = memory_budget
+        self.enforce_budget()
+
+    def push(self, layers, patches=None, document=None):
+        """
+        إضافة الحالة الحالية كخطوة جديدة.
+        patches: قائمة رُقع (image, box, before, after) للتعديلات التي تمت داخل الصور للوصول لهذه الحالة.
+        document: خصائص المستند التي ليست جزءاً من الطبقات (مثل الاتجاه).
+        """
+        if self.index < len(self.entries) - 1:
+            del self.entries[self.index + 1:]
+        self.entries.append({
+            'layers': snapshot_layers(layers),
+            'patches': patches or [],
+            'document': dict(document or {}),
+        })
+        self.index += 1
+        self.enforce_budget()
+
+    def can_undo(self):
+        return self.index > 0
+
+    def can_redo(self):
+        return self.index < len(self.entries) - 1
+
+    def undo(self):
+        """الرجوع خطوة. يرجع (الطبقات, الرُقع التي طُبقت, خصائص المستند) أو None إذا لم يكن ذلك ممكناً."""
+        if not self.can_undo(): return None
+        self.load_entries(self.entries[self.index], self.entries[self.index - 1])
+        patches = self.entries[self.index]['patches']
+        # إرجاع المناطق المعدلة لحالتها السابقة بالترتيب العكسي
+        for image, box, before, after in reversed(patches):
+            image.paste(before, box[:2])
+        self.index -= 1
+        layers = snapshot_layers(self.entries[self.index]['layers'])
+        document = dict(self.entries[self.index]['document'])
+        self.enforce_budget()
+        return layers, patches, document
+
+    def redo(self):
+        """التقدم خطوة. يرجع (الطبقات, الرُقع التي طُبقت, خصائص المستند) أو None إذا لم يكن ذلك ممكناً."""
+        if not self.can_redo(): return None
+        self.load_entries(self.entries[self.index + 1])
+        self.index += 1
+        patches = self.entries[self.index]['patches']
+        for image, box, before, after in patches:
+            image.paste(after, box[:2])
+        layers = snapshot_layers(self.entries[self.index]['layers'])
+        document = dict(self.entries[self.index]['document'])
+        self.enforce_budget()
+        return layers, patches, document
+
+    def memory_usage(self):
+        """
+        حساب حجم بيانات البكسلات التي يحتفظ بها التاريخ (وذاكرة سلاسل العمليات) في الذاكرة بالبايت
+        (الصور المشتركة تُحسب مرة واحدة، والصور المنقولة للقرص لا تُحسب).
+        """
+        seen = set()
+        total = 0
+        images = [image for entry in self.entries for image in entry_images(entry)]
+        if self.cache is not None:
+            images += [image for key, image in self.cache.images()]
+        for image in images:
+            if id(image) not in seen and not isinstance(image, SpilledImage):
+                seen.add(id(image))
+                total += image_nbytes(image)
+        return total
+
+    def disk_usage(self):
+        """حجم البيانات المضغوطة المنقولة إلى القرص بالبايت."""
+        return self.spill_store.size if self.spill_store else 0
+
+    # --- دوال النقل إلى القرص ---
+    def enforce_budget(self):
+        """نقل أقدم الصور إلى القرص (مضغوطة) حتى يصبح حجم التاريخ في الذاكرة ضمن الحد."""
+        if self.memory_budget is None or not self.entries: return
+        usage = self.memory_usage()
+        if usage <= self.memory_budget: return
+
+        # صور الحالة الحالية مستخدمة في التحرير ولا يمكن نقلها
+        live = set()
+        for layer in self.entries[self.index]['layers']:
+            live.update((id(layer['image']), id(layer['source'])))
+
+        usage = self.trim_cache(usage)
+        if usage <= self.memory_budget: return
+        usage = self.drop_derived_images(live, usage)
+        if usage <= self.memory_budget: return
+
+        spilled = {}
+        for entry in self.entries:
+            for image in entry_images(entry):
+                if usage <= self.memory_budget: break
+                if id(image) in live or id(image) in spilled or isinstance(image, SpilledImage):
+                    continue
+                if self.spill_store is None:
+                    self.spill_store = SpillStore()
+                spilled[id(image)] = SpilledImage(self.spill_store, image)
+                usage -= image_nbytes(image)
+            if usage <= self.memory_budget: break
+        self.replace_images(spilled)
+
+    def trim_cache(self, usage):
+        """
+        حذف نتائج ذاكرة سلاسل العمليات (الأقدم استخداماً أولاً) حتى يصبح الحجم ضمن الحد. يرجع الحجم الجديد.
+        الصورة لا يقل الحجم بحذفها إذا كانت مستخدمة في التاريخ أو محفوظة في الذاكرة بمفتاح آخر.
+        """
+        if self.cache is None: return usage
+        referenced = {id(image) for entry in self.entries for image in entry_images(entry)}
+        cached = self.cache.images()
+        remaining = {}
+        for key, image in cached:
+            remaining[id(image)] = remaining.get(id(image), 0) + 1
+        for key, image in cached:
+            if usage <= self.memory_budget: break
+            self.cache.remove(key)
+            remaining[id(image)] -= 1
+            if not remaining[id(image)] and id(image) not in referenced:
+                usage -= image_nbytes(image)
+        return usage
+
+    def drop_derived_images(self, live, usage):
+        """
+        حذف الصور المشتقة من سلسلة العمليات (الأقدم أولاً) حتى يصبح الحجم ضمن الحد. يرجع الحجم الجديد.
+        لا تُحذف صورة إذا كانت مستخدمة كصورة أصلية أو في رُقعة، لأنها عندها لا يمكن إعادة حسابها.
+        """
+        needed = set(live)
+        for entry in self.entries:
+            for layer in entry['layers']:
+                needed.add(id(layer['source']))
+            for patch in entry['patches']:
+                needed.update(id(part) for part in patch if not isinstance(part, tuple))
+
+        dropped = {}
+        for entry in self.entries:
+            for layer in entry['layers']:
+                if usage <= self.memory_budget: break
+                image = layer['image']
+                if not layer['ops'] or image is None or id(image) in needed or id(image) in dropped:
+                    continue
+                dropped[id(image)] = None
+                if not isinstance(image, SpilledImage):
+                    usage -= image_nbytes(image)
+            if usage <= self.memory_budget: break
+        self.replace_images(dropped)
+        if self.cache is not None:
+            # الذاكرة لا يجب أن تحتفظ بالصور التي حُذفت لتوفير المساحة
+            for key, image in self.cache.images():
+                if id(image) in dropped:
+                    self.cache.remove(key)
+        return usage
+
+    def load_entries(self, *entries):
+        """إعادة الصور المنقولة للقرص في خطوات معينة إلى الذاكرة."""
+        loaded = {}
+        for entry in entries:
+            for image in entry_images(entry):
+                if isinstance(image, SpilledImage) and id(image) not in loaded:
+                    loaded[id(image)] = image.load()
+        self.replace_images(loaded)
+
+    def replace_images(self, replacements):
+        """استبدال مراجع الصور في كل الخطوات (بالمعرف id) حتى تبقى الصور مشتركة."""
+        if not replacements: return
+        for entry in self.entries:
+            for layer in entry['layers']:
+                layer['image'] = replacements.get(id(layer['image']), layer['image'])
+                layer['source'] = replacements.get(id(layer['source']), layer['source'])
+            entry['patches'] = [
+                tuple(replacements.get(id(part), part) if i != 1 else part for i, part in enumerate(patch))
+                for patch in entry['patches']
+            ]
+
+
+class SpillStore:
+    """ملف مؤقت يُضاف إليه فقط، تُقرأ البيانات منه عبر mmap."""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix='studio_history_')
+        self.size = 0
+        self.map = None
+
+    def write(self, data):
+        """كتابة بيانات في نهاية الملف وإرجاع موضعها."""
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        """قراءة جزء من الملف عبر mmap (يُعاد إنشاؤه إذا كبر الملف)."""
+        if self.map is None or len(self.map) < offset + length:
+            self.file.flush()
+            if self.map: self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def close(self):
+        if self.map: self.map.close()
+        self.file.close()
+
+
+class SpilledImage:
+    """مرجع لصورة مضغوطة محفوظة في SpillStore بدلاً من الذاكرة."""
+    def __init__(self, store, image):
+        self.store = store
+        self.mode = image.mode
+        self.size = image.size
+        data = zlib.compress(image.tobytes(), 1)
+        self.offset = store.write(data)
+        self.length = len(data)
+
+    def load(self):
+        """فك ضغط الصورة وإرجاعها ككائن PIL جديد."""
+        data = zlib.decompress(self.store.read(self.offset, self.length))
+        return Image.frombytes(self.mode, self.size, data)
+
+
+def snapshot_layers(layers):
+    """نسخة سطحية من قائمة الطبقات: خصائص كل طبقة تُنسخ والصور تُشارك."""
+    return [dict(layer) for layer in layers]
+
+
+def entry_images(entry):
+    """كل الصور التي تشير إليها خطوة واحدة (صور الطبقات وصورها الأصلية وصور الرُقع)."""
+    for layer in entry['layers']:
+        if layer['image'] is not None:
+            yield layer['image']
+        if layer['source'] is not layer['image']:
+            yield layer['source']
+    for image, box, before, after in entry['patches']:
+        yield image
+        yield before
+        yield after
+
+
+def image_nbytes(image):
+    """تقدير حجم بيانات صورة في الذاكرة بالبايت."""
+    width, height = image.size
+    return width * height * len(image.getbands())
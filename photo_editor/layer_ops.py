@@ -0,0 +1,120 @@
+# /photo_editor/layer_ops.py
+
+from collections import OrderedDict
+from PIL import ImageFilter
+from .adjustments import adjust_image
+from .orientation import IDENTITY, inverse, orient_image
+
+# الفلاتر المتاحة بأسمائها (الاسم هو ما يُحفظ في سلسلة العمليات)
+FILTERS = {
+    'blur': ImageFilter.BLUR,
+    'sharpen': ImageFilter.SHARPEN,
+    'find_edges': ImageFilter.FIND_EDGES,
+    'emboss': ImageFilter.EMBOSS,
+    'contour': ImageFilter.CONTOUR,
+}
+
+# فلاتر غير متماثلة (تتغير نتيجتها بالتدوير أو القلب)، فتُطبق في اتجاه العرض الذي اختيرت فيه
+ORIENTED_FILTERS = {'emboss'}
+
+
+
+def apply_op(image, op, progress_callback=None):
+    """
+    تطبيق عملية واحدة على صورة وإرجاع صورة جديدة.
+    العملية tuple أول عنصر فيها نوعها: ('filter', name[, orientation]) أو ('adjust', b, c, s, sh)
+    أو ('threshold', value).
+    """
+    kind = op[0]
+    if kind == 'filter':
+        orientation = op[2] if len(op) > 2 else IDENTITY
+        image = orient_image(image, orientation).filter(FILTERS[op[1]])
+        return orient_image(image, inverse(orientation))
+    if kind == 'adjust':
+        return adjust_image(image, *op[1:], progress_callback=progress_callback)
+    if kind == 'threshold':
+        value = op[1]
+        table = [255 if p > value else 0 for p in range(256)]
+        return image.convert("L").point(table, '1').convert("RGBA")
+    raise ValueError(f"عملية غير معروفة: {kind}")
+
+
+def filter_op(filter_name, orientation=IDENTITY):
+    """عملية فلتر؛ الفلاتر غير المتماثلة تحفظ اتجاه العرض الحالي حتى تظهر كما اختارها المستخدم."""
+    if filter_name in ORIENTED_FILTERS and orientation != IDENTITY:
+        return ('filter', filter_name, orientation)
+    return ('filter', filter_name)
+
+
+def describe_op(op):
+    """وصف مختصر للعملية لعرضه في الواجهة."""
+    kind = op[0]
+    if kind == 'filter':
+        return f"فلتر: {op[1]}"
+    if kind == 'adjust':
+        return "تعديلات: " + ", ".join(f"{value:.2f}" for value in op[1:])
+    if kind == 'threshold':
+        return f"عتبة: {int(op[1])}"
+    return str(op)
+
+
+class OpStackCache:
+    """
+    ذاكرة النتائج الوسيطة لسلاسل العمليات.
+    لكل صورة أصلية (source) تُحفظ نتيجة كل بادئة من سلسلة العمليات، فعند تغيير أو حذف
+    عملية يُعاد الحساب من أول عملية تغيرت فقط.
+    حجمها يُحسب ضمن حد ذاكرة التاريخ (History)، وعند تجاوزه تُحذف النتائج الأقدم استخداماً أولاً.
+    """
+    def __init__(self):
+        # (id(source), ops_prefix) -> (source, image)، الأقدم استخداماً أولاً
+        self.results = OrderedDict()
+
+    def evaluate(self, source, ops):
+        """حساب نتيجة تطبيق ops على source بدءاً من أطول بادئة محفوظة."""
+        ops = tuple(ops)
+        if not ops: return source
+
+        image, start = source, len(ops)
+        while start > 0:
+            cached = self._get(source, ops[:start])
+            if cached is not None:
+                image = cached
+                break
+            start -= 1
+        for i in range(start, len(ops)):
+            image = apply_op(image, ops[i])
+            self.store(source, ops[:i + 1], image)
+        return image
+
+    def store(self, source, ops, image):
+        """حفظ نتيجة حُسبت خارج الذاكرة (مثلاً في خيط منفصل)."""
+        if ops:
+            key = (id(source), tuple(ops))
+            self.results.pop(key, None)
+            self.results[key] = (source, image)
+
+    def discard(self, image):
+        """
+        حذف كل ما يعتمد على صورة ستُعدل في مكانها (رسم، رُقع التاريخ):
+        النتائج المحسوبة منها كصورة أصلية، وأي نتيجة هي نفس الصورة.
+        """
+        for key in [key for key, (source, result) in self.results.items()
+                    if source is image or result is image]:
+            del self.results[key]
+
+    def clear(self):
+        self.results.clear()
+
+    def images(self):
+        """الصور المحفوظة من الأقدم استخداماً إلى الأحدث: [(key, image)]."""
+        return [(key, result) for key, (source, result) in self.results.items()]
+
+    def remove(self, key):
+        self.results.pop(key, None)
+
+    def _get(self, source, ops):
+        entry = self.results.get((id(source), ops))
+        if entry is None or entry[0] is not source:
+            return None
+        self.results.move_to_end((id(source), ops))
+        return entry[1]
@@ -0,0 +1,150 @@
+# /photo_editor/macro.py
+
+import json
+from .compositor import flatten_layers
+from .layer_ops import apply_op
+from .project_file import op_from_json
+from .text_render import render_text
+from . import orientation as orient
+
+# امتداد ملفات الماكرو (JSON)
+MACRO_EXTENSION = ".macro"
+MACRO_VERSION = 1
+
+# الماكرو قائمة خطوات، كل خطوة قائمة أول عنصر فيها نوعها. الطبقات تُعرف برقم ثابت داخل الماكرو
+# (0 = الصورة الأساسية، وكل طبقة نص تُضاف أثناء التسجيل تأخذ رقماً جديداً)، والمواضع والمستطيلات
+# نسب من أبعاد المستند وحجم النص نسبة من أصغر بعديه، فتناسب الخطوات صوراً بأبعاد مختلفة:
+#   ['op', layer, op]                                 إضافة عملية (فلتر، تعديلات، عتبة) لسلسلة عمليات طبقة
+#   ['remove_op', layer, op_index]                    حذف عملية من السلسلة
+#   ['transform', operation]                          تدوير أو قلب المستند
+#   ['crop', [x1, y1, x2, y2] | None]                 مستطيل القص (None = إلغاء القص)
+#   ['text', layer, text, size, color, x, y]          إضافة طبقة نص (معتدلة في اتجاه العرض الحالي)
+#   ['edit_text', layer, text, size, color]           تغيير نص طبقة نص
+#   ['move', layer, x, y]                             موضع طبقة
+#   ['opacity', layer, opacity]                       شفافية طبقة
+#   ['remove_layer', layer]                           حذف طبقة
+#   ['flatten_crop']                                  تثبيت القص (أبعاد المستند تصبح أبعاد مستطيل القص)
+
+# الخطوات التي عنصرها الثاني رقم طبقة
+MACRO_LAYER_STEPS = {'op', 'remove_op', 'edit_text', 'move', 'opacity', 'remove_layer'}
+
+
+def relative_box(box, size):
+    width, height = size
+    return [box[0] / width, box[1] / height, box[2] / width, box[3] / height]
+
+
+def absolute_box(box, size):
+    """مستطيل بالبكسل من مستطيل نسبي (بعرض وارتفاع بكسل واحد على الأقل داخل الصورة)."""
+    width, height = size
+    x1 = min(width - 1, max(0, round(box[0] * width)))
+    y1 = min(height - 1, max(0, round(box[1] * height)))
+    return x1, y1, max(x1 + 1, min(width, round(box[2] * width))), max(y1 + 1, min(height, round(box[3] * height)))
+
+
+def relative_text_size(size, document_size):
+    return size / min(document_size)
+
+
+def text_size(ratio, document_size):
+    return max(1, round(ratio * min(document_size)))
+
+
+def save_macro(path, steps):
+    with open(path, "w", encoding='utf-8') as f:
+        json.dump({'version': MACRO_VERSION, 'steps': steps}, f, ensure_ascii=False, indent=1)
+
+
+def load_macro(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != MACRO_VERSION:
+        raise ValueError("إصدار ملف الماكرو غير مدعوم")
+    return data['steps']
+
+
+def _text_image(text, ratio, color, document_size, orientation):
+    # طبقة النص تُدار بعكس اتجاه المستند حتى تظهر معتدلة (كما في PhotoModel.place_upright)
+    image = render_text(text, text_size(ratio, document_size), tuple(color))
+    return orient.orient_image(image, orient.inverse(orientation))
+
+
+def _evaluate(layer):
+    layer['image'] = layer['source']
+    for op in layer['ops']:
+        layer['image'] = apply_op(layer['image'], op)
+    return layer['image']
+
+
+def _flatten_crop(layers, crop_box):
+    """حذف البكسلات خارج مستطيل القص من كل الطبقات (كما في PhotoModel.flatten_crop_job). يرجع الأبعاد الجديدة."""
+    for layer in layers.values():
+        image = _evaluate(layer)
+        x, y = layer['x'], layer['y']
+        x1, y1 = max(crop_box[0], x), max(crop_box[1], y)
+        x2, y2 = min(crop_box[2], x + image.width), min(crop_box[3], y + image.height)
+        if x1 < x2 and y1 < y2:
+            layer['source'] = image.crop((x1 - x, y1 - y, x2 - x, y2 - y))
+            layer['ops'] = []
+            x, y = x1, y1
+        layer['x'], layer['y'] = x - crop_box[0], y - crop_box[1]
+    return crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+
+
+def replay_macro(image, steps):
+    """
+    تطبيق خطوات ماكرو على صورة وإرجاع الصورة النهائية (بعد القص والاتجاه) كما يصدرها المحرر.
+    الطبقات تُبنى كما في PhotoModel (صورة أصلية + سلسلة عمليات) فتكون النتيجة مطابقة للتحرير اليدوي.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    size = image.size
+    orientation = orient.IDENTITY
+    crop_rect = None
+    # رقم الطبقة في الماكرو -> الطبقة، بترتيب الطبقات من الأسفل للأعلى
+    layers = {0: {'source': image, 'ops': [], 'opacity': 1.0, 'visible': True, 'x': 0, 'y': 0}}
+
+    for step in steps:
+        kind = step[0]
+        if kind == 'op':
+            layers[step[1]]['ops'].append(op_from_json(step[2]))
+        elif kind == 'remove_op':
+            del layers[step[1]]['ops'][step[2]]
+        elif kind == 'transform':
+            orientation = orient.compose(orientation, step[1])
+        elif kind == 'crop':
+            crop_rect = absolute_box(step[1], size) if step[1] else None
+        elif kind == 'text':
+            layer_number, text, ratio, color, x, y = step[1:]
+            layers[layer_number] = {
+                'source': _text_image(text, ratio, color, size, orientation), 'ops': [],
+                'opacity': 1.0, 'visible': True, 'x': round(x * size[0]), 'y': round(y * size[1]),
+                'orientation': orientation,
+            }
+        elif kind == 'edit_text':
+            layer = layers[step[1]]
+            layer['source'] = _text_image(step[2], step[3], step[4], size, layer['orientation'])
+        elif kind == 'move':
+            layer = layers[step[1]]
+            layer['x'], layer['y'] = round(step[2] * size[0]), round(step[3] * size[1])
+        elif kind == 'opacity':
+            layers[step[1]]['opacity'] = step[2]
+        elif kind == 'remove_layer':
+            del layers[step[1]]
+        elif kind == 'flatten_crop':
+            size = _flatten_crop(layers, crop_rect or (0, 0) + size)
+            crop_rect = None
+        else:
+            raise ValueError(f"خطوة ماكرو غير معروفة: {kind}")
+
+    for layer in layers.values():
+        _evaluate(layer)
+    if len(layers) == 1 and layers[0]['opacity'] == 1.0:
+        composite = layers[0]['image']
+        if composite.mode != 'RGBA':
+            composite = composite.convert('RGBA')
+    else:
+        composite = flatten_layers(layers.values(), size)
+    if crop_rect:
+        composite = composite.crop(crop_rect)
+    return orient.orient_image(composite, orientation)
@@ -0,0 +1,81 @@
+# /photo_editor/orientation.py
+
+from PIL import Image
+
+# الاتجاه هو (k, flipped): قلب أفقي اختياري ثم تدوير k مرة بمقدار 90 درجة عكس عقارب الساعة.
+# هذه الثمانية تغطي كل تركيبات التدوير والقلب، وكل اتجاه يُطبق بعملية transpose واحدة.
+IDENTITY = (0, False)
+
+TRANSPOSE_METHODS = {
+    (1, False): Image.Transpose.ROTATE_90,
+    (2, False): Image.Transpose.ROTATE_180,
+    (3, False): Image.Transpose.ROTATE_270,
+    (0, True): Image.Transpose.FLIP_LEFT_RIGHT,
+    (1, True): Image.Transpose.TRANSPOSE,
+    (2, True): Image.Transpose.FLIP_TOP_BOTTOM,
+    (3, True): Image.Transpose.TRANSVERSE,
+}
+
+
+def compose(orientation, operation):
+    """إرجاع الاتجاه الجديد بعد تطبيق عملية (rotate_left, rotate_right, flip_horizontal, flip_vertical)."""
+    k, flipped = orientation
+    if operation == 'rotate_left':
+        return ((k + 1) % 4, flipped)
+    if operation == 'rotate_right':
+        return ((k - 1) % 4, flipped)
+    if operation == 'flip_horizontal':
+        return ((-k) % 4, not flipped)
+    if operation == 'flip_vertical':
+        return ((2 - k) % 4, not flipped)
+    raise ValueError(f"عملية غير معروفة: {operation}")
+
+
+def inverse(orientation):
+    k, flipped = orientation
+    # القلب مع أي تدوير هو انعكاس، وعكسه هو نفسه
+    return orientation if flipped else ((-k) % 4, False)
+
+
+def orient_image(image, orientation):
+    """تطبيق الاتجاه على صورة (بدون نسخ إذا كان الاتجاه هو الأصلي)."""
+    if orientation == IDENTITY: return image
+    return image.transpose(TRANSPOSE_METHODS[orientation])
+
+
+def oriented_size(size, orientation):
+    """أبعاد الصورة بعد تطبيق الاتجاه."""
+    return (size[1], size[0]) if orientation[0] % 2 else size
+
+
+def map_point(point, size, orientation):
+    """تحويل نقطة من إحداثيات المستند (بأبعاد size) إلى إحداثيات العرض بعد تطبيق الاتجاه."""
+    k, flipped = orientation
+    x, y = point
+    width, height = size
+    if flipped:
+        x = width - x
+    for _ in range(k):
+        # تدوير 90 عكس عقارب الساعة: (x, y) -> (y, width - x) والأبعاد تتبادل
+        x, y = y, width - x
+        width, height = height, width
+    return x, y
+
+
+def unmap_point(point, size, orientation):
+    """تحويل نقطة من إحداثيات العرض إلى إحداثيات المستند (size هي أبعاد المستند)."""
+    return map_point(point, oriented_size(size, orientation), inverse(orientation))
+
+
+def unmap_box(box, size, orientation):
+    """تحويل مستطيل (x1, y1, x2, y2) من إحداثيات العرض إلى إحداثيات المستند."""
+    x1, y1 = unmap_point(box[:2], size, orientation)
+    x2, y2 = unmap_point(box[2:], size, orientation)
+    return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+
+def unmap_vector(dx, dy, orientation):
+    """تحويل إزاحة (مثل سحب الفأرة) من إحداثيات العرض إلى إحداثيات المستند."""
+    x0, y0 = map_point((0, 0), (0, 0), inverse(orientation))
+    x1, y1 = map_point((dx, dy), (0, 0), inverse(orientation))
+    return x1 - x0, y1 - y0
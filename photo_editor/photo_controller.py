@@ -1,11 +1,23 @@
 # /photo_editor/photo_controller.py
 
+import os
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, colorchooser
 from .photo_model import PhotoModel
+from .project_file import PROJECT_EXTENSION
+from .export import WEB_EXPORT_TARGETS, format_report
+from .macro import MACRO_EXTENSION, load_macro, save_macro
 from .photo_view import PhotoView
+from .executor import OperationExecutor
+from .render_scheduler import RenderScheduler
 from .text_dialog import TextDialog
-from .batch_dialog import BatchDialog
+from .batch_window import BatchWindow
+
+# المدة (بالملي ثانية) بعد آخر تفاعل قبل إعادة الرسم بجودة عالية
+SETTLE_DELAY_MS = 150
+
+# شرائط التعديلات التي لها معاينة حية (بترتيب معاملات apply_adjustments)
+ADJUSTMENT_KEYS = ('brightness', 'contrast', 'saturation', 'sharpness')
 
 class PhotoController:
     """
@@ -21,11 +33,23 @@ class PhotoController:
         self.is_drawing = False
         self.is_cropping = False
         self.is_dragging_layer = False
-        self.last_draw_point = None
         self.drag_start_x = 0
         self.drag_start_y = 0
         self.original_layer_x = 0
         self.original_layer_y = 0
+        self.pan_last_x = 0
+        self.pan_last_y = 0
+        self.settle_job = None
+        # التعديلات المؤجلة حتى اكتمال تحميل الصورة بالدقة الكاملة
+        self.pending_edits = []
+        # العمليات الثقيلة تُنفذ في الخلفية، ونتائجها تُنقل للخيط الرئيسي عبر after
+        self.executor = OperationExecutor(lambda callback: self.view.canvas.after(0, callback))
+        # طلبات تحديث الواجهة تُجمع في رسم واحد لكل إطار
+        self.render_scheduler = RenderScheduler(self.view.canvas, self.render_view)
+        # آخر حالة معروضة للقوائم والأزرار (لتجنب إعادة بنائها بدون تغيير)
+        self.shown_layers_state = None
+        self.shown_ops_labels = None
+        self.shown_history_state = None
         
         self.bind_commands()
 
@@ -33,32 +57,38 @@ class PhotoController:
         """ربط جميع عناصر الواجهة بالدوال المناسبة في المتحكم."""
         # أزرار الملفات
         self.view.open_button.configure(command=self.open_image)
+        self.view.save_button.configure(command=self.save_image)
         self.view.save_as_button.configure(command=self.save_as_image)
+        self.view.export_web_button.configure(command=self.export_web)
         
         # أزرار التاريخ
         self.view.undo_button.configure(command=self.undo)
         self.view.redo_button.configure(command=self.redo)
+        self.view.cancel_operation_button.configure(command=self.cancel_operation)
 
         # أزرار الطبقات
         self.view.add_layer_button.configure(command=self.add_image_layer)
         self.view.add_text_button.configure(command=self.open_text_dialog)
         self.view.remove_layer_button.configure(command=self.remove_layer)
+        self.view.edit_text_button.configure(command=self.edit_text_layer)
         self.view.layers_listbox.bind('<<ListboxSelect>>', self.on_layer_select)
         self.view.opacity_slider.configure(command=self.update_opacity)
+        self.view.remove_op_button.configure(command=self.remove_layer_op)
 
         # أزرار التعديلات
         self.view.apply_adj_button.configure(command=self.apply_adjustments)
         self.view.cancel_adj_button.configure(command=self.cancel_adjustments)
         self.view.apply_threshold_button.configure(command=self.apply_threshold)
-        for slider in self.view.adjustment_sliders.values():
+        for key in ADJUSTMENT_KEYS:
+            slider = self.view.adjustment_sliders[key]
             slider.bind("<ButtonPress-1>", self.start_adjustment_preview)
-            slider.bind("<ButtonRelease-1>", self.preview_adjustments)
+            slider.configure(command=self.preview_adjustments)
 
         # أزرار الفلاتر
-        for name, filter_type in self.view.filter_buttons.items():
+        for name, filter_name in self.view.filter_buttons.items():
             button = self.find_widget_by_text(self.view.filters_tab, name)
             if button:
-                button.configure(command=lambda ft=filter_type: self.apply_filter(ft))
+                button.configure(command=lambda fn=filter_name: self.apply_filter(fn))
 
         # أزرار الأدوات
         self.view.brush_button.configure(command=self.toggle_drawing_mode)
@@ -68,6 +98,8 @@ class PhotoController:
         self.view.flip_horizontal_button.configure(command=lambda: self.apply_transform('flip_horizontal'))
         self.view.flip_vertical_button.configure(command=lambda: self.apply_transform('flip_vertical'))
         self.view.batch_button.configure(command=self.open_batch_dialog)
+        self.view.record_macro_button.configure(command=self.toggle_macro_recording)
+        self.view.run_macro_button.configure(command=self.run_macro)
 
         # أدوات الفرشاة
         self.view.brush_size_slider.configure(command=self.update_brush_size)
@@ -79,12 +111,31 @@ class PhotoController:
         self.view.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.view.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
 
+        # التكبير (العجلة، لوحة المفاتيح، الأزرار) والتحريك (السحب بالزر الأوسط)
+        self.view.zoom_in_button.configure(command=self.zoom_in)
+        self.view.zoom_out_button.configure(command=self.zoom_out)
+        self.view.zoom_fit_button.configure(command=self.zoom_fit)
+        self.view.zoom_actual_button.configure(command=self.zoom_actual_size)
+        self.view.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.view.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.view.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.view.canvas.bind("<ButtonPress-2>", self.start_pan)
+        self.view.canvas.bind("<B2-Motion>", self.pan_view)
+        for key in ("<Control-plus>", "<Control-equal>", "<Control-KP_Add>"):
+            self.view.canvas.bind(key, lambda e: self.zoom_in())
+        for key in ("<Control-minus>", "<Control-KP_Subtract>"):
+            self.view.canvas.bind(key, lambda e: self.zoom_out())
+        self.view.canvas.bind("<Control-0>", lambda e: self.zoom_fit())
+        self.view.canvas.bind("<Control-1>", lambda e: self.zoom_actual_size())
+
     # --- دوال معالجة أحداث الكانفاس ---
     # <<< تم تصحيح المسافة البادئة هنا >>>
     def on_canvas_press(self, event):
         """يتم استدعاؤها عند الضغط على الكانفاس."""
+        # حتى تصل اختصارات التكبير للكانفاس
+        self.view.canvas.focus_set()
         if self.is_drawing:
-            self.draw_on_canvas(event)
+            self.start_stroke(event)
         elif self.is_cropping:
             self.start_crop(event)
         else: # وضع تحريك الطبقات
@@ -102,9 +153,7 @@ class PhotoController:
     def on_canvas_release(self, event):
         """يتم استدعاؤها عند رفع زر الفأرة عن الكانفاس."""
         if self.is_drawing:
-            self.last_draw_point = None
-            self.model.add_to_history()
-            self.update_history_buttons()
+            self.end_stroke(event)
         elif self.is_cropping:
             pass # لا تفعل شيئاً، ننتظر الضغط على زر "تطبيق"
         elif self.is_dragging_layer:
@@ -112,22 +161,203 @@ class PhotoController:
 
     def on_canvas_resize(self, event):
         """يتم استدعاؤها عند تغيير حجم النافذة."""
+        self.update_view(interactive=True)
+
+    # --- دوال التكبير والتحريك ---
+    def zoom_in(self, point=None):
+        if not self.model.has_image(): return
+        self.view.viewport.zoom_in(point)
+        self.update_view(interactive=True)
+
+    def zoom_out(self, point=None):
+        if not self.model.has_image(): return
+        self.view.viewport.zoom_out(point)
+        self.update_view(interactive=True)
+
+    def zoom_fit(self):
+        self.view.viewport.fit()
         self.update_view()
 
+    def zoom_actual_size(self):
+        """عرض الصورة بحجمها الحقيقي (بكسل لكل بكسل)."""
+        if not self.model.has_image(): return
+        self.view.viewport.set_zoom(1.0)
+        self.update_view()
+
+    def on_mouse_wheel(self, event):
+        """التكبير حول مؤشر الفأرة (delta في ويندوز/ماك، والزران 4 و 5 في لينكس)."""
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.zoom_in((event.x, event.y))
+        elif event.num == 5 or getattr(event, 'delta', 0) < 0:
+            self.zoom_out((event.x, event.y))
+
+    def start_pan(self, event):
+        self.pan_last_x, self.pan_last_y = event.x, event.y
+
+    def pan_view(self, event):
+        self.view.viewport.pan(event.x - self.pan_last_x, event.y - self.pan_last_y)
+        self.pan_last_x, self.pan_last_y = event.x, event.y
+        self.update_view(interactive=True)
+
     # --- دوال الملفات والتاريخ ---
     def open_image(self):
-        path = filedialog.askopenfilename(title="اختر صورة", filetypes=[("ملفات الصور", "*.jpg *.jpeg *.png *.bmp *.tiff")])
+        path = filedialog.askopenfilename(title="اختر صورة", filetypes=[
+            ("ملفات الصور والمشاريع", f"*.jpg *.jpeg *.png *.bmp *.tiff *{PROJECT_EXTENSION}"),
+            ("مشروع", f"*{PROJECT_EXTENSION}")])
         if path:
-            self.model.load_image(path)
+            self.executor.cancel()
+            self.pending_edits = []
             self.active_layer_index = 0
+            self.view.viewport.fit()
+            if self.model.is_project_path(path):
+                self.open_project(path)
+                return
+            canvas_width, canvas_height = self.view.get_canvas_size()
+
+            def on_loaded(token, image, error):
+                self.view.canvas.after(0, lambda: self.finish_loading(token, image, error))
+
+            if self.model.load_image_fast(path, canvas_width, canvas_height, on_loaded):
+                self.view.show_progress(0, "جاري تحميل الصورة بالدقة الكاملة...")
             self.update_view()
 
+    def open_project(self, path):
+        try:
+            self.model.open_project(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("خطأ", f"تعذر فتح المشروع: {e}")
+        self.update_view()
+
+    def recover_autosave(self):
+        """عرض استرجاع التعديلات غير المحفوظة إذا أُغلق البرنامج بشكل غير طبيعي في المرة السابقة."""
+        records = self.model.read_recovery()
+        if records is None: return
+        if not messagebox.askyesno("محرر الصور", "توجد تعديلات غير محفوظة من الجلسة السابقة. هل تريد استرجاعها؟"):
+            self.model.journal.discard()
+            return
+        try:
+            self.model.recover(records)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("خطأ", f"تعذر استرجاع التعديلات: {e}")
+        self.active_layer_index = 0
+        self.view.viewport.fit()
+        self.update_view()
+
+    def finish_loading(self, token, image, error):
+        """يُستدعى في الخيط الرئيسي بعد فك الصورة كاملة الدقة، ثم تُنفذ التعديلات المؤجلة بالترتيب."""
+        if not self.model.finish_loading(token, image):
+            if error:
+                self.view.hide_progress()
+                self.pending_edits = []
+                messagebox.showerror("خطأ", f"تعذر تحميل الصورة: {error}")
+                self.update_view()
+            return
+        self.view.hide_progress()
+        self.run_pending_edits()
+
+    def run_pending_edits(self):
+        """تنفيذ التعديلات المؤجلة بالترتيب: كل تعديل يبدأ بعد انتهاء الذي قبله."""
+        if not self.pending_edits:
+            self.update_view()
+            return
+        step = self.pending_edits.pop(0)
+        step(self.run_pending_edits)
+
+    def queue_edit(self, step):
+        """تأجيل تعديل حتى اكتمال تحميل الصورة. step(next_edit) يجب أن يستدعي next_edit عند انتهائه."""
+        self.pending_edits.append(step)
+        self.view.show_progress(0, f"جاري تحميل الصورة بالدقة الكاملة... ({len(self.pending_edits)} تعديل في الانتظار)")
+
+    def run_or_queue(self, action, *args):
+        """تنفيذ تعديل سريع على الـ Model فوراً، أو تأجيله إذا كانت الصورة كاملة الدقة ما زالت قيد التحميل."""
+        if self.model.is_loading():
+            self.queue_edit(lambda next_edit: (action(*args), next_edit()))
+            return
+        action(*args)
+        self.update_view()
+
+    def run_operation(self, text, make_job, *args, on_done=None):
+        """
+        تنفيذ عملية ثقيلة على الـ Model في الخلفية مع عرض التقدم وزر الإلغاء.
+        make_job(*args) يُستدعى عند بدء التنفيذ ويرجع (compute, commit) (انظر OperationExecutor).
+        """
+        if self.model.is_loading():
+            def step(next_edit):
+                def finished():
+                    if on_done: on_done()
+                    next_edit()
+                self.run_operation(text, make_job, *args, on_done=finished)
+            self.queue_edit(step)
+            return
+        self.view.show_progress(0, text, cancellable=True)
+
+        def progress(value):
+            self.view.show_progress(value, text, cancellable=True)
+
+        def done(committed):
+            if not self.executor.is_busy():
+                self.view.hide_progress()
+            if on_done:
+                on_done()
+            else:
+                self.update_view()
+
+        def error(e):
+            self.view.hide_progress()
+            self.pending_edits = []
+            # معاينة تعديلات لم تُطبق (المنزلقات أُعيدت عند الطلب) لا يجب أن تبقى معروضة
+            self.model.cancel_adjustment_preview()
+            self.update_view()
+            messagebox.showerror("خطأ", f"فشلت العملية: {e}")
+
+        self.executor.submit(lambda: make_job(*args), done, progress, error)
+
+    def cancel_operation(self):
+        """إلغاء العملية الجارية في الخلفية وأي تعديلات مؤجلة."""
+        self.executor.cancel()
+        self.pending_edits = []
+        self.model.cancel_adjustment_preview()
+        self.view.hide_progress()
+        self.update_view()
+
+    def save_image(self):
+        """حفظ سريع: المشروع المفتوح يُحفظ تدريجياً في نفس الملف، وغير ذلك يُطلب مسار الحفظ."""
+        if not self.model.layers: return
+        if self.model.image_path and self.model.is_project_path(self.model.image_path):
+            self.save_project(self.model.image_path)
+        else:
+            self.save_as_image()
+
     def save_as_image(self):
         if not self.model.layers: return
-        path = filedialog.asksaveasfilename(title="حفظ الصورة باسم", defaultextension=".png", filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg"), ("BMP", "*.bmp")])
-        if path:
-            self.model.save_image(path)
-            messagebox.showinfo("نجاح", "تم حفظ الصورة بنجاح.")
+        path = filedialog.asksaveasfilename(title="حفظ الصورة باسم", defaultextension=".png", filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg"), ("BMP", "*.bmp"), ("مشروع", f"*{PROJECT_EXTENSION}")])
+        if not path: return
+        if self.model.is_project_path(path):
+            self.save_project(path)
+            return
+        self.model.save_image(path)
+        messagebox.showinfo("نجاح", "تم حفظ الصورة بنجاح.")
+
+    def export_web(self):
+        """تصدير مجموعة الويب (كاملة، WebP، 2x/1x، مصغرة) إلى مجلد في الخلفية."""
+        if not self.model.has_image(): return
+        folder = filedialog.askdirectory(title="اختر مجلد التصدير")
+        if not folder: return
+        base_name = os.path.splitext(os.path.basename(self.model.image_path or "image"))[0]
+
+        def show_report(results):
+            messagebox.showinfo("نجاح", "تم التصدير:\n" + format_report(results))
+
+        self.run_operation("جاري التصدير...", self.model.export_job,
+                           WEB_EXPORT_TARGETS, folder, base_name, show_report)
+
+    def save_project(self, path):
+        try:
+            self.model.save_project(path)
+        except OSError as e:
+            messagebox.showerror("خطأ", f"تعذر حفظ المشروع: {e}")
+            return
+        messagebox.showinfo("نجاح", "تم حفظ المشروع بنجاح.")
 
     def undo(self):
         if self.model.undo():
@@ -139,21 +369,41 @@ class PhotoController:
 
     # --- دوال الطبقات ---
     def add_image_layer(self):
-        if not self.model.layers: return
+        if not self.model.has_image(): return
         path = filedialog.askopenfilename(title="اختر صورة للطبقة", filetypes=[("ملفات الصور", "*.jpg *.jpeg *.png *.bmp")])
         if path:
-            self.model.add_image_layer(path)
-            self.active_layer_index = len(self.model.layers) - 1
-            self.update_view()
+            self.run_or_queue(self.add_layer_and_select, self.model.add_image_layer, path)
 
     def open_text_dialog(self):
-        if not self.model.layers: return
+        if not self.model.has_image(): return
         dialog = TextDialog(self.view.winfo_toplevel())
         self.view.wait_window(dialog)
         if dialog.result:
-            self.model.add_text_layer(**dialog.result)
-            self.active_layer_index = len(self.model.layers) - 1
-            self.update_view()
+            result = dialog.result
+            self.run_or_queue(self.add_layer_and_select, lambda: self.model.add_text_layer(**result))
+
+    def edit_text_layer(self):
+        """تعديل طبقة النص المحددة مع معاينة حية أثناء الكتابة (بدون خطوات تاريخ حتى التأكيد)."""
+        if self.model.is_loading(): return
+        layer_index = self.active_layer_index
+        original = self.model.get_text_params(layer_index)
+        if not original: return
+
+        def preview(values):
+            self.model.update_text_layer(layer_index, **values, add_history=False)
+            self.update_view(interactive=True)
+
+        dialog = TextDialog(self.view.winfo_toplevel(), initial=original, on_change=preview)
+        self.view.wait_window(dialog)
+        # إرجاع القيم الأصلية (من الذاكرة المؤقتة) ثم تطبيق النتيجة كخطوة واحدة في التاريخ
+        self.model.update_text_layer(layer_index, **original, add_history=False)
+        if dialog.result:
+            self.model.update_text_layer(layer_index, **dialog.result)
+        self.update_view()
+
+    def add_layer_and_select(self, add_layer, *args):
+        add_layer(*args)
+        self.active_layer_index = len(self.model.layers) - 1
 
     def remove_layer(self):
         if self.model.remove_layer(self.active_layer_index):
@@ -163,26 +413,47 @@ class PhotoController:
     def on_layer_select(self, event):
         selection = self.view.layers_listbox.curselection()
         if selection:
+            if selection[0] != self.active_layer_index:
+                self.model.cancel_adjustment_preview()
             self.active_layer_index = selection[0]
             self.update_view()
 
+    def remove_layer_op(self):
+        selection = self.view.ops_listbox.curselection()
+        if selection and self.model.remove_layer_op(self.active_layer_index, selection[0]):
+            self.update_view()
+
     def update_opacity(self, value):
-        self.model.layers[self.active_layer_index]['opacity'] = float(value)
-        self.update_view()
+        self.model.set_layer_opacity(self.active_layer_index, float(value))
+        self.update_view(interactive=True)
 
     # --- دوال التعديلات والفلاتر ---
-    def start_adjustment_preview(self, event):
-        self.model.start_adjustment_preview(self.active_layer_index)
+    def start_adjustment_preview(self, event=None):
+        """تجهيز نسخة مصغرة من الطبقة النشطة للمعاينة الحية (مرة واحدة عند بدء التحريك)."""
+        if not self.model.layers or self.model.adjustment_preview: return
+        canvas_width, canvas_height = self.view.get_canvas_size()
+        self.model.start_adjustment_preview(self.active_layer_index, canvas_width, canvas_height)
+
+    def get_adjustment_values(self):
+        return tuple(self.view.adjustment_sliders[key].get() for key in ADJUSTMENT_KEYS)
+
+    def preview_adjustments(self, value=None):
+        """عرض نتيجة التعديلات فوراً على النسخة المصغرة."""
+        self.start_adjustment_preview()
+        self.model.set_adjustment_preview_values(*self.get_adjustment_values())
+        self.update_view(interactive=True)
 
     def apply_adjustments(self):
-        self.model.apply_adjustments(
-            self.active_layer_index,
-            self.view.adjustment_sliders['brightness'].get(),
-            self.view.adjustment_sliders['contrast'].get(),
-            self.view.adjustment_sliders['saturation'].get(),
-            self.view.adjustment_sliders['sharpness'].get()
-        )
+        """تطبيق التعديلات بالدقة الكاملة في الخلفية مع عرض التقدم."""
+        values = self.get_adjustment_values()
+        layer_index = self.active_layer_index
+        self.run_operation("جاري تطبيق التعديلات...", self.model.adjustments_job, layer_index, *values,
+                           on_done=lambda: self.finish_adjustments(layer_index))
         self.view.reset_adjustment_sliders()
+
+    def finish_adjustments(self, layer_index):
+        """يُستدعى في الخيط الرئيسي بعد انتهاء التطبيق في الخلفية."""
+        self.model.cancel_adjustment_preview(layer_index)
         self.update_view()
 
     def cancel_adjustments(self):
@@ -190,14 +461,12 @@ class PhotoController:
         self.view.reset_adjustment_sliders()
         self.update_view()
 
-    def apply_filter(self, filter_type):
-        self.model.apply_filter(self.active_layer_index, filter_type)
-        self.update_view()
+    def apply_filter(self, filter_name):
+        self.run_operation("جاري تطبيق الفلتر...", self.model.filter_job, self.active_layer_index, filter_name)
 
     def apply_threshold(self):
-        value = self.view.threshold_slider.get()
-        self.model.apply_threshold(self.active_layer_index, value)
-        self.update_view()
+        value = int(self.view.adjustment_sliders['threshold'].get())
+        self.run_operation("جاري تطبيق العتبة...", self.model.threshold_job, self.active_layer_index, value)
 
     # --- دوال الأدوات ---
     def toggle_drawing_mode(self):
@@ -217,19 +486,33 @@ class PhotoController:
             self.model.brush_color = (*color_code[0], 255)
             self.view.update_brush_color_button(color_code[1])
 
-    def draw_on_canvas(self, event):
+    def start_stroke(self, event):
         coords = self.view.canvas_to_image_coords(event.x, event.y)
         if coords:
-            self.model.draw_on_layer(self.active_layer_index, self.last_draw_point, coords)
-            self.last_draw_point = coords
+            self.model.begin_stroke(self.active_layer_index, coords)
             self.update_view()
 
+    def draw_on_canvas(self, event):
+        coords = self.view.canvas_to_image_coords(event.x, event.y)
+        if coords:
+            if self.model.stroke:
+                self.model.continue_stroke(coords)
+            else:
+                self.model.begin_stroke(self.active_layer_index, coords)
+            self.update_view(interactive=True)
+
+    def end_stroke(self, event):
+        self.model.end_stroke()
+        self.update_view()
+
     def toggle_crop_mode(self):
-        if not self.model.layers: return
+        if not self.model.has_image(): return
         self.is_cropping = not self.is_cropping
         self.view.show_crop_controls(self.is_cropping)
         if self.is_cropping:
             self.view.apply_crop_button.configure(command=self.apply_crop)
+            self.view.reset_crop_button.configure(command=self.reset_crop)
+            self.view.flatten_crop_button.configure(command=self.flatten_crop)
 
     def start_crop(self, event):
         self.view.start_crop_rect(event.x, event.y)
@@ -240,19 +523,69 @@ class PhotoController:
     def apply_crop(self):
         crop_box = self.view.get_image_crop_box()
         if crop_box:
-            self.model.apply_crop(crop_box)
-            self.update_view()
+            self.run_or_queue(self.model.apply_crop, crop_box)
         self.toggle_crop_mode()
 
+    def reset_crop(self):
+        """إظهار المستند كاملاً من جديد (القص لا يحذف البكسلات حتى يتم تثبيته)."""
+        self.run_or_queue(self.model.reset_crop)
+
+    def flatten_crop(self):
+        """حذف البكسلات خارج مستطيل القص فعلياً."""
+        self.run_operation("جاري تثبيت القص...", self.model.flatten_crop_job)
+
     def apply_transform(self, operation):
-        self.model.apply_transform(operation)
-        self.update_view()
+        self.run_or_queue(self.model.apply_transform, operation)
 
     def open_batch_dialog(self):
-        dialog = BatchDialog(self.view.winfo_toplevel())
-        self.view.wait_window(dialog)
-        if dialog.result:
-            self.model.process_batch_watermark(**dialog.result, progress_callback=dialog.update_progress)
+        BatchWindow(self.view.winfo_toplevel())
+
+    # --- دوال الماكرو ---
+    def toggle_macro_recording(self):
+        """بدء تسجيل ماكرو، أو إنهاؤه وحفظه في ملف."""
+        if not self.model.is_recording_macro():
+            self.model.start_macro()
+            self.view.record_macro_button.configure(text="⏹️ إيقاف التسجيل وحفظ الماكرو")
+            return
+        steps = self.model.stop_macro()
+        self.view.record_macro_button.configure(text="⏺️ تسجيل ماكرو")
+        if not steps:
+            messagebox.showwarning("تحذير", "لم يتم تسجيل أي عمليات.")
+            return
+        path = filedialog.asksaveasfilename(title="حفظ الماكرو", defaultextension=MACRO_EXTENSION,
+                                            filetypes=[("ماكرو", f"*{MACRO_EXTENSION}")])
+        if not path: return
+        try:
+            save_macro(path, steps)
+        except OSError as e:
+            messagebox.showerror("خطأ", f"تعذر حفظ الماكرو: {e}")
+
+    def run_macro(self):
+        """تطبيق ماكرو محفوظ على كل صور مجلد (بالتوازي في الخلفية)."""
+        path = filedialog.askopenfilename(title="اختر ملف الماكرو", filetypes=[("ماكرو", f"*{MACRO_EXTENSION}")])
+        if not path: return
+        try:
+            steps = load_macro(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("خطأ", f"تعذر فتح الماكرو: {e}")
+            return
+        source_folder = filedialog.askdirectory(title="اختر مجلد الصور")
+        if not source_folder: return
+        save_folder = filedialog.askdirectory(title="اختر مجلد الحفظ")
+        if not save_folder: return
+
+        def progress(value, text, finished):
+            self.view.canvas.after(0, lambda: self.show_macro_progress(value, text, finished))
+
+        self.view.show_progress(0, "جاري تطبيق الماكرو...")
+        self.model.process_batch_macro(source_folder, steps, save_folder, progress)
+
+    def show_macro_progress(self, value, text, finished):
+        if finished:
+            self.view.hide_progress()
+            messagebox.showinfo("تطبيق الماكرو", text)
+        else:
+            self.view.show_progress(value, text)
 
     # --- دوال تحريك الطبقات ---
     def start_drag_layer(self, event):
@@ -266,11 +599,13 @@ class PhotoController:
 
     def drag_layer(self, event):
         if self.is_dragging_layer:
-            dx = event.x - self.drag_start_x
-            dy = event.y - self.drag_start_y
-            self.model.layers[self.active_layer_index]['x'] = self.original_layer_x + dx
-            self.model.layers[self.active_layer_index]['y'] = self.original_layer_y + dy
-            self.update_view()
+            scale = self.view.viewport.scale()
+            dx, dy = self.model.to_document_vector((event.x - self.drag_start_x) / scale,
+                                                   (event.y - self.drag_start_y) / scale)
+            # مواضع الطبقات بكسلات صحيحة (الإزاحة مقسومة على التكبير عدد عشري)
+            self.model.move_layer(self.active_layer_index, self.original_layer_x + int(round(dx)),
+                                  self.original_layer_y + int(round(dy)))
+            self.update_view(interactive=True)
 
     def end_drag_layer(self, event):
         if self.is_dragging_layer:
@@ -279,22 +614,55 @@ class PhotoController:
             self.update_history_buttons()
 
     # --- دالة التحديث الرئيسية ---
-    def update_view(self):
-        """تحديث الواجهة بالكامل بناءً على حالة الـ Model."""
-        # عرض الصورة
-        composited_image = self.model.get_composited_image()
-        self.view.display_image(composited_image)
+    def update_view(self, interactive=False):
+        """
+        طلب تحديث الواجهة بناءً على حالة الـ Model (الرسم الفعلي يتم مرة واحدة لكل إطار عبر RenderScheduler).
+        أثناء التفاعل (سحب، رسم، ...) يُعرض تحجيم سريع، ثم يُعاد الرسم بجودة عالية بعد توقف التفاعل.
+        """
+        if self.settle_job:
+            self.view.canvas.after_cancel(self.settle_job)
+            self.settle_job = None
+        if interactive:
+            self.settle_job = self.view.canvas.after(SETTLE_DELAY_MS, self.update_view)
+        self.render_scheduler.request(interactive)
+
+    def render_view(self, interactive):
+        """رسم الواجهة فعلياً (يُستدعى من RenderScheduler)."""
+        # عرض الجزء الظاهر فقط من الصورة حسب التكبير والتحريك (أو المعاينة الحية للتعديلات)
+        canvas_width, canvas_height = self.view.get_canvas_size()
+        image_size = self.model.get_image_size()
+        viewport = self.view.viewport
+        visible_image, position = None, (0, 0)
+        if image_size and canvas_width > 1 and canvas_height > 1:
+            viewport.set_sizes(image_size, (canvas_width, canvas_height))
+            region = viewport.visible_region()
+            if region:
+                box, size, position = region
+                visible_image = self.model.get_viewport_image(box, size, interactive)
+        self.view.display_image(visible_image, position)
+        self.view.update_zoom_label(viewport.scale())
         
-        # تحديث قائمة الطبقات
-        self.view.update_layers_list(self.model.layers, self.active_layer_index)
+        # تحديث قائمة الطبقات وعملياتها (فقط إذا تغير ما يُعرض فيها)
+        layers_state = (tuple((layer['name'], layer['visible']) for layer in self.model.layers),
+                        self.active_layer_index)
+        if layers_state != self.shown_layers_state:
+            self.shown_layers_state = layers_state
+            self.view.update_layers_list(self.model.layers, self.active_layer_index)
+        if 0 <= self.active_layer_index < len(self.model.layers):
+            self.view.set_opacity_slider(self.model.layers[self.active_layer_index]['opacity'])
+        ops_labels = self.model.get_layer_op_labels(self.active_layer_index)
+        if ops_labels != self.shown_ops_labels:
+            self.shown_ops_labels = ops_labels
+            self.view.update_ops_list(ops_labels)
         
         # تحديث أزرار التراجع/الإعادة
         self.update_history_buttons()
 
     def update_history_buttons(self):
-        can_undo = self.model.history_index > 0
-        can_redo = self.model.history_index < len(self.model.history) - 1
-        self.view.update_history_buttons(can_undo, can_redo)
+        history_state = (self.model.can_undo(), self.model.can_redo())
+        if history_state != self.shown_history_state:
+            self.shown_history_state = history_state
+            self.view.update_history_buttons(*history_state)
 
     def find_widget_by_text(self, parent, text):
         """دالة مساعدة للبحث عن ويدجت بناءً على النص."""
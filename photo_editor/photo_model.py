@@ -2,9 +2,22 @@
 
 # --- الاستيرادات ---
 import os
-import copy
 import threading
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageOps
+import weakref
+from PIL import Image
+from .compositor import TileCompositor, flatten_layers, blend_layer
+from .history import History
+from .brush import BrushStroke
+from .preview import PreviewPyramid
+from .adjustments import adjust_image
+from .text_render import render_text
+from .layer_ops import OpStackCache, apply_op, describe_op, filter_op
+from .project_file import PROJECT_EXTENSION, ProjectFile, layer_from_json, layer_to_json
+from .export import export_targets
+from .batch_engine import macro_recipe, list_images, run_recipe
+from .macro import MACRO_LAYER_STEPS, relative_box, relative_text_size
+from utils.autosave import AutosaveJournal
+from . import orientation as orient
 
 class PhotoModel:
     """
@@ -16,34 +29,128 @@ class PhotoModel:
         # --- حالة النموذج ---
         self.image_path = None
         self.layers = []
-        self.history = []
-        self.history_index = -1
+        self.op_cache = OpStackCache()
+        # ذاكرة سلاسل العمليات تُحسب ضمن حد ذاكرة التاريخ
+        self.history = History(cache=self.op_cache)
         self.brush_size = 10
         self.brush_color = (255, 0, 0, 255)
         self.unsaved_changes = False
+        self.compositor = TileCompositor()
+        self.preview = PreviewPyramid()
+        self.stroke = None
+        self.stroke_layer_index = None
+        # عداد الكتابة داخل صور الطبقات (ضربات الفرشاة، ورُقع التراجع/الإعادة) التي لا تغير هوية الصورة
+        self.pixel_edits = 0
+        self.adjustment_preview = None
+        self.loading = None
+        # اتجاه المستند (تدوير/قلب) يُطبق عند العرض والتصدير فقط، والطبقات تبقى بإحداثيات المستند
+        self.orientation = orient.IDENTITY
+        # مستطيل القص (بإحداثيات المستند) يحدد الجزء المعروض والمُصدر دون حذف البكسلات، None = بدون قص
+        self.crop_rect = None
+        # ملف المشروع المفتوح/المحفوظ حالياً (للحفظ التدريجي وفك الطبقات عند الحاجة)
+        self.project = None
+        # سجل الحفظ التلقائي: id(صورة) -> (weakref, رقمها في السجل) للصور المكتوبة فيه
+        self.journal = AutosaveJournal('photo')
+        self.journal_images = {}
+        self.journal_next_number = 0
+        # تسجيل الماكرو: None أو {'steps', 'length' (عدد الخطوات الفعلية بعد التراجع), 'pushed' (عددها
+        # عند آخر خطوة في التاريخ), 'session', 'next_layer'}
+        self.macro = None
+        self.macro_session = 0
 
     # --- دوال تحميل وحفظ ---
     def load_image(self, file_path):
         """تحميل صورة من مسار وتعيينها كطبقة أساسية."""
-        self.image_path = file_path
         image = Image.open(file_path)
         if image.mode != 'RGBA':
             image = image.convert('RGBA')
-        
+        self.set_base_image(file_path, image)
+
+    def load_image_fast(self, file_path, max_width, max_height, done_callback):
+        """
+        فتح سريع للصور الكبيرة: تُفك نسخة مصغرة بحجم الشاشة (draft لصور JPEG، أسرع بكثير من فك الصورة كاملة)
+        وتُعرض فوراً، بينما تُفك الصورة بالدقة الكاملة في خيط منفصل.
+        done_callback(token, image, error) يُستدعى من الخيط المنفصل، ويجب على المتحكم نقله للخيط الرئيسي
+        ثم استدعاء finish_loading. يرجع False إذا كانت الصيغة لا تدعم الفك المصغر أو كانت الصورة صغيرة
+        (وتُحمل الصورة مباشرة).
+        """
+        image = Image.open(file_path)
+        full_size = image.size
+        if image.draft('RGB', (max(1, max_width), max(1, max_height))) is None or image.size == full_size:
+            self.set_base_image(file_path, image.convert('RGBA'))
+            return False
+
+        self.layers = []
+        self.compositor.invalidate()
+        self.op_cache.clear()
+        self.history.clear()
+        self.adjustment_preview = None
+        self.orientation = orient.IDENTITY
+        self.crop_rect = None
+        self.project = None
+        self.journal.discard()
+        token = object()
+        self.loading = {'token': token, 'path': file_path, 'proxy': image.convert('RGBA'), 'size': full_size}
+
+        def worker():
+            try:
+                with Image.open(file_path) as full:
+                    result = full.convert('RGBA')
+                done_callback(token, result, None)
+            except Exception as e:
+                done_callback(token, None, e)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return True
+
+    def finish_loading(self, token, image):
+        """
+        استبدال النسخة المصغرة بالصورة كاملة الدقة بعد انتهاء الفك في الخلفية.
+        يرجع False إذا فُتحت صورة أخرى أثناء التحميل أو فشل الفك.
+        """
+        if not self.loading or self.loading['token'] is not token: return False
+        path = self.loading['path']
+        self.loading = None
+        if image is None:
+            self.image_path = None
+            return False
+        self.set_base_image(path, image)
+        return True
+
+    def is_loading(self):
+        """هل الصورة كاملة الدقة ما زالت قيد الفك في الخلفية؟"""
+        return self.loading is not None
+
+    def has_image(self):
+        return bool(self.layers) or self.loading is not None
+
+    def set_base_image(self, file_path, image):
+        """تعيين صورة كطبقة أساسية وحيدة وبدء تاريخ جديد."""
+        self.image_path = file_path
+        self.loading = None
+        self.orientation = orient.IDENTITY
+        self.crop_rect = None
+        self.project = None
         self.layers = [{
             'name': 'الطبقة الأساسية',
             'image': image,
+            'source': image, 'ops': (),
             'opacity': 1.0,
             'visible': True,
             'x': 0, 'y': 0,
             'is_draw_layer': False
         }]
+        self.compositor.invalidate()
+        self.op_cache.clear()
+        self.journal.discard()
         self.reset_history()
         self.unsaved_changes = False
+        self.start_journal('image', file_path)
 
     def save_image(self, path):
         """دمج كل الطبقات وحفظ الصورة النهائية في مسار معين."""
-        final_image = self.get_composited_image()
+        final_image = self.get_export_image()
         if not final_image: return
 
         if ".jpg" in path.lower() or ".jpeg" in path.lower():
@@ -52,6 +159,79 @@ class PhotoModel:
             final_image.save(path)
         self.image_path = path
         self.unsaved_changes = False
+        # ما قبل هذه النقطة محفوظ، فيبدأ سجل جديد من الحالة الحالية
+        self.start_journal('saved', path)
+
+    def open_project(self, path):
+        """
+        فتح ملف مشروع: الطبقات وخصائص المستند تُقرأ فوراً، وبكسلات كل طبقة تُفك من الملف عند أول استخدام لها.
+        """
+        project, index = ProjectFile.open(path)
+        self.op_cache.clear()
+        try:
+            layers = [layer_from_json(entry, entry['image']) for entry in index['layers']]
+            for layer in layers:
+                layer['image'] = self.op_cache.evaluate(layer['source'], layer['ops'])
+            orientation = tuple(index['orientation'])
+            crop_rect = tuple(index['crop_rect']) if index['crop_rect'] else None
+        except BaseException as e:
+            self.op_cache.clear()
+            project.close()
+            # طبقة أو عملية بحقول خاطئة في الفهرس (مثل فلتر غير معروف)
+            if isinstance(e, (KeyError, IndexError, TypeError)):
+                raise ValueError("ملف المشروع تالف") from e
+            raise
+
+        self.image_path = path
+        self.loading = None
+        self.project = project
+        self.orientation = orientation
+        self.crop_rect = crop_rect
+        self.layers = layers
+        self.compositor.invalidate()
+        self.journal.discard()
+        self.reset_history()
+        self.unsaved_changes = False
+        self.start_journal('project', path)
+
+    def save_project(self, path):
+        """
+        حفظ المشروع بطبقاته وسلاسل عملياتها. الحفظ في نفس الملف المفتوح تدريجي:
+        تُكتب فقط المربعات التي تغيرت منذ آخر حفظ.
+        """
+        if self.project is None or self.project.path != os.path.abspath(path):
+            self.project = ProjectFile(path)
+        document = {'orientation': self.orientation, 'crop_rect': self.crop_rect}
+        self.project = self.project.save(self.layers, document)
+        self.image_path = path
+        self.unsaved_changes = False
+        # المشروع المحفوظ يحتوي كل الطبقات، فيبدأ سجل جديد منه
+        self.start_journal('project', path)
+
+    def export_job(self, targets, folder, base_name, on_commit=None):
+        """
+        تصدير متعدد الأهداف (صيغ وأحجام وجودة مختلفة): الصورة تُدمج مرة واحدة في الخيط الرئيسي،
+        ثم تُرمز كل الأهداف بالتوازي في compute. on_commit(results) تستقبل الحجم والزمن لكل هدف.
+        """
+        image = self.get_export_image()
+        if image is None: return None
+        if image is self.compositor.composite:
+            # الصورة المدمجة المخزنة قد تتغير أثناء الترميز في الخلفية
+            image = image.copy()
+
+        def compute(progress_callback):
+            return export_targets(image, targets, folder, base_name, progress_callback=progress_callback)
+
+        def commit(results):
+            if on_commit:
+                on_commit(results)
+            return True
+
+        return compute, commit
+
+    @staticmethod
+    def is_project_path(path):
+        return path.lower().endswith(PROJECT_EXTENSION)
 
     # --- دوال الطبقات ---
     def add_image_layer(self, file_path):
@@ -61,30 +241,35 @@ class PhotoModel:
             layer_image = layer_image.convert('RGBA')
         
         layer_info = {
-            'name': os.path.basename(file_path), 'image': layer_image, 
+            'name': os.path.basename(file_path), 'image': layer_image, 'source': layer_image, 'ops': (),
             'opacity': 1.0, 'visible': True, 'x': 0, 'y': 0, 'is_draw_layer': False
         }
+        self.place_upright(layer_info)
         self.layers.append(layer_info)
+        self.compositor.invalidate_layer(layer_info)
         self.add_to_history()
 
     def add_text_layer(self, text, size, color):
-        """إنشاء صورة من نص وإضافتها كطبقة جديدة."""
-        try:
-            font = ImageFont.truetype("arial.ttf", size)
-        except IOError:
-            font = ImageFont.load_default()
-        
-        bbox = font.getbbox(text)
-        text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        text_image = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(text_image)
-        draw.text((-bbox[0], -bbox[1]), text, font=font, fill=color)
-        
+        """
+        إنشاء صورة من نص وإضافتها كطبقة جديدة.
+        الطبقة تحتفظ بمعاملات النص (text) حتى يمكن تعديلها لاحقاً، والصورة تأتي من ذاكرة render_text.
+        """
+        text_image = render_text(text, size, tuple(color))
         layer_info = {
-            'name': f'نص: "{text[:10]}..."', 'image': text_image,
-            'opacity': 1.0, 'visible': True, 'x': 0, 'y': 0, 'is_draw_layer': False
+            'name': f'نص: "{text[:10]}..."', 'image': text_image, 'source': text_image, 'ops': (),
+            'opacity': 1.0, 'visible': True, 'x': 0, 'y': 0, 'is_draw_layer': False,
+            'text': {'text': text, 'size': size, 'color': tuple(color), 'orientation': self.orientation},
         }
+        self.place_upright(layer_info)
+        if self.macro:
+            document_size = self.get_document_size()
+            layer_info['macro_layer'] = (self.macro['session'], self.macro['next_layer'])
+            self.macro['next_layer'] += 1
+            self.record_macro_step('text', layer_info['macro_layer'][1], text,
+                                   relative_text_size(size, document_size), list(color),
+                                   layer_info['x'] / document_size[0], layer_info['y'] / document_size[1])
         self.layers.append(layer_info)
+        self.compositor.invalidate_layer(layer_info)
         self.add_to_history()
 
     def add_draw_layer(self):
@@ -93,200 +278,786 @@ class PhotoModel:
         base_size = self.layers[0]['image'].size
         draw_layer_image = Image.new("RGBA", base_size, (0, 0, 0, 0))
         layer_info = {
-            'name': 'طبقة رسم', 'image': draw_layer_image,
+            'name': 'طبقة رسم', 'image': draw_layer_image, 'source': draw_layer_image, 'ops': (),
             'opacity': 1.0, 'visible': True, 'x': 0, 'y': 0, 'is_draw_layer': True
         }
         self.layers.append(layer_info)
         self.add_to_history()
         return len(self.layers) - 1
 
+    def place_upright(self, layer_info):
+        """
+        تجهيز طبقة جديدة لتظهر معتدلة في أعلى يسار العرض مهما كان اتجاه المستند
+        (تُدار صورتها بعكس الاتجاه، وهي صغيرة عادة، وتُحسب إحداثياتها في المستند).
+        """
+        if self.orientation == orient.IDENTITY: return
+        image = orient.orient_image(layer_info['image'], orient.inverse(self.orientation))
+        box = self.to_document_box((0, 0, layer_info['image'].width, layer_info['image'].height))
+        layer_info['image'] = layer_info['source'] = image
+        layer_info['x'], layer_info['y'] = int(box[0]), int(box[1])
+
+    def get_text_params(self, layer_index):
+        """معاملات طبقة النص (text, size, color) أو None إذا لم تكن طبقة نص."""
+        if not (0 <= layer_index < len(self.layers)): return None
+        params = self.layers[layer_index].get('text')
+        if not params: return None
+        return {'text': params['text'], 'size': params['size'], 'color': params['color']}
+
+    def update_text_layer(self, layer_index, text, size, color, add_history=True):
+        """
+        تغيير نص أو خط أو لون طبقة نص. يُعاد رسم النص فقط إذا تغيرت المعاملات (والنتائج السابقة
+        محفوظة في ذاكرة render_text)، مع الحفاظ على موضع الطبقة وسلسلة عملياتها.
+        add_history=False مناسب للمعاينة الحية أثناء الكتابة.
+        """
+        params = self.get_text_params(layer_index)
+        if params is None: return False
+        color = tuple(color)
+        if params == {'text': text, 'size': size, 'color': color}: return False
+
+        layer = self.layers[layer_index]
+        orientation = layer['text']['orientation']
+        self.compositor.invalidate_layer(layer, layer_index)
+        layer['text'] = {'text': text, 'size': size, 'color': color, 'orientation': orientation}
+        layer['name'] = f'نص: "{text[:10]}..."'
+        layer['source'] = orient.orient_image(render_text(text, size, color), orient.inverse(orientation))
+        layer['image'] = self.op_cache.evaluate(layer['source'], layer['ops'])
+        self.compositor.invalidate_layer(layer, layer_index)
+        self.record_macro_step('edit_text', layer_index, text,
+                               relative_text_size(size, self.get_document_size()), list(color), coalesce=True)
+        if add_history:
+            self.add_to_history()
+        else:
+            self.adjustment_preview = None
+        return True
+
     def remove_layer(self, layer_index):
         """حذف طبقة معينة (لا يمكن حذف الطبقة الأساسية)."""
         if layer_index > 0 and layer_index < len(self.layers):
+            self.record_macro_step('remove_layer', layer_index)
+            self.compositor.invalidate_layer(self.layers[layer_index])
             del self.layers[layer_index]
             self.add_to_history()
             return True
         return False
 
+    def set_layer_opacity(self, layer_index, opacity):
+        """تغيير شفافية طبقة (بدون إضافة للتاريخ، مناسب للتحديث الحي)."""
+        if not (0 <= layer_index < len(self.layers)): return
+        layer = self.layers[layer_index]
+        if layer['opacity'] == opacity: return
+        self.record_macro_step('opacity', layer_index, opacity, coalesce=True)
+        layer['opacity'] = opacity
+        self.compositor.set_active_layer(layer_index)
+        self.compositor.invalidate_layer(layer, layer_index)
+
+    def move_layer(self, layer_index, x, y):
+        """تحريك طبقة إلى موضع جديد (بدون إضافة للتاريخ، مناسب للسحب الحي)."""
+        if not (0 <= layer_index < len(self.layers)): return
+        layer = self.layers[layer_index]
+        if (layer['x'], layer['y']) == (x, y): return
+        width, height = self.get_document_size()
+        self.record_macro_step('move', layer_index, x / width, y / height, coalesce=True)
+        # المنطقة القديمة والجديدة كلاهما تحتاج إعادة دمج
+        self.compositor.set_active_layer(layer_index)
+        self.compositor.invalidate_layer(layer, layer_index)
+        layer['x'], layer['y'] = x, y
+        self.compositor.invalidate_layer(layer, layer_index)
+
     # --- دوال معالجة الصور ---
-    def apply_filter(self, layer_index, filter_type):
-        """تطبيق فلتر على طبقة معينة."""
-        if 0 <= layer_index < len(self.layers):
-            self.layers[layer_index]['image'] = self.layers[layer_index]['image'].filter(filter_type)
-            self.add_to_history()
+    # الفلاتر والتعديلات والعتبة لا تغير الصورة الأصلية للطبقة (source)، بل تُضاف لسلسلة
+    # عمليات الطبقة (ops)، و layer['image'] هي نتيجة تطبيق السلسلة (محفوظة في op_cache لكل خطوة).
+    def apply_filter(self, layer_index, filter_name):
+        """إضافة فلتر (بالاسم من FILTERS) لسلسلة عمليات طبقة."""
+        self.add_layer_op(layer_index, filter_op(filter_name, self.orientation))
 
     def apply_adjustments(self, layer_index, brightness, contrast, saturation, sharpness):
-        """تطبيق التعديلات (سطوع، تباين...) على طبقة."""
+        """إضافة التعديلات (سطوع، تباين...) لسلسلة عمليات طبقة."""
+        self.add_layer_op(layer_index, ('adjust', brightness, contrast, saturation, sharpness))
+
+    def apply_threshold(self, layer_index, value):
+        """إضافة فلتر العتبة لسلسلة عمليات طبقة."""
+        self.add_layer_op(layer_index, ('threshold', value))
+
+    def filter_job(self, layer_index, filter_name):
+        return self.layer_op_job(layer_index, filter_op(filter_name, self.orientation))
+
+    def adjustments_job(self, layer_index, brightness, contrast, saturation, sharpness):
+        return self.layer_op_job(layer_index, ('adjust', brightness, contrast, saturation, sharpness))
+
+    def threshold_job(self, layer_index, value):
+        return self.layer_op_job(layer_index, ('threshold', value))
+
+    def add_layer_op(self, layer_index, op):
+        """إضافة عملية في نهاية سلسلة عمليات طبقة."""
         if not (0 <= layer_index < len(self.layers)): return
-        
-        image = self.layers[layer_index]['image']
-        enhancer = ImageEnhance.Brightness(image); image = enhancer.enhance(brightness)
-        enhancer = ImageEnhance.Contrast(image); image = enhancer.enhance(contrast)
-        enhancer = ImageEnhance.Color(image); image = enhancer.enhance(saturation)
-        enhancer = ImageEnhance.Sharpness(image); image = enhancer.enhance(sharpness)
-        
-        self.layers[layer_index]['image'] = image
+        self.record_macro_step('op', layer_index, list(op))
+        self.set_layer_ops(layer_index, self.layers[layer_index]['ops'] + (op,))
+
+    def remove_layer_op(self, layer_index, op_index):
+        """حذف عملية من سلسلة عمليات طبقة (يُعاد الحساب من موضعها فقط)."""
+        if not (0 <= layer_index < len(self.layers)): return False
+        ops = self.layers[layer_index]['ops']
+        if not (0 <= op_index < len(ops)): return False
+        if self.macro:
+            relative_index = self.macro_op_index(layer_index, op_index)
+            if relative_index is not None:
+                self.record_macro_step('remove_op', layer_index, relative_index)
+        self.set_layer_ops(layer_index, ops[:op_index] + ops[op_index + 1:])
+        return True
+
+    def set_layer_ops(self, layer_index, ops):
+        """استبدال سلسلة عمليات طبقة وحساب النتيجة بدءاً من أطول بادئة محفوظة."""
+        layer = self.layers[layer_index]
+        layer['ops'] = tuple(ops)
+        layer['image'] = self.op_cache.evaluate(layer['source'], layer['ops'])
+        self.compositor.invalidate_layer(layer, layer_index)
         self.add_to_history()
 
-    def apply_transform(self, operation):
-        """تطبيق عمليات التدوير والقلب على كل الطبقات."""
-        if not self.layers: return
+    def get_layer_op_labels(self, layer_index):
+        """أوصاف عمليات طبقة لعرضها في الواجهة."""
+        if not (0 <= layer_index < len(self.layers)): return []
+        return [describe_op(op) for op in self.layers[layer_index]['ops']]
 
-        base_size = self.layers[0]['image'].size
-        new_base_size = base_size
-        if operation in ['rotate_left', 'rotate_right']:
-            new_base_size = (base_size[1], base_size[0])
+    def bake_layer(self, layer_index):
+        """
+        جعل نتيجة سلسلة العمليات هي الصورة الأصلية للطبقة قبل تعديلها في مكانها (الرسم).
+        لا يضيف للتاريخ: الحالة السابقة في التاريخ تحتفظ بالسلسلة القديمة.
+        """
+        layer = self.layers[layer_index]
+        if layer['ops']:
+            layer['source'] = layer['image']
+            layer['ops'] = ()
+        elif layer.get('text'):
+            # صورة النص مشتركة في ذاكرة render_text فلا يجوز الرسم عليها
+            layer['image'] = layer['source'] = layer['image'].copy()
+        # بعد الرسم تصبح طبقة النص صورة عادية
+        layer['text'] = None
+        self.op_cache.discard(layer['image'])
 
-        for layer in self.layers:
-            img = layer['image']
-            x, y = layer['x'], layer['y']
-            
-            if operation == 'rotate_left':
-                img = img.rotate(90, expand=True)
-                layer['x'], layer['y'] = y, new_base_size[1] - (x + layer['image'].size[0])
-            elif operation == 'rotate_right':
-                img = img.rotate(-90, expand=True)
-                layer['x'], layer['y'] = new_base_size[0] - (y + layer['image'].size[1]), x
-            elif operation == 'flip_horizontal':
-                img = ImageOps.mirror(img)
-                layer['x'] = new_base_size[0] - (x + img.width)
-            elif operation == 'flip_vertical':
-                img = ImageOps.flip(img)
-                layer['y'] = new_base_size[1] - (y + img.height)
-            
-            layer['image'] = img
-        
-        self.add_to_history()
+    def layer_op_job(self, layer_index, op):
+        """
+        تجهيز إضافة عملية لطبقة كعملية (compute, commit) للتنفيذ في الخلفية (انظر OperationExecutor).
+        compute تطبق العملية على الصورة الحالية للطبقة فقط، و commit تضيفها للسلسلة.
+        """
+        if not (0 <= layer_index < len(self.layers)): return None
+        source_image = self.layers[layer_index]['image']
+        state = self.edit_state()
 
-    def apply_threshold(self, layer_index, value):
-        """تطبيق فلتر العتبة على طبقة معينة."""
-        if not (0 <= layer_index < len(self.layers)): return
-        
+        def compute(progress_callback):
+            return apply_op(source_image, op, progress_callback)
+
+        def commit(result):
+            return self.commit_layer_op(layer_index, state, op, result)
+
+        return compute, commit
+
+    def commit_layer_op(self, layer_index, state, op, result):
+        """
+        إضافة عملية حُسبت نتيجتها مسبقاً (من صورة الطبقة عند edit_state() == state) لسلسلة عمليات طبقة.
+        إذا تغير المستند أثناء الحساب (ومنه الرسم أو التراجع داخل نفس الصورة) يتم تجاهل النتيجة ويُرجع False.
+        """
+        if not (0 <= layer_index < len(self.layers)): return False
+        if self.stroke or self.edit_state() != state: return False
         layer = self.layers[layer_index]
-        grayscale_img = layer['image'].convert("L")
-        threshold_img = grayscale_img.point(lambda p: 255 if p > value else 0, '1')
-        layer['image'] = threshold_img.convert("RGBA")
+        ops = layer['ops'] + (op,)
+        self.op_cache.store(layer['source'], ops, result)
+        self.record_macro_step('op', layer_index, list(op))
+        self.set_layer_ops(layer_index, ops)
+        return True
+
+    # --- دوال معاينة التعديلات ---
+    def start_adjustment_preview(self, layer_index, max_width, max_height):
+        """
+        تجهيز معاينة حية للتعديلات على نسخة مصغرة بحجم الشاشة:
+        تُصغر الطبقات مرة واحدة، وتُسطح الطبقات تحت الطبقة النشطة وفوقها.
+        """
+        if not (0 <= layer_index < len(self.layers)): return
+        left, top, right, bottom = self.get_visible_box()
+        width, height = right - left, bottom - top
+        factor = max(1, int(min(width / max(1, max_width), height / max(1, max_height))))
+
+        small_layers = []
+        for layer in self.layers:
+            small = dict(layer)
+            small['image'] = layer['image'].reduce(factor) if factor > 1 else layer['image']
+            small['x'], small['y'] = layer['x'] // factor, layer['y'] // factor
+            small_layers.append(small)
+
+        size = small_layers[0]['image'].size
+        self.adjustment_preview = {
+            'layer_index': layer_index,
+            'factor': factor,
+            'layer': small_layers[layer_index],
+            'below': flatten_layers(small_layers[:layer_index], size),
+            'above': flatten_layers(small_layers[layer_index + 1:], size),
+            'values': (1.0, 1.0, 1.0, 1.0),
+            'image': None,
+        }
+
+    def set_adjustment_preview_values(self, brightness, contrast, saturation, sharpness):
+        """تحديث قيم المعاينة الحية."""
+        if not self.adjustment_preview: return
+        values = (brightness, contrast, saturation, sharpness)
+        if values != self.adjustment_preview['values']:
+            self.adjustment_preview['values'] = values
+            self.adjustment_preview['image'] = None
+
+    def get_adjustment_preview_image(self):
+        """دمج النسخة المصغرة المعدلة للطبقة النشطة بين الطبقات المسطحة (تحت/فوق)."""
+        preview = self.adjustment_preview
+        if not preview: return None
+        if preview['image'] is None:
+            layer = dict(preview['layer'])
+            layer['image'] = adjust_image(layer['image'], *preview['values'])
+            image = preview['below'].copy()
+            blend_layer(image, layer, (0, 0, image.width, image.height))
+            image.alpha_composite(preview['above'])
+            if self.crop_rect:
+                factor = preview['factor']
+                image = image.crop(tuple(v // factor for v in self.crop_rect))
+            preview['image'] = orient.orient_image(image, self.orientation)
+        return preview['image']
+
+    def cancel_adjustment_preview(self, layer_index=None):
+        """إنهاء المعاينة الحية دون تعديل الطبقة."""
+        self.adjustment_preview = None
+
+    def apply_transform(self, operation):
+        """
+        تدوير أو قلب المستند. لا تتغير بكسلات الطبقات: يتغير اتجاه المستند فقط ويُطبق
+        على النسخة المعروضة وعند التصدير.
+        """
+        if not self.layers: return
+        self.orientation = orient.compose(self.orientation, operation)
+        self.record_macro_step('transform', operation)
         self.add_to_history()
 
     def apply_crop(self, crop_box):
-        """قص كل الطبقات بناءً على مربع التحديد."""
-        if not self.layers or crop_box[0] >= crop_box[2] or crop_box[1] >= crop_box[3]:
-            return
+        """
+        قص المستند بمربع التحديد (بإحداثيات العرض). لا تُحذف أي بكسلات: يتغير مستطيل القص فقط
+        ويُطبق على العرض والتصدير، فإعادة القص بمساحة أكبر (بعد reset_crop) لا تكلف شيئاً.
+        """
+        if not self.layers or crop_box[0] >= crop_box[2] or crop_box[1] >= crop_box[3]: return
+        x1, y1, x2, y2 = (int(round(v)) for v in self.to_document_box(crop_box))
+        left, top, right, bottom = self.get_visible_box()
+        box = (max(left, x1), max(top, y1), min(right, x2), min(bottom, y2))
+        if box[0] >= box[2] or box[1] >= box[3]: return
+        self.crop_rect = box
+        self.record_macro_step('crop', relative_box(box, self.get_document_size()))
+        self.add_to_history()
 
-        for layer in self.layers:
-            layer['image'] = layer['image'].crop(crop_box)
-            layer['x'] -= crop_box[0]
-            layer['y'] -= crop_box[1]
-        
+    def reset_crop(self):
+        """إلغاء القص وإظهار المستند كاملاً."""
+        if self.crop_rect is None: return
+        self.crop_rect = None
+        self.record_macro_step('crop', None)
         self.add_to_history()
 
-    def draw_on_layer(self, layer_index, last_point, current_point):
-        """الرسم على طبقة معينة."""
+    def flatten_crop(self):
+        run_job(self.flatten_crop_job())
+
+    def flatten_crop_job(self):
+        """
+        تثبيت القص: حذف البكسلات خارج مستطيل القص من كل الطبقات فعلياً (لتوفير الذاكرة)،
+        كعملية (compute, commit) للتنفيذ في الخلفية.
+        """
+        if not self.layers or self.crop_rect is None: return None
+        crop_box = self.crop_rect
+
+        def crop(layer):
+            # قص الجزء من الطبقة الذي يقع داخل المربع (حسب موضع الطبقة)
+            x, y = layer['x'], layer['y']
+            width, height = layer['image'].size
+            x1, y1 = max(crop_box[0], x), max(crop_box[1], y)
+            x2, y2 = min(crop_box[2], x + width), min(crop_box[3], y + height)
+            if x1 < x2 and y1 < y2:
+                layer['image'] = layer['source'] = layer['image'].crop((x1 - x, y1 - y, x2 - x, y2 - y))
+                layer['ops'] = ()
+                layer['text'] = None
+                x, y = x1, y1
+            layer['x'], layer['y'] = x - crop_box[0], y - crop_box[1]
+
+        def clear_crop_rect():
+            self.crop_rect = None
+            if self.macro:
+                # التثبيت يحذف سلاسل العمليات، فكل العمليات بعده يعيدها الماكرو
+                self.macro['base_ops'] = {}
+            self.record_macro_step('flatten_crop')
+
+        return self.layers_job(crop, clear_crop_rect)
+
+    def layers_job(self, change_layer, on_commit=None):
+        """
+        عملية تغير كل الطبقات: compute تطبق change_layer على نسخ من الطبقات (طبقة بعد طبقة مع تقرير التقدم)،
+        و commit تستبدل الطبقات بها (وتستدعي on_commit) إذا لم يتغير المستند أثناء الحساب
+        (تحريك، شفافية، عمليات، رسم بالفرشاة، تراجع، ...)، وإلا تُتجاهل النتيجة.
+        """
+        layers = [dict(layer) for layer in self.layers]
+        state = self.edit_state()
+
+        def compute(progress_callback):
+            for i, layer in enumerate(layers):
+                change_layer(layer)
+                if progress_callback:
+                    progress_callback((i + 1) / len(layers))
+            return layers
+
+        def commit(result):
+            if self.stroke or self.edit_state() != state:
+                return False
+            self.layers = result
+            if on_commit:
+                on_commit()
+            self.compositor.invalidate()
+            self.add_to_history()
+            return True
+
+        return compute, commit
+
+    def edit_state(self):
+        """بصمة حالة المستند للتحقق من أنه لم يتغير أثناء عملية في الخلفية."""
+        layers = tuple((id(layer['image']), id(layer['source']), layer['ops'], layer['x'], layer['y'],
+                        layer['opacity'], layer['visible'], layer.get('text')) for layer in self.layers)
+        return layers, self.pixel_edits, self.orientation, self.crop_rect
+
+    # --- دوال الرسم بالفرشاة ---
+    def begin_stroke(self, layer_index, point):
+        """بدء ضربة فرشاة جديدة على طبقة معينة (point بإحداثيات العرض)."""
         if not (0 <= layer_index < len(self.layers)): return
-        
-        draw_layer = self.layers[layer_index]['image']
-        draw = ImageDraw.Draw(draw_layer)
-        
-        if last_point:
-            draw.line([last_point, current_point], fill=self.brush_color, width=self.brush_size)
-        else:
-            radius = self.brush_size / 2
-            bbox = (current_point[0] - radius, current_point[1] - radius, 
-                    current_point[0] + radius, current_point[1] + radius)
-            draw.ellipse(bbox, fill=self.brush_color)
-        self.add_to_history() # حفظ الرسم في التاريخ
+        self.end_stroke()
+        self.bake_layer(layer_index)
+        point = self.to_document_point(point)
+        self.stroke = BrushStroke(self.layers[layer_index]['image'], self.brush_size, self.brush_color)
+        self.stroke_layer_index = layer_index
+        self.compositor.set_active_layer(layer_index)
+        self._add_stroke_point(point)
+
+    def continue_stroke(self, point):
+        """إضافة نقطة (بإحداثيات العرض) للضربة الحالية وإعادة دمج المنطقة التي تغيرت فقط."""
+        if not self.stroke: return
+        self._add_stroke_point(self.to_document_point(point))
+
+    def _add_stroke_point(self, point):
+        layer = self.layers[self.stroke_layer_index]
+        box = self.stroke.add_point((point[0] - layer['x'], point[1] - layer['y']))
+        if box:
+            self.pixel_edits += 1
+            self.compositor.invalidate(offset_box(box, layer), self.stroke_layer_index)
+
+    def end_stroke(self):
+        """إنهاء الضربة الحالية وحفظها في التاريخ كخطوة واحدة."""
+        if not self.stroke: return
+        layer = self.layers[self.stroke_layer_index]
+        box, patches = self.stroke.finish()
+        if box:
+            self.compositor.invalidate(offset_box(box, layer), self.stroke_layer_index)
+        self.stroke = None
+        self.stroke_layer_index = None
+        if patches:
+            self.add_to_history(patches)
 
     # --- دوال الحصول على الحالة ---
     def get_composited_image(self):
-        """دمج كل الطبقات المرئية في صورة واحدة للعرض أو الحفظ."""
-        if not self.layers: return None
-        
-        base_size = self.layers[0]['image'].size
-        composite = Image.new('RGBA', base_size, (0, 0, 0, 0))
-        
-        for layer in self.layers:
-            if layer['visible']:
-                img_to_paste = layer['image'].copy()
-                if layer['opacity'] < 1.0:
-                    alpha = img_to_paste.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(layer['opacity'])
-                    img_to_paste.putalpha(alpha)
-                composite.paste(img_to_paste, (layer['x'], layer['y']), img_to_paste)
+        """
+        دمج كل الطبقات المرئية في صورة واحدة للعرض أو الحفظ.
+        يعيد دمج المربعات التي تغيرت فقط منذ آخر استدعاء، والصورة المرجعة مخزنة داخلياً فلا يجب تعديلها.
+        """
+        composite = self.compositor.render(self.layers)
+        self.preview.invalidate(self.compositor.changed_boxes)
         return composite
 
+    def get_viewport_image(self, box, size, interactive=False):
+        """
+        جزء من الصورة كما تُعرض للكانفاس: box بإحداثيات الصورة المعروضة بالدقة الكاملة (أعداد عشرية)،
+        و size أبعاد الناتج بالبكسل. تُدمج فقط المربعات المتسخة التي تظهر في box، ويُعاد تحجيم الجزء
+        الظاهر فقط من أقرب مستوى في هرم المعاينة، فلا تكلف رؤية جزء مكبر من صورة ضخمة إلا ذلك الجزء.
+        """
+        full_size = self.get_image_size()
+        if full_size is None: return None
+        scale = size[0] / (box[2] - box[0])
+        if scale >= 1:
+            # التكبير فوق 100% يعرض البكسلات كما هي
+            resample = Image.Resampling.NEAREST
+        else:
+            resample = Image.Resampling.BILINEAR if interactive else Image.Resampling.LANCZOS
+
+        # أثناء التحميل أو المعاينة الحية توجد نسخة مصغرة من الصورة المعروضة كاملة
+        preview = self.loading['proxy'] if self.loading else self.get_adjustment_preview_image()
+        if preview is not None:
+            return scaled_region(preview, box, full_size, size, resample)
+
+        doc_box = self.to_document_box(box)
+        # هامش لمدى فلتر التحجيم حول الجزء الظاهر
+        margin = int(8 / min(1.0, scale)) + 1
+        composite = self.compositor.render(self.layers, (doc_box[0] - margin, doc_box[1] - margin,
+                                                         doc_box[2] + margin, doc_box[3] + margin))
+        self.preview.invalidate(self.compositor.changed_boxes)
+        level = self.preview.get_level_for_scale(composite, scale)
+        doc_size = orient.oriented_size(size, orient.inverse(self.orientation))
+        image = scaled_region(level, doc_box, composite.size, doc_size, resample)
+        return orient.orient_image(image, self.orientation)
+
+    def get_export_image(self):
+        """الصورة النهائية بالدقة الكاملة بعد تطبيق القص والاتجاه (للحفظ والتصدير)."""
+        composite = self.get_composited_image()
+        if not composite: return None
+        if self.crop_rect:
+            composite = composite.crop(self.crop_rect)
+        return orient.orient_image(composite, self.orientation)
+
+    def get_image_size(self):
+        """أبعاد الصورة بالدقة الكاملة كما تُعرض (بعد تطبيق القص والاتجاه)."""
+        if self.loading: return self.loading['size']
+        if not self.layers: return None
+        left, top, right, bottom = self.get_visible_box()
+        return orient.oriented_size((right - left, bottom - top), self.orientation)
+
+    def get_document_size(self):
+        """أبعاد المستند (الطبقة الأساسية) قبل تطبيق القص والاتجاه."""
+        if not self.layers: return None
+        return self.layers[0]['image'].size
+
+    def get_visible_box(self):
+        """الجزء الظاهر من المستند (مستطيل القص أو المستند كاملاً)."""
+        if self.crop_rect: return self.crop_rect
+        width, height = self.get_document_size()
+        return (0, 0, width, height)
+
+    # --- دوال تحويل الإحداثيات بين العرض والمستند ---
+    def to_document_point(self, point):
+        left, top, right, bottom = self.get_visible_box()
+        x, y = orient.unmap_point(point, (right - left, bottom - top), self.orientation)
+        return x + left, y + top
+
+    def to_document_box(self, box):
+        left, top, right, bottom = self.get_visible_box()
+        x1, y1, x2, y2 = orient.unmap_box(box, (right - left, bottom - top), self.orientation)
+        return x1 + left, y1 + top, x2 + left, y2 + top
+
+    def to_document_vector(self, dx, dy):
+        """تحويل إزاحة من إحداثيات العرض (مثل سحب طبقة) إلى إحداثيات المستند."""
+        return orient.unmap_vector(dx, dy, self.orientation)
+
     # --- دوال إدارة التاريخ ---
-    def add_to_history(self):
-        """إضافة الحالة الحالية للطبقات إلى قائمة التاريخ."""
-        if self.history_index < len(self.history) - 1:
-            self.history = self.history[:self.history_index + 1]
-        self.history.append(copy.deepcopy(self.layers))
-        self.history_index += 1
+    def add_to_history(self, patches=None):
+        """
+        إضافة الحالة الحالية للطبقات إلى التاريخ.
+        patches: رُقع (image, box, before, after) للتعديلات التي كُتبت داخل صورة موجودة.
+        """
+        macro_length = macro_base_ops = None
+        if self.macro:
+            macro_length = self.macro['pushed'] = self.macro['length']
+            macro_base_ops = (self.macro['session'], dict(self.macro['base_ops']))
+        self.history.push(self.layers, patches, {'orientation': self.orientation, 'crop_rect': self.crop_rect,
+                                                 'macro_length': macro_length, 'macro_base_ops': macro_base_ops})
+        self.journal_state(patches)
         self.unsaved_changes = True
+        # أي تغيير مؤكد يجعل النسخة المصغرة للمعاينة قديمة
+        self.adjustment_preview = None
 
     def reset_history(self):
         """إعادة تعيين قائمة التاريخ عند فتح صورة جديدة."""
-        self.history = []
-        self.history_index = -1
+        self.history.clear()
         self.add_to_history()
 
     def undo(self):
         """العودة إلى الحالة السابقة في التاريخ."""
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.layers = copy.deepcopy(self.history[self.history_index])
-            return True
-        return False
+        result = self.history.undo()
+        if result is None: return False
+        self.restore_layers(*result)
+        return True
 
     def redo(self):
         """التقدم إلى الحالة التالية في التاريخ."""
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.layers = copy.deepcopy(self.history[self.history_index])
-            return True
-        return False
+        result = self.history.redo()
+        if result is None: return False
+        self.restore_layers(*result)
+        return True
+
+    def can_undo(self):
+        return self.history.can_undo()
+
+    def can_redo(self):
+        return self.history.can_redo()
+
+    def get_history_memory_usage(self):
+        """حجم بيانات البكسلات التي يحتفظ بها التاريخ (مع ذاكرة سلاسل العمليات) في الذاكرة بالبايت."""
+        return self.history.memory_usage()
+
+    def set_history_memory_budget(self, memory_budget):
+        """تحديد الحد الأقصى لحجم التاريخ في الذاكرة، وما يزيد عنه يُضغط ويُنقل إلى القرص."""
+        self.history.set_memory_budget(memory_budget)
+
+    def restore_layers(self, layers, patches, document):
+        """استبدال الطبقات (وخصائص المستند) بحالة من التاريخ مع إعادة دمج ما تغير فقط."""
+        self.orientation = document.get('orientation', orient.IDENTITY)
+        self.crop_rect = document.get('crop_rect')
+        if self.macro:
+            # التراجع والإعادة أثناء التسجيل يتراجعان عن خطوات الماكرو أيضاً
+            length = min(document.get('macro_length') or 0, len(self.macro['steps']))
+            self.macro['length'] = self.macro['pushed'] = length
+            base_ops = document.get('macro_base_ops')
+            if base_ops and base_ops[0] == self.macro['session']:
+                self.macro['base_ops'] = dict(base_ops[1])
+            else:
+                self.macro['base_ops'] = dict(self.macro['start_base_ops'])
+        for image, box, before, after in patches:
+            self.op_cache.discard(image)
+        # التاريخ كتب الرُقع داخل الصور نفسها
+        self.pixel_edits += 1
+        for layer in layers:
+            # الصور المشتقة التي حذفها التاريخ لتوفير الذاكرة تُعاد من سلسلة العمليات
+            if layer['image'] is None:
+                layer['image'] = self.op_cache.evaluate(layer['source'], layer['ops'])
+
+        old_layers = self.layers
+        self.layers = layers
+        self.adjustment_preview = None
+        if len(old_layers) != len(layers):
+            self.compositor.invalidate()
+            return
+
+        for index, (old, new) in enumerate(zip(old_layers, layers)):
+            if old['image'] is not new['image'] or any(
+                    old[key] != new[key] for key in ('x', 'y', 'opacity', 'visible')):
+                self.compositor.invalidate_layer(old, index)
+                self.compositor.invalidate_layer(new, index)
+        for image, box, before, after in patches:
+            for index, layer in enumerate(layers):
+                if layer['image'] is image:
+                    self.compositor.invalidate(offset_box(box, layer), index)
+        self.journal_state(patches)
+
+    # --- دوال الحفظ التلقائي ---
+    def start_journal(self, kind, path):
+        """
+        بدء سجل الحفظ التلقائي لمستند فُتح (أو حُفظ) في ملف: صور الطبقات الحالية تُقرأ من الملف
+        عند الاسترجاع فلا تُكتب في السجل.
+        kind 'saved': الصورة حُفظت مدمجة فلا يمكن إعادة الطبقات منها، فتُكتب صورها الأصلية في أول سجل.
+        """
+        self.journal_images = {}
+        self.journal_next_number = 0
+        sources, new_images, blobs = [], [], []
+        for layer in self.layers:
+            number, is_new = self._journal_image_number(layer['source'])
+            sources.append(number)
+            if kind == 'saved' and is_new:
+                new_images.append(number)
+                blobs.append(layer['source'].copy())
+        self.journal.start({'editor': 'photo', 'open': kind, 'path': os.path.abspath(path), 'sources': sources,
+                            'images': new_images}, blobs)
+
+    def journal_state(self, patches=None):
+        """
+        تسجيل حالة المستند بعد تغيير: خصائص الطبقات وسلاسل عملياتها، والصور الأصلية الجديدة فقط،
+        ومناطق البكسلات التي تغيرت داخل صور مسجلة من قبل (رُقع الرسم والتراجع).
+        """
+        if not self.journal.active: return
+        blobs, new_images, regions, layers = [], [], [], []
+        for layer in self.layers:
+            number, is_new = self._journal_image_number(layer['source'])
+            if is_new:
+                # نسخة لأن الكتابة تتم في الخلفية والصورة قد تُعدل في مكانها بعد ذلك
+                new_images.append(number)
+                blobs.append(layer['source'].copy())
+            layers.append({**layer_to_json(layer), 'source': number})
+        for image, box, before, after in patches or ():
+            entry = self.journal_images.get(id(image))
+            if entry and entry[0]() is image and entry[1] not in new_images:
+                regions.append([entry[1], list(box)])
+                blobs.append(image.crop(box))
+
+        self.journal.record({
+            'kind': 'state',
+            'orientation': list(self.orientation),
+            'crop_rect': self.crop_rect,
+            'layers': layers, 'images': new_images, 'regions': regions,
+        }, blobs)
+
+    def _journal_image_number(self, image):
+        """رقم الصورة في السجل، و True إذا كانت جديدة (لم تُكتب فيه من قبل)."""
+        entry = self.journal_images.get(id(image))
+        if entry and entry[0]() is image:
+            return entry[1], False
+        number = self.journal_next_number
+        self.journal_next_number += 1
+        self.journal_images[id(image)] = (weakref.ref(image), number)
+        return number, True
+
+    def read_recovery(self):
+        """قراءة سجل الحفظ التلقائي المتبقي من جلسة سابقة. يرجع None إذا لم يوجد عمل غير محفوظ فيه."""
+        if not self.journal.exists(): return None
+        try:
+            records = self.journal.read()
+        except (OSError, ValueError):
+            return None
+        if len(records) < 2 or records[0][0].get('editor') != 'photo' or records[-1][0]['kind'] == 'saved':
+            return None
+        return records
+
+    def recover(self, records):
+        """إعادة بناء آخر حالة مسجلة: فتح الملف الأصلي ثم تطبيق الصور والمناطق المسجلة بالترتيب."""
+        start, start_blobs = records[0]
+        if start['open'] == 'project':
+            self.open_project(start['path'])
+        elif start['open'] == 'image':
+            self.load_image(start['path'])
+        else:
+            # بعد حفظ صورة مدمجة: صور الطبقات في أول سجل وليست في الملف
+            self.image_path = start['path']
+            self.loading = None
+            self.project = None
+            self.op_cache.clear()
+        if start['open'] == 'saved':
+            images = dict(zip(start['images'], start_blobs))
+        else:
+            images = {number: layer['source'] for number, layer in zip(start['sources'], self.layers)}
+
+        state, changed = None, []
+        for meta, blobs in records[1:]:
+            if meta['kind'] != 'state': continue
+            blobs = iter(blobs)
+            for number in meta['images']:
+                images[number] = next(blobs)
+            for number, box in meta['regions']:
+                images[number].paste(next(blobs), tuple(box[:2]))
+                changed.append((images[number], tuple(box)))
+            state = meta
+        if state is None: return
+
+        self.layers = [layer_from_json(entry, images[entry['source']]) for entry in state['layers']]
+        for layer in self.layers:
+            layer['image'] = self.op_cache.evaluate(layer['source'], layer['ops'])
+        self.orientation = tuple(state['orientation'])
+        self.crop_rect = tuple(state['crop_rect']) if state['crop_rect'] else None
+        self.compositor.invalidate()
+        if start['open'] == 'saved':
+            # سجل جديد بصور الطبقات المسترجعة نفسها (reset_history يسجل حالة الطبقات بعده)
+            self.start_journal('saved', start['path'])
+            self.reset_history()
+            return
+        self.reset_history()
+        # الصور المفتوحة من الملف الأصلي لا تُكتب في السجل الجديد، فتُسجل المناطق التي تغيرت فيها
+        self.journal_state([(image, box, None, None) for image, box in changed])
+
+    def close_journal(self):
+        """حذف سجل الحفظ التلقائي عند الخروج الطبيعي."""
+        self.journal.discard()
+        self.journal.flush()
+
+    # --- دوال تسجيل الماكرو ---
+    def start_macro(self):
+        """
+        بدء تسجيل العمليات (فلاتر، تعديلات، تدوير/قلب، قص، نصوص) كماكرو يمكن إعادته على صور أخرى.
+        تُسجل العمليات على الصورة الأساسية وطبقات النص المضافة أثناء التسجيل فقط، والتراجع يحذف خطواته.
+        """
+        self.macro_session += 1
+        # base_ops: عدد العمليات الموجودة قبل التسجيل في سلسلة كل طبقة (رقمها في الماكرو)، فهي لا تُعاد
+        # وأرقام العمليات المسجلة تُحسب بعدها
+        base_ops = {0: len(self.layers[0]['ops'])} if self.layers else {}
+        self.macro = {'steps': [], 'length': 0, 'pushed': 0, 'session': self.macro_session, 'next_layer': 1,
+                      'base_ops': base_ops, 'start_base_ops': dict(base_ops)}
+
+    def stop_macro(self):
+        """إنهاء التسجيل وإرجاع خطوات الماكرو (انظر macro.py)."""
+        if not self.macro: return []
+        steps = self.macro['steps'][:self.macro['length']]
+        self.macro = None
+        return steps
+
+    def is_recording_macro(self):
+        return self.macro is not None
+
+    def record_macro_step(self, kind, *args, coalesce=False):
+        """
+        إضافة خطوة للماكرو أثناء التسجيل. خطوات الطبقات تستقبل رقم الطبقة في المستند ويُحول لرقمها في الماكرو.
+        coalesce: الخطوة تحل محل السابقة لنفس الطبقة منذ آخر خطوة في التاريخ (مثل السحب الحي).
+        """
+        if not self.macro: return
+        if kind in MACRO_LAYER_STEPS:
+            number = self.macro_layer_number(args[0])
+            # طبقة لا يعيدها الماكرو (موجودة قبل التسجيل، أو صورة مضافة، أو طبقة رسم)
+            if number is None: return
+            args = (number,) + args[1:]
+        steps = self.macro['steps']
+        del steps[self.macro['length']:]
+        step = [kind, *args]
+        if coalesce and len(steps) > self.macro['pushed'] and steps[-1][:2] == step[:2]:
+            steps[-1] = step
+        else:
+            steps.append(step)
+        self.macro['length'] = len(steps)
+
+    def macro_op_index(self, layer_index, op_index):
+        """
+        رقم عملية في سلسلة طبقة كما يعيدها الماكرو (بدون العمليات الموجودة قبل التسجيل)،
+        أو None إذا كانت العملية موجودة قبل التسجيل أو كانت الطبقة لا يعيدها الماكرو.
+        """
+        number = self.macro_layer_number(layer_index)
+        if number is None: return None
+        base = self.macro['base_ops'].get(number, 0)
+        if op_index < base:
+            # حذف عملية سابقة للتسجيل لا يغير ما يعيده الماكرو، لكن يقل عدد العمليات قبل المسجلة
+            self.macro['base_ops'][number] = base - 1
+            return None
+        return op_index - base
+
+    def macro_layer_number(self, layer_index):
+        if layer_index == 0: return 0
+        tag = self.layers[layer_index].get('macro_layer')
+        if tag and tag[0] == self.macro['session']:
+            return tag[1]
+        return None
+
+    # --- دوال المعالجة الدفعية ---
+    def process_batch_macro(self, source_folder, steps, save_folder, progress_callback):
+        """
+        تطبيق ماكرو مسجل على كل صور مجلد (في خيط منفصل، والمعالجة في محرك الدفعات متعدد العمليات).
+        progress_callback(progress, text, finished) يُستدعى من الخيط المنفصل.
+        """
+        self._run_batch_thread(lambda report: run_recipe(list_images(source_folder), macro_recipe(steps),
+                                                         save_folder, report),
+                               progress_callback)
+
+    def _run_batch_thread(self, run, progress_callback):
+        """تشغيل دفعة (run(report) ترجع ملخص run_recipe) في خيط منفصل مع رسائل التقدم والنتيجة."""
+        def report(done, total, filename, error):
+            text = f"فشلت معالجة: {filename} ({error})" if error else f"تمت معالجة: {filename}"
+            progress_callback(done / total, text, False)
 
-    # --- دالة المعالجة الدفعية ---
-    def process_batch_watermark(self, source_folder, watermark_path, save_folder, position, progress_callback):
-        """منطق إضافة شعار مائي لمجموعة من الصور."""
         def worker():
             try:
-                watermark = Image.open(watermark_path).convert('RGBA')
-                image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
-                image_files = [f for f in os.listdir(source_folder) if f.lower().endswith(image_extensions)]
-                
-                if not image_files:
+                summary = run(report)
+                if not summary['total']:
                     progress_callback(1.0, "لا توجد صور في المجلد المحدد.", True)
-                    return
-
-                total_images = len(image_files)
-                for i, filename in enumerate(image_files):
-                    progress_callback((i) / total_images, f"جاري معالجة: {filename}", False)
-                    
-                    image_path = os.path.join(source_folder, filename)
-                    with Image.open(image_path).convert('RGBA') as image:
-                        wm_width = int(image.size[0] * 0.15)
-                        wm_ratio = wm_width / watermark.size[0]
-                        wm_height = int(watermark.size[1] * wm_ratio)
-                        wm_resized = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-                        
-                        margin = 20
-                        positions = {
-                            "top_left": (margin, margin),
-                            "top_right": (image.size[0] - wm_width - margin, margin),
-                            "bottom_left": (margin, image.size[1] - wm_height - margin),
-                            "bottom_right": (image.size[0] - wm_width - margin, image.size[1] - wm_height - margin)
-                        }
-                        pos = positions.get(position, "bottom_right")
-                        
-                        image.paste(wm_resized, pos, wm_resized)
-                        
-                        save_path = os.path.join(save_folder, f"marked_{filename}")
-                        final_image = image.convert('RGB') if save_path.lower().endswith('.jpg') else image
-                        final_image.save(save_path)
-                
-                progress_callback(1.0, f"اكتملت المعالجة بنجاح لـ {total_images} صورة.", True)
+                elif summary['failed']:
+                    progress_callback(1.0, f"اكتملت المعالجة: {summary['succeeded']} من {summary['total']} صورة، "
+                                           f"ولم تتغير {summary['skipped']}، وفشلت {len(summary['failed'])}.", True)
+                else:
+                    progress_callback(1.0, f"اكتملت المعالجة بنجاح لـ {summary['succeeded']} صورة "
+                                           f"(ولم تتغير {summary['skipped']}).", True)
             except Exception as e:
                 progress_callback(1.0, f"حدث خطأ فادح: {e}", True)
 
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
+
+
+def run_job(job):
+    """تنفيذ عملية (compute, commit) مباشرة في نفس الخيط."""
+    if job is None: return False
+    compute, commit = job
+    return commit(compute(None))
+
+
+def scaled_region(image, box, full_size, size, resample):
+    """تحجيم الجزء box (بإحداثيات صورة بأبعاد full_size) من image، وهي نسخة مصغرة منها أو هي نفسها، إلى size."""
+    scale_x, scale_y = image.width / full_size[0], image.height / full_size[1]
+    return image.resize(size, resample, box=(max(0, box[0] * scale_x), max(0, box[1] * scale_y),
+                                             min(image.width, box[2] * scale_x),
+                                             min(image.height, box[3] * scale_y)))
+
+
+def offset_box(box, layer):
+    """تحويل مستطيل من إحداثيات الطبقة إلى إحداثيات الكانفاس."""
+    return (box[0] + layer['x'], box[1] + layer['y'], box[2] + layer['x'], box[3] + layer['y'])
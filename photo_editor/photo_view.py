@@ -2,7 +2,8 @@
 
 import customtkinter as ctk
 import tkinter as tk
-from PIL import ImageTk, ImageFilter, Image
+from PIL import ImageTk, Image
+from .viewport import Viewport
 
 class PhotoView:
     """
@@ -24,6 +25,9 @@ class PhotoView:
         self.display_frame = ctk.CTkFrame(self.main_frame)
         self.display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
+        # --- شريط الحالة (تقدم العمليات الطويلة) ---
+        self.setup_status_bar()
+
         # --- منطقة العرض ---
         self.canvas = tk.Canvas(self.display_frame, bg="#2B2B2B", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
@@ -32,6 +36,8 @@ class PhotoView:
         # متغيرات لحفظ أبعاد الصورة الأصلية عند العرض
         self.original_image_width = 1
         self.original_image_height = 1
+        # التكبير والتحريك (الجزء الظاهر من الصورة وموضعه على الكانفاس)
+        self.viewport = Viewport()
         
         # --- أشرطة الأدوات (مخفية مبدئياً) ---
         self.setup_toolbars()
@@ -55,6 +61,8 @@ class PhotoView:
         self.save_button.grid(row=1, column=0, sticky="ew", padx=2, pady=2)
         self.save_as_button = ctk.CTkButton(file_buttons_frame, text="💾 حفظ باسم")
         self.save_as_button.grid(row=1, column=1, sticky="ew", padx=2, pady=2)
+        self.export_web_button = ctk.CTkButton(file_buttons_frame, text="🌐 تصدير للويب")
+        self.export_web_button.grid(row=2, column=0, columnspan=2, sticky="ew", padx=2, pady=2)
 
         history_buttons_frame = ctk.CTkFrame(file_frame)
         history_buttons_frame.pack(fill=tk.X, pady=5)
@@ -78,6 +86,16 @@ class PhotoView:
         self.create_filters_tab(self.filters_tab)
         self.create_tools_tab(self.tools_tab)
 
+    def setup_status_bar(self):
+        """إنشاء شريط الحالة أسفل منطقة العرض (مخفي حتى تبدأ عملية طويلة)."""
+        self.status_bar = ctk.CTkFrame(self.display_frame, height=30)
+        self.status_label = ctk.CTkLabel(self.status_bar, text="")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+        self.status_progress = ctk.CTkProgressBar(self.status_bar)
+        self.status_progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        self.status_progress.set(0)
+        self.cancel_operation_button = ctk.CTkButton(self.status_bar, text="إلغاء", width=80)
+
     def setup_toolbars(self):
         """إنشاء أشرطة الأدوات العلوية للرسم والقص."""
         # شريط أدوات الرسم
@@ -93,7 +111,25 @@ class PhotoView:
         # شريط أدوات القص
         self.crop_toolbar = ctk.CTkFrame(self.display_frame, height=50)
         self.apply_crop_button = ctk.CTkButton(self.crop_toolbar, text="تطبيق القص")
-        self.apply_crop_button.pack(pady=10)
+        self.apply_crop_button.pack(side=tk.LEFT, padx=5, pady=10)
+        self.reset_crop_button = ctk.CTkButton(self.crop_toolbar, text="إلغاء القص")
+        self.reset_crop_button.pack(side=tk.LEFT, padx=5, pady=10)
+        self.flatten_crop_button = ctk.CTkButton(self.crop_toolbar, text="تثبيت القص")
+        self.flatten_crop_button.pack(side=tk.LEFT, padx=5, pady=10)
+
+        # شريط التكبير (ظاهر دائماً أعلى يمين منطقة العرض)
+        self.zoom_toolbar = ctk.CTkFrame(self.display_frame)
+        self.zoom_out_button = ctk.CTkButton(self.zoom_toolbar, text="−", width=30)
+        self.zoom_out_button.pack(side=tk.LEFT, padx=2, pady=2)
+        self.zoom_label = ctk.CTkLabel(self.zoom_toolbar, text="100%", width=50)
+        self.zoom_label.pack(side=tk.LEFT, padx=2)
+        self.zoom_in_button = ctk.CTkButton(self.zoom_toolbar, text="+", width=30)
+        self.zoom_in_button.pack(side=tk.LEFT, padx=2, pady=2)
+        self.zoom_fit_button = ctk.CTkButton(self.zoom_toolbar, text="ملاءمة", width=60)
+        self.zoom_fit_button.pack(side=tk.LEFT, padx=2, pady=2)
+        self.zoom_actual_button = ctk.CTkButton(self.zoom_toolbar, text="1:1", width=40)
+        self.zoom_actual_button.pack(side=tk.LEFT, padx=2, pady=2)
+        self.zoom_toolbar.place(relx=1.0, rely=0, anchor="ne", x=-10, y=10)
 
     def create_layers_tab(self, tab):
         """إنشاء واجهة تبويب الطبقات."""
@@ -108,7 +144,9 @@ class PhotoView:
         self.add_text_button.grid(row=1, column=1, sticky="ew", padx=(2,5), pady=5)
         
         self.remove_layer_button = ctk.CTkButton(tab, text="حذف الطبقة المحددة")
-        self.remove_layer_button.grid(row=2, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.remove_layer_button.grid(row=2, column=0, sticky="ew", padx=(5,2), pady=5)
+        self.edit_text_button = ctk.CTkButton(tab, text="تعديل النص")
+        self.edit_text_button.grid(row=2, column=1, sticky="ew", padx=(2,5), pady=5)
         
         opacity_frame = ctk.CTkFrame(tab)
         opacity_frame.grid(row=3, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
@@ -116,6 +154,13 @@ class PhotoView:
         self.opacity_slider = ctk.CTkSlider(opacity_frame, from_=0.0, to=1.0)
         self.opacity_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
+        # سلسلة العمليات (فلاتر وتعديلات) على الطبقة المحددة
+        ctk.CTkLabel(tab, text="عمليات الطبقة:").grid(row=4, column=0, columnspan=2, sticky="w", padx=5)
+        self.ops_listbox = tk.Listbox(tab, bg="#2b2b2b", fg="white", height=4, exportselection=False, borderwidth=0, highlightthickness=0)
+        self.ops_listbox.grid(row=5, column=0, columnspan=2, sticky="nsew", padx=5, pady=5)
+        self.remove_op_button = ctk.CTkButton(tab, text="حذف العملية المحددة")
+        self.remove_op_button.grid(row=6, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
+
     def create_adjustments_tab(self, tab):
         """إنشاء واجهة تبويب التعديلات."""
         tab.grid_columnconfigure(0, weight=1)
@@ -147,17 +192,19 @@ class PhotoView:
         self.apply_adj_button.grid(row=0, column=0, padx=2, sticky="ew")
         self.cancel_adj_button = ctk.CTkButton(buttons_frame, text="إلغاء المعاينة")
         self.cancel_adj_button.grid(row=0, column=1, padx=2, sticky="ew")
+        self.apply_threshold_button = ctk.CTkButton(buttons_frame, text="تطبيق العتبة")
+        self.apply_threshold_button.grid(row=1, column=0, columnspan=2, padx=2, pady=(5,0), sticky="ew")
 
     def create_filters_tab(self, tab):
         """إنشاء واجهة تبويب الفلاتر."""
         tab.grid_columnconfigure(0, weight=1)
         self.filter_buttons = {}
         filters = [
-            ("ضبابي (Blur)", ImageFilter.BLUR), 
-            ("حاد (Sharpen)", ImageFilter.SHARPEN), 
-            ("بحث عن الحواف", ImageFilter.FIND_EDGES), 
-            ("نقش (Emboss)", ImageFilter.EMBOSS), 
-            ("تحديد الخطوط", ImageFilter.CONTOUR)
+            ("ضبابي (Blur)", 'blur'), 
+            ("حاد (Sharpen)", 'sharpen'), 
+            ("بحث عن الحواف", 'find_edges'), 
+            ("نقش (Emboss)", 'emboss'), 
+            ("تحديد الخطوط", 'contour')
         ]
         for i, (name, filter_type) in enumerate(filters):
             btn = ctk.CTkButton(tab, text=name)
@@ -351,31 +398,46 @@ class PhotoView:
         ctk.CTkLabel(batch_frame, text="المعالجة المجمعة", font=("Arial", 12, "bold")).pack()
         self.batch_button = ctk.CTkButton(batch_frame, text="إضافة شعار لعدة صور")
         self.batch_button.pack(fill=tk.X, pady=4)
+        self.record_macro_button = ctk.CTkButton(batch_frame, text="⏺️ تسجيل ماكرو")
+        self.record_macro_button.pack(fill=tk.X, pady=4)
+        self.run_macro_button = ctk.CTkButton(batch_frame, text="▶️ تطبيق ماكرو على مجلد")
+        self.run_macro_button.pack(fill=tk.X, pady=4)
 
     # --- دوال تحديث الواجهة ---
-    def display_image(self, pil_image):
-        """عرض صورة على الكانفاس."""
+    def display_image(self, pil_image, position=(0, 0)):
+        """
+        عرض صورة على الكانفاس. pil_image هي الجزء الظاهر من الصورة بعد تحجيمه (انظر Viewport.visible_region)،
+        و position موضع زاويتها العليا اليسرى على الكانفاس.
+        """
         self.canvas.delete("all")
         if not pil_image: 
             self.photo_tk = None
             return
         
-        # حفظ أبعاد الصورة الأصلية لاستخدامها في التحويلات
-        self.original_image_width = pil_image.width
-        self.original_image_height = pil_image.height
-        
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        if canvas_width <= 1 or canvas_height <= 1: return
+        self.photo_tk = ImageTk.PhotoImage(pil_image)
+        self.canvas.create_image(position[0], position[1], image=self.photo_tk, anchor=tk.NW)
 
-        ratio = min(canvas_width / pil_image.width, canvas_height / pil_image.height)
-        display_width = int(pil_image.width * ratio)
-        display_height = int(pil_image.height * ratio)
-        
-        display_image = pil_image.resize((display_width, display_height), Image.Resampling.LANCZOS)
-        
-        self.photo_tk = ImageTk.PhotoImage(display_image)
-        self.canvas.create_image(canvas_width / 2, canvas_height / 2, image=self.photo_tk, anchor=tk.CENTER)
+    def update_zoom_label(self, scale):
+        self.zoom_label.configure(text=f"{scale * 100:.0f}%")
+
+    def show_progress(self, progress, text="", cancellable=False):
+        """إظهار شريط الحالة وتحديث نسبة التقدم (مع زر إلغاء للعمليات التي يمكن إلغاؤها)."""
+        if not self.status_bar.winfo_ismapped():
+            self.status_bar.pack(side=tk.BOTTOM, fill=tk.X, before=self.canvas)
+        self.status_progress.set(progress)
+        self.status_label.configure(text=text)
+        if cancellable and not self.cancel_operation_button.winfo_ismapped():
+            self.cancel_operation_button.pack(side=tk.RIGHT, padx=10)
+        elif not cancellable and self.cancel_operation_button.winfo_ismapped():
+            self.cancel_operation_button.pack_forget()
+
+    def hide_progress(self):
+        """إخفاء شريط الحالة."""
+        self.status_bar.pack_forget()
+
+    def get_canvas_size(self):
+        """أبعاد الكانفاس الحالية."""
+        return self.canvas.winfo_width(), self.canvas.winfo_height()
 
     def update_layers_list(self, layers, active_layer_index):
         """تحديث قائمة الطبقات في الواجهة."""
@@ -386,7 +448,17 @@ class PhotoView:
             self.layers_listbox.insert(tk.END, f"{prefix}{visibility} {layer['name']}")
         if active_layer_index is not None and active_layer_index < len(layers):
             self.layers_listbox.selection_set(active_layer_index)
-            self.opacity_slider.set(layers[active_layer_index]['opacity'])
+
+    def set_opacity_slider(self, opacity):
+        """ضبط شريط الشفافية (فقط إذا اختلفت قيمته، حتى لا يتعارض مع سحب المستخدم له)."""
+        if abs(self.opacity_slider.get() - opacity) > 1e-6:
+            self.opacity_slider.set(opacity)
+
+    def update_ops_list(self, op_labels):
+        """تحديث قائمة عمليات الطبقة المحددة."""
+        self.ops_listbox.delete(0, tk.END)
+        for i, label in enumerate(op_labels):
+            self.ops_listbox.insert(tk.END, f"{i + 1}. {label}")
 
     def update_history_buttons(self, can_undo, can_redo):
         """تحديث حالة أزرار التراجع والإعادة."""
@@ -438,68 +510,34 @@ class PhotoView:
 
     def get_image_crop_box(self):
         """
-        تحويل إحداثيات مستطيل القص من الكانفاس إلى إحداثيات الصورة الأصلية.
+        تحويل إحداثيات مستطيل القص من الكانفاس إلى إحداثيات الصورة الأصلية (حسب التكبير والتحريك الحاليين).
         """
         if not hasattr(self, 'crop_rect') or not self.photo_tk:
             return None
 
         x1, y1, x2, y2 = self.canvas.coords(self.crop_rect)
-        
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        display_width = self.photo_tk.width()
-        display_height = self.photo_tk.height()
-        
-        if self.original_image_width == 0: return None
-        ratio = display_width / self.original_image_width
-        
-        offset_x = (canvas_width - display_width) / 2
-        offset_y = (canvas_height - display_height) / 2
-
-        img_x1 = (x1 - offset_x) / ratio
-        img_y1 = (y1 - offset_y) / ratio
-        img_x2 = (x2 - offset_x) / ratio
-        img_y2 = (y2 - offset_y) / ratio
+        img_x1, img_y1 = self.viewport.canvas_to_image(x1, y1)
+        img_x2, img_y2 = self.viewport.canvas_to_image(x2, y2)
 
         return (int(min(img_x1, img_x2)), int(min(img_y1, img_y2)), 
                 int(max(img_x1, img_x2)), int(max(img_y1, img_y2)))
 
     def canvas_to_image_coords(self, canvas_x, canvas_y):
-   
-   
-    # 1. التحقق من وجود صورة معروضة
-    if not self.photo_tk: 
-        return None
-
-    # 2. الحصول على أبعاد الكانفاس والصورة المعروضة عليه
-    canvas_width = self.canvas.winfo_width()
-    canvas_height = self.canvas.winfo_height()
-    display_width = self.photo_tk.width()
-    display_height = self.photo_tk.height()
-    
-    # 3. حماية من القسمة على صفر (إذا لم يتم تحميل صورة بعد)
-    if self.original_image_width == 0: 
-        return None
-        
-    # 4. حساب نسبة التصغير/التكبير التي تم تطبيقها على الصورة لتناسب الكانفاس
-    ratio = display_width / self.original_image_width
-    
-    # 5. حساب المسافة الفارغة (الهوامش) حول الصورة داخل الكانفاس
-    offset_x = (canvas_width - display_width) / 2
-    offset_y = (canvas_height - display_height) / 2
-
-    # 6. التحقق مما إذا كانت نقرة الفأرة داخل حدود الصورة المعروضة (وليس في الهوامش)
-    if not (offset_x <= canvas_x < offset_x + display_width and offset_y <= canvas_y < offset_y + display_height):
-        return None
-
-    # 7. المعادلة العكسية: تحويل إحداثيات الكانفاس إلى إحداثيات الصورة الأصلية
-    #    - نطرح الهامش للوصول إلى إحداثيات النقطة بالنسبة للصورة المعروضة
-    #    - نقسم على نسبة التكبير/التصغير للعودة إلى الإحداثيات في الصورة الأصلية
-    image_x = int((canvas_x - offset_x) / ratio)
-    image_y = int((canvas_y - offset_y) / ratio)
-    
-    # 8. إرجاع الإحداثيات المحسوبة كنقطة (tuple)
-    return (image_x, image_y)
+        """تحويل إحداثيات نقطة على الكانفاس إلى إحداثيات الصورة الأصلية."""
+        # 1. التحقق من وجود صورة معروضة
+        if not self.photo_tk:
+            return None
+
+        # 2. المعادلة العكسية حسب التكبير وموضع الصورة الحاليين (انظر Viewport)
+        image_x, image_y = self.viewport.canvas_to_image(canvas_x, canvas_y)
+
+        # 3. التحقق مما إذا كانت نقرة الفأرة داخل حدود الصورة (وليس في الهوامش)
+        width, height = self.viewport.image_size
+        if not (0 <= image_x < width and 0 <= image_y < height):
+            return None
+
+        # 4. إرجاع الإحداثيات المحسوبة كنقطة (tuple)
+        return (int(image_x), int(image_y))
 
         # /photo_editor/photo_view.py
 
@@ -0,0 +1,64 @@
+# /photo_editor/preview.py
+
+# أصغر مستوى في الهرم (لا داعي لتصغير الصورة أكثر من ذلك)
+MIN_LEVEL_SIZE = 256
+
+
+class PreviewPyramid:
+    """
+    هرم معاينة (Mipmap) للصورة المدمجة: كل مستوى نصف حجم المستوى الذي قبله.
+    يُختار للعرض أصغر مستوى لا تقل دقته عن مقياس العرض، فيكون التصغير النهائي سريعاً مهما كانت دقة الصورة.
+    عند تغير أجزاء من الصورة يتم تحديث نفس الأجزاء فقط في كل مستوى.
+    """
+    def __init__(self):
+        self.levels = []
+        self.pending_boxes = []
+        self.needs_rebuild = True
+
+    def invalidate(self, boxes=None):
+        """تسجيل المناطق التي تغيرت في الصورة الأصلية (None = الصورة كاملة)."""
+        if boxes is None:
+            self.needs_rebuild = True
+        elif not self.needs_rebuild:
+            self.pending_boxes.extend(boxes)
+
+    def get_level_for_scale(self, image, scale):
+        """
+        أصغر مستوى دقته لا تقل عن scale (بكسلات العرض لكل بكسل من الصورة الأصلية).
+        """
+        if scale * 2 > 1:
+            # العرض بدقة الصورة الأصلية أو أكبر: لا حاجة لتحديث الهرم
+            return image
+        self._refresh(image)
+        index = 0
+        while index + 1 < len(self.levels) and 2 ** (index + 1) * scale <= 1:
+            index += 1
+        return self.levels[index]
+
+    def _refresh(self, image):
+        if self.needs_rebuild or not self.levels or self.levels[0] is not image \
+                or self.levels[0].size != image.size:
+            self._rebuild(image)
+        elif self.pending_boxes:
+            self._update_boxes()
+
+    def _rebuild(self, image):
+        """بناء كل المستويات من جديد."""
+        self.levels = [image]
+        while max(self.levels[-1].size) > MIN_LEVEL_SIZE:
+            self.levels.append(self.levels[-1].reduce(2))
+        self.pending_boxes = []
+        self.needs_rebuild = False
+
+    def _update_boxes(self):
+        """إعادة حساب المناطق المتغيرة فقط في كل مستوى."""
+        for box in self.pending_boxes:
+            for i in range(1, len(self.levels)):
+                source = self.levels[i - 1]
+                # محاذاة المنطقة لأرقام زوجية حتى تطابق نتيجة تصغير الصورة كاملة
+                x1, y1 = box[0] // 2 * 2, box[1] // 2 * 2
+                x2, y2 = min(source.width, (box[2] + 1) // 2 * 2), min(source.height, (box[3] + 1) // 2 * 2)
+                if x1 >= x2 or y1 >= y2: break
+                self.levels[i].paste(source.crop((x1, y1, x2, y2)).reduce(2), (x1 // 2, y1 // 2))
+                box = (x1 // 2, y1 // 2, (x2 + 1) // 2, (y2 + 1) // 2)
+        self.pending_boxes = []
@@ -0,0 +1,368 @@
+# /photo_editor/project_file.py
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import weakref
+import zlib
+from PIL import Image, ImageFile
+
+# امتداد ملفات المشاريع
+PROJECT_EXTENSION = ".studio"
+
+# حجم مربعات البكسلات في الملف
+PROJECT_TILE_SIZE = 256
+
+HEADER_MAGIC = b"STUDIOPJ"
+FOOTER_MAGIC = b"STUDIOIX"
+# التذييل: علامة + موضع الفهرس (JSON) في الملف
+FOOTER = struct.Struct("<8sQ")
+FORMAT_VERSION = 1
+# لا يُعاد كتابة الملف ما دامت البيانات غير المستخدمة فيه أقل من هذا الحجم
+COMPACT_MIN_GARBAGE = 4 * 1024 * 1024
+
+
+class ProjectFile:
+    """
+    ملف مشروع محرر الصور (قائمة الطبقات مع بكسلاتها).
+    الملف يُضاف إليه فقط: بعد الترويسة تأتي مربعات البكسلات (Tiles) مضغوطة بـ zlib، ثم فهرس JSON
+    يصف الطبقات ومواضع مربعاتها، ثم تذييل يشير لموضع آخر فهرس.
+
+    - كل مربع يُعرف ببصمة محتواه (blake2b)، فالحفظ التدريجي يكتب فقط المربعات التي لا توجد في الملف،
+      والمربعات الشفافة تماماً لا تُخزن أصلاً.
+    - الفتح لا يقرأ البكسلات: الملف يُربط بالذاكرة (mmap) وكل طبقة تُفك مربعاتها عند أول استخدام لها.
+    - عندما تزيد البيانات القديمة غير المستخدمة عن البيانات الحالية يُعاد كتابة الملف كاملاً.
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.file = None
+        self.map = None
+        # بصمة المربع -> (الموضع, الطول) لكل المربعات الموجودة في الملف
+        self.tiles = {}
+        self.live_bytes = 0
+        self.index_bytes = 0
+        # صور الطبقات (LazyTileImage) التي تُفك من هذا الملف: id(الصورة) -> الصورة
+        self.images = weakref.WeakValueDictionary()
+
+    # --- الفتح ---
+    @classmethod
+    def open(cls, path):
+        """فتح ملف مشروع. يرجع (ProjectFile, الفهرس) والطبقات في الفهرس تحتوي صوراً تُفك عند الحاجة."""
+        project = cls(path)
+        project.file = open(project.path, "r+b")
+        try:
+            project._map()
+            if project.map[:len(HEADER_MAGIC)] != HEADER_MAGIC:
+                raise ValueError("الملف ليس ملف مشروع صالح")
+            index = project._read_index()
+
+            for layer in index['layers']:
+                layer['image'] = LazyTileImage(project, layer)
+            project._remember_tiles(index)
+        except BaseException as e:
+            project.close()
+            # ملف ناقص أو فهرس بحقول خاطئة
+            if isinstance(e, (struct.error, KeyError, IndexError, TypeError)):
+                raise ValueError("ملف المشروع تالف") from e
+            raise
+        return project, index
+
+    def _map(self):
+        # الربط القديم لا يُغلق صراحة: قد يكون خيط آخر يفك منه مربعاً الآن (يُغلق عند تحرير آخر مرجع له)
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_index(self):
+        magic, offset = FOOTER.unpack(self.map[-FOOTER.size:])
+        if magic != FOOTER_MAGIC:
+            raise ValueError("فهرس ملف المشروع تالف")
+        self.index_bytes = len(self.map) - FOOTER.size - offset
+        index = json.loads(self.map[offset:offset + self.index_bytes].decode('utf-8'))
+        if index.get('version', 0) > FORMAT_VERSION:
+            raise ValueError("إصدار ملف المشروع أحدث من هذا البرنامج")
+        return index
+
+    def _remember_tiles(self, index):
+        self.tiles = {}
+        for layer in index['layers']:
+            for tile in layer['tiles']:
+                if tile:
+                    self.tiles[tile[2]] = (tile[0], tile[1])
+        self.live_bytes = sum(length for offset, length in self.tiles.values())
+
+    def read_tile(self, tile):
+        """فك ضغط مربع واحد من الملف."""
+        offset, length = tile[0], tile[1]
+        return zlib.decompress(self.map[offset:offset + length])
+
+    def decode_tile(self, tile, box):
+        """صورة مربع واحد (box موضعه في الطبقة)."""
+        return Image.frombytes('RGBA', (box[2] - box[0], box[3] - box[1]), self.read_tile(tile))
+
+    def decode_layer(self, layer, decoded=None):
+        """
+        بناء صورة طبقة كاملة من مربعاتها (المربعات الفارغة تبقى شفافة).
+        decoded: مربعات فُكت من قبل (رقم المربع -> صورته) فلا تُفك مرة أخرى.
+        """
+        decoded = decoded or {}
+        width, height = layer['width'], layer['height']
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for index, (box, tile) in enumerate(zip(tile_boxes(width, height), layer['tiles'])):
+            if tile:
+                tile_image = decoded.get(index)
+                if tile_image is None:
+                    tile_image = self.decode_tile(tile, box)
+                image.paste(tile_image, box[:2])
+        return image
+
+    # --- الحفظ ---
+    def save(self, layers, document, progress_callback=None):
+        """
+        حفظ الطبقات (وخصائص المستند) مع إعادة استخدام المربعات الموجودة في الملف.
+        يرجع ProjectFile الذي يمثل الملف بعد الحفظ (يكون جديداً إذا أعيدت كتابة الملف كاملاً).
+        """
+        if self.file is not None and self._garbage_bytes() > max(self.live_bytes, COMPACT_MIN_GARBAGE):
+            project = ProjectFile(self.path)
+            project._write_new(layers, document, progress_callback, replaced=self)
+            project._map()
+            return project
+        if self.file is None:
+            self._write_new(layers, document, progress_callback)
+        else:
+            end = self.file.seek(0, os.SEEK_END)
+            try:
+                self._append(layers, document, progress_callback)
+            except BaseException:
+                # إرجاع الملف لآخر فهرس سليم حتى لا يبقى بدون تذييل
+                self.file.truncate(end)
+                raise
+        self._map()
+        return self
+
+    def _write_new(self, layers, document, progress_callback, replaced=None):
+        """
+        كتابة ملف جديد كاملاً. يُكتب في ملف مؤقت ثم يستبدل الملف القديم (والنسخة القديمة تبقى سليمة
+        إذا فشل الحفظ). replaced: الملف المفتوح بنفس المسار (عند إعادة الكتابة لحذف البيانات القديمة)،
+        يُغلق قبل الاستبدال لأن Windows لا يسمح باستبدال ملف مفتوح.
+        """
+        temp_path = self.path + ".tmp"
+        self.file = open(temp_path, "w+b")
+        moved = []
+        try:
+            self.file.write(HEADER_MAGIC)
+            entries = self._append(layers, document, progress_callback)
+            self.file.close()
+            if replaced is not None:
+                moved = replaced._release(layers, entries, self)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            self.file.close()
+            self.file = None
+            if replaced is not None and replaced.file is None:
+                # الاستبدال فشل: الملف القديم ما زال سليماً، فتعود إليه الصور التي نُقلت
+                replaced.file = open(replaced.path, "r+b")
+                replaced._map()
+                for image, layer in moved:
+                    image.rebind(replaced, layer)
+            os.remove(temp_path)
+            raise
+        self.file = open(self.path, "r+b")
+
+    def _release(self, layers, entries, project):
+        """
+        إغلاق الملف مع الحفاظ على صوره التي لم تُفك: صور الطبقات المحفوظة في project تُقرأ منه
+        (نفس المربعات في مواضعها الجديدة)، وباقي الصور (مثلاً في التاريخ) تُفك الآن.
+        يرجع [(الصورة, وصفها القديم)] للصور التي نُقلت.
+        """
+        saved = {id(layer['source']): entry for layer, entry in zip(layers, entries)}
+        moved = []
+        for image in list(self.images.values()):
+            if image.project is not self or image.is_loaded(): continue
+            entry = saved.get(id(image))
+            if entry is None:
+                image.load()
+            else:
+                moved.append((image, image.layer))
+                image.rebind(project, entry)
+        self.close()
+        return moved
+
+    def _append(self, layers, document, progress_callback):
+        """إضافة المربعات الجديدة ثم فهرس جديد وتذييل في نهاية الملف."""
+        self.file.seek(0, os.SEEK_END)
+        written = dict(self.tiles)
+        entries = []
+        for i, layer in enumerate(layers):
+            entries.append(self._layer_entry(layer, written))
+            if progress_callback:
+                progress_callback((i + 1) / len(layers))
+
+        index = json.dumps({
+            'version': FORMAT_VERSION,
+            'tile_size': PROJECT_TILE_SIZE,
+            'orientation': list(document.get('orientation', (0, False))),
+            'crop_rect': document.get('crop_rect'),
+            'layers': entries,
+        }, ensure_ascii=False).encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(index)
+        self.file.write(FOOTER.pack(FOOTER_MAGIC, offset))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.index_bytes = len(index)
+        self._remember_tiles({'layers': entries})
+        return entries
+
+    def _layer_entry(self, layer, written):
+        """وصف طبقة في الفهرس، مع كتابة مربعاتها الجديدة فقط."""
+        source = layer['source']
+        width, height = source.size
+        if isinstance(source, LazyTileImage) and not source.is_loaded():
+            # الصورة لم تُفك منذ فتحها: بصمات مربعاتها معروفة، فتُنسخ البيانات المضغوطة كما هي عند الحاجة
+            tiles = [self._copy_tile(source.project, tile, written) if tile else None
+                     for tile in source.layer['tiles']]
+        else:
+            if source.mode != 'RGBA':
+                source = source.convert('RGBA')
+            tiles = [self._write_tile(source.crop(box), written) for box in tile_boxes(width, height)]
+
+        return {**layer_to_json(layer), 'width': width, 'height': height, 'tiles': tiles}
+
+    def _write_tile(self, tile_image, written):
+        if not tile_image.getbbox(alpha_only=False): return None
+        data = tile_image.tobytes()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if digest not in written:
+            compressed = zlib.compress(data, 6)
+            written[digest] = (self.file.tell(), len(compressed))
+            self.file.write(compressed)
+        return [*written[digest], digest]
+
+    def _copy_tile(self, project, tile, written):
+        digest = tile[2]
+        if digest not in written:
+            offset, length = tile[0], tile[1]
+            written[digest] = (self.file.tell(), length)
+            self.file.write(project.map[offset:offset + length])
+        return [*written[digest], digest]
+
+    def _garbage_bytes(self):
+        """حجم البيانات التي لم يعد آخر فهرس يشير إليها (مربعات وفهارس قديمة)."""
+        self.file.seek(0, os.SEEK_END)
+        return self.file.tell() - len(HEADER_MAGIC) - self.live_bytes - self.index_bytes - FOOTER.size
+
+    def close(self):
+        """إغلاق الملف (الصور التي لم تُفك بعد من هذا الملف لن تعود قابلة للاستخدام)."""
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class LazyTileImage(ImageFile.ImageFile):
+    """
+    صورة طبقة من ملف مشروع تُفك مربعاتها عند أول استخدام لبكسلاتها
+    (الأبعاد والنوع متاحة بدون فك، وبعد الفك تتصرف كأي صورة PIL).
+    قص جزء منها (مثل دمج المربعات الظاهرة في العرض) يفك المربعات التي يغطيها فقط.
+    """
+    format = "STUDIO"
+    format_description = "Studio project layer"
+
+    def __init__(self, project, layer):
+        self.rebind(project, layer)
+        # المربعات التي فُكت قبل فك الطبقة كاملة: رقم المربع -> صورته (None = مربع فارغ)
+        self.decoded_tiles = {}
+        super().__init__(io.BytesIO(b""))
+
+    def rebind(self, project, layer):
+        """قراءة المربعات من ملف آخر يحتوي نفس الطبقة (بعد إعادة كتابة ملف المشروع)."""
+        self.project = project
+        self.layer = layer
+        project.images[id(self)] = self
+
+    def _open(self):
+        self._mode = 'RGBA'
+        self._size = (self.layer['width'], self.layer['height'])
+
+    def is_loaded(self):
+        return self._im is not None
+
+    def load(self):
+        if self._im is None:
+            self.im = self.project.decode_layer(self.layer, self.decoded_tiles).im
+            self.readonly = 0
+            self.decoded_tiles = {}
+        return Image.Image.load(self)
+
+    def crop(self, box=None):
+        if self._im is not None or box is None:
+            return super().crop(box)
+        x1, y1, x2, y2 = (int(round(value)) for value in box)
+        if x2 < x1 or y2 < y1:
+            return super().crop(box)
+        region = Image.new('RGBA', (x2 - x1, y2 - y1), (0, 0, 0, 0))
+        ts = PROJECT_TILE_SIZE
+        width, height = self.size
+        columns = (width + ts - 1) // ts
+        for ty in range(max(0, y1 // ts), min((height + ts - 1) // ts, (y2 + ts - 1) // ts)):
+            for tx in range(max(0, x1 // ts), min(columns, (x2 + ts - 1) // ts)):
+                x, y = tx * ts, ty * ts
+                tile = self._decoded_tile(ty * columns + tx, (x, y, min(x + ts, width), min(y + ts, height)))
+                if tile is not None:
+                    region.paste(tile, (x - x1, y - y1))
+        return region
+
+    def _decoded_tile(self, index, box):
+        if index not in self.decoded_tiles:
+            tile = self.layer['tiles'][index]
+            self.decoded_tiles[index] = self.project.decode_tile(tile, box) if tile else None
+        return self.decoded_tiles[index]
+
+
+def tile_boxes(width, height, tile_size=PROJECT_TILE_SIZE):
+    """مربعات الصورة بالترتيب (صفاً بصف)."""
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+
+def layer_to_json(layer):
+    """خصائص الطبقة (بدون البكسلات) كقاموس JSON."""
+    text = layer.get('text')
+    return {
+        'name': layer['name'], 'opacity': layer['opacity'], 'visible': layer['visible'],
+        'x': layer['x'], 'y': layer['y'], 'is_draw_layer': layer['is_draw_layer'],
+        'ops': [list(op) for op in layer['ops']],
+        'text': dict(text) if text else None,
+    }
+
+
+def layer_from_json(entry, source):
+    """
+    بناء قاموس طبقة من خصائصها في JSON وصورتها الأصلية.
+    'image' تبقى None ويجب حسابها من سلسلة العمليات (op_cache.evaluate).
+    """
+    return {
+        'name': entry['name'],
+        'image': None,
+        'source': source, 'ops': tuple(op_from_json(op) for op in entry['ops']),
+        'opacity': entry['opacity'],
+        'visible': entry['visible'],
+        'x': entry['x'], 'y': entry['y'],
+        'is_draw_layer': entry['is_draw_layer'],
+        'text': text_from_json(entry['text']),
+    }
+
+
+def op_from_json(op):
+    """تحويل عملية من JSON (قوائم) إلى tuple كما تستخدمها سلسلة العمليات."""
+    return tuple(tuple(part) if isinstance(part, list) else part for part in op)
+
+
+def text_from_json(text):
+    if not text: return None
+    return {**text, 'color': tuple(text['color']), 'orientation': tuple(text['orientation'])}
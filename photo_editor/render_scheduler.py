@@ -0,0 +1,41 @@
+# /photo_editor/render_scheduler.py
+
+import time
+
+# الحد الأقصى الافتراضي لعدد مرات الرسم في الثانية
+DEFAULT_MAX_FPS = 60
+
+
+class RenderScheduler:
+    """
+    يجمع طلبات تحديث الواجهة المتتالية في عملية رسم واحدة لكل إطار.
+    كل طلب يعلّم الواجهة كـ"متسخة" فقط، والرسم الفعلي يتم عبر after_idle (أو after إذا لم يمر
+    زمن إطار كامل منذ آخر رسم)، فلا يتجاوز عدد مرات الرسم max_fps مهما كثرت الأحداث.
+    """
+    def __init__(self, widget, render, max_fps=DEFAULT_MAX_FPS):
+        self.widget = widget
+        self.render = render
+        self.frame_interval = 1.0 / max_fps
+        self.job = None
+        self.interactive = True
+        self.last_render = 0.0
+
+    def request(self, interactive=False):
+        """
+        طلب إعادة رسم. interactive=True يسمح برسم سريع منخفض الجودة؛
+        إذا كان أي طلب في نفس الإطار غير تفاعلي يُرسم الإطار بالجودة الكاملة.
+        """
+        self.interactive = self.interactive and interactive
+        if self.job is not None: return
+        delay = self.last_render + self.frame_interval - time.monotonic()
+        if delay <= 0:
+            self.job = self.widget.after_idle(self._run)
+        else:
+            self.job = self.widget.after(int(delay * 1000) + 1, self._run)
+
+    def _run(self):
+        interactive = self.interactive
+        self.job = None
+        self.interactive = True
+        self.last_render = time.monotonic()
+        self.render(interactive)
@@ -3,14 +3,20 @@ import customtkinter as ctk
 from tkinter import colorchooser, messagebox
 
 class TextDialog(ctk.CTkToplevel):
-    def __init__(self, parent):
+    """
+    نافذة إدخال نص جديد أو تعديل طبقة نص موجودة.
+    initial: القيم الحالية (text, size, color) عند التعديل.
+    on_change(values): يُستدعى مع كل تغيير صحيح للمعاينة الحية أثناء الكتابة.
+    """
+    def __init__(self, parent, initial=None, on_change=None):
         super().__init__(parent)
         
         # --- الحل: حفظ الأب الحقيقي ---
         # هذا يضمن أن أي نافذة منبثقة جديدة ستظهر فوق النافذة الرئيسية
         self.main_parent = parent 
+        self.on_change = on_change
         
-        self.title("إضافة نص")
+        self.title("تعديل النص" if initial else "إضافة نص")
         self.geometry("400x300")
         self.result = None
         
@@ -31,8 +37,16 @@ class TextDialog(ctk.CTkToplevel):
         self.color_button.color = (0, 0, 0, 255)
         self.color_button.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
         
-        add_button = ctk.CTkButton(self, text="إضافة", command=self.on_add)
+        add_button = ctk.CTkButton(self, text="تحديث" if initial else "إضافة", command=self.on_add)
         add_button.grid(row=3, column=0, columnspan=2, padx=10, pady=20)
+
+        if initial:
+            self.text_entry.insert(0, initial['text'])
+            self.size_entry.delete(0, 'end')
+            self.size_entry.insert(0, str(initial['size']))
+            self.set_color(initial['color'])
+        self.text_entry.bind("<KeyRelease>", self.notify_change)
+        self.size_entry.bind("<KeyRelease>", self.notify_change)
         
         # هاتان الدالتان تضمنان أن هذه النافذة تبقى فوق النافذة الرئيسية
         self.transient(parent)
@@ -45,31 +59,44 @@ class TextDialog(ctk.CTkToplevel):
         """
         color_code = colorchooser.askcolor(parent=self.main_parent, title="اختر لون النص")
         if color_code and color_code[0]:
-            rgb, hex_color = color_code[0], color_code[1]
-            self.color_button.configure(fg_color=hex_color)
-            
-            # حساب لون النص المناسب (أسود أو أبيض)
-            text_color = "#000000" if (rgb[0]*0.299 + rgb[1]*0.587 + rgb[2]*0.114) > 186 else "#FFFFFF"
-            self.color_button.configure(text_color=text_color)
-            
-            self.color_button.color = (int(rgb[0]), int(rgb[1]), int(rgb[2]), 255)
+            rgb = color_code[0]
+            self.set_color((int(rgb[0]), int(rgb[1]), int(rgb[2]), 255))
+            self.notify_change()
+
+    def set_color(self, color):
+        """تعيين لون النص وتحديث شكل زر اللون."""
+        self.color_button.configure(fg_color="#%02x%02x%02x" % tuple(color[:3]))
+        
+        # حساب لون النص المناسب (أسود أو أبيض)
+        text_color = "#000000" if (color[0]*0.299 + color[1]*0.587 + color[2]*0.114) > 186 else "#FFFFFF"
+        self.color_button.configure(text_color=text_color)
+        
+        self.color_button.color = tuple(color)
+
+    def get_values(self):
+        """القيم الحالية إذا كانت صحيحة، أو None."""
+        text = self.text_entry.get()
+        size_str = self.size_entry.get()
+        if not text or not size_str.isdigit() or int(size_str) <= 0:
+            return None
+        return {"text": text, "size": int(size_str), "color": self.color_button.color}
+
+    def notify_change(self, event=None):
+        if self.on_change:
+            values = self.get_values()
+            if values:
+                self.on_change(values)
 
     def on_add(self):
         """
         يتم استدعاؤها عند الضغط على زر "إضافة".
         تتحقق من المدخلات وتجهز النتيجة.
         """
-        text = self.text_entry.get()
-        size_str = self.size_entry.get()
-        
-        if not text or not size_str.isdigit() or int(size_str) <= 0:
+        values = self.get_values()
+        if not values:
             # الحل: استخدام self.main_parent كـ "أب" لرسالة الخطأ
             messagebox.showerror("خطأ في الإدخال", "الرجاء إدخال نص وحجم خط صحيح (رقم أكبر من صفر).", parent=self.main_parent)
             return
         
-        self.result = {
-            "text": text,
-            "size": int(size_str),
-            "color": self.color_button.color
-        }
+        self.result = values
         self.destroy()
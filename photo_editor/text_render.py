@@ -0,0 +1,30 @@
+# /photo_editor/text_render.py
+
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_FONT = "arial.ttf"
+
+
+@lru_cache(maxsize=32)
+def load_font(size, font_name=DEFAULT_FONT):
+    """تحميل خط بحجم معين مرة واحدة فقط (الخطوط المحملة مشتركة بين كل طبقات النص)."""
+    try:
+        return ImageFont.truetype(font_name, size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=128)
+def render_text(text, size, color, font_name=DEFAULT_FONT):
+    """
+    رسم نص في صورة RGBA شفافة بحجم النص فقط.
+    الصورة المرجعة مشتركة (مخزنة في الذاكرة المؤقتة) فيجب عدم تعديلها في مكانها.
+    """
+    font = load_font(size, font_name)
+    bbox = font.getbbox(text)
+    text_width, text_height = max(1, bbox[2] - bbox[0]), max(1, bbox[3] - bbox[1])
+    text_image = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(text_image)
+    draw.text((-bbox[0], -bbox[1]), text, font=font, fill=color)
+    return text_image
@@ -0,0 +1,120 @@
+# /photo_editor/viewport.py
+
+# نسبة التكبير/التصغير لكل خطوة (عجلة الفأرة أو لوحة المفاتيح)، وحدود التكبير
+ZOOM_STEP = 1.25
+MIN_ZOOM = 0.01
+MAX_ZOOM = 32.0
+
+
+class Viewport:
+    """
+    حالة العرض في الكانفاس: التكبير (بكسلات الشاشة لكل بكسل من الصورة) وموضع مركز العرض في الصورة.
+    zoom = None يعني ملاءمة الصورة للكانفاس. الإحداثيات هنا إحداثيات الصورة كما تُعرض
+    (بعد القص والاتجاه) بالدقة الكاملة، والتحويل للمستند يتم في الـ Model.
+    """
+    def __init__(self):
+        self.zoom = None
+        self.center = None
+        self.image_size = (1, 1)
+        self.canvas_size = (1, 1)
+
+    def set_sizes(self, image_size, canvas_size):
+        """تحديث أبعاد الصورة والكانفاس (بعد فتح صورة أو قص أو تدوير أو تغيير حجم النافذة)."""
+        if image_size != self.image_size:
+            # الاحتفاظ بنفس الموضع النسبي عند تغير أبعاد الصورة (مثلاً بعد التدوير)
+            if self.center:
+                self.center = (self.center[0] * image_size[0] / self.image_size[0],
+                               self.center[1] * image_size[1] / self.image_size[1])
+            self.image_size = image_size
+        self.canvas_size = (max(1, canvas_size[0]), max(1, canvas_size[1]))
+        self._clamp()
+
+    # --- التكبير والتحريك ---
+    def fit_zoom(self):
+        return min(self.canvas_size[0] / self.image_size[0], self.canvas_size[1] / self.image_size[1])
+
+    def scale(self):
+        """التكبير الفعلي الحالي."""
+        return self.fit_zoom() if self.zoom is None else self.zoom
+
+    def fit(self):
+        self.zoom = None
+        self.center = None
+
+    def set_zoom(self, zoom, canvas_point=None):
+        """
+        تغيير التكبير مع تثبيت نقطة الصورة التي تحت canvas_point (مؤشر الفأرة)، أو مركز العرض.
+        """
+        zoom = min(MAX_ZOOM, max(MIN_ZOOM, zoom))
+        if canvas_point is None:
+            canvas_point = (self.canvas_size[0] / 2, self.canvas_size[1] / 2)
+        image_point = self.canvas_to_image(*canvas_point)
+        self.zoom = zoom
+        # المركز الجديد بحيث تبقى image_point تحت canvas_point
+        self.center = (image_point[0] - (canvas_point[0] - self.canvas_size[0] / 2) / zoom,
+                       image_point[1] - (canvas_point[1] - self.canvas_size[1] / 2) / zoom)
+        self._clamp()
+
+    def zoom_in(self, canvas_point=None):
+        self.set_zoom(self.scale() * ZOOM_STEP, canvas_point)
+
+    def zoom_out(self, canvas_point=None):
+        self.set_zoom(self.scale() / ZOOM_STEP, canvas_point)
+
+    def pan(self, dx, dy):
+        """تحريك العرض بإزاحة بكسلات الشاشة (مثل سحب الصورة)."""
+        if self.zoom is None: return
+        scale = self.scale()
+        center = self.get_center()
+        self.center = (center[0] - dx / scale, center[1] - dy / scale)
+        self._clamp()
+
+    def get_center(self):
+        if self.center is None:
+            return self.image_size[0] / 2, self.image_size[1] / 2
+        return self.center
+
+    def _clamp(self):
+        """منع تحريك الصورة خارج الكانفاس: البعد الأصغر من الكانفاس يتوسط، والأكبر لا يترك فراغاً."""
+        if self.zoom is None:
+            self.center = None
+            return
+        scale = self.scale()
+        center = list(self.get_center())
+        for axis in (0, 1):
+            half = self.canvas_size[axis] / (2 * scale)
+            size = self.image_size[axis]
+            center[axis] = size / 2 if 2 * half >= size else min(size - half, max(half, center[axis]))
+        self.center = tuple(center)
+
+    # --- تحويل الإحداثيات ---
+    def origin(self):
+        """موضع نقطة الأصل (0, 0) للصورة على الكانفاس."""
+        scale = self.scale()
+        center = self.get_center()
+        return (self.canvas_size[0] / 2 - center[0] * scale, self.canvas_size[1] / 2 - center[1] * scale)
+
+    def canvas_to_image(self, x, y):
+        origin_x, origin_y = self.origin()
+        scale = self.scale()
+        return (x - origin_x) / scale, (y - origin_y) / scale
+
+    def image_to_canvas(self, x, y):
+        origin_x, origin_y = self.origin()
+        scale = self.scale()
+        return origin_x + x * scale, origin_y + y * scale
+
+    def visible_region(self):
+        """
+        الجزء الظاهر من الصورة: (box بإحداثيات الصورة (أعداد عشرية), أبعاد الصورة المعروضة بالبكسل,
+        موضعها على الكانفاس)، أو None إذا لم يظهر شيء.
+        """
+        x1, y1 = self.canvas_to_image(0, 0)
+        x2, y2 = self.canvas_to_image(*self.canvas_size)
+        box = (max(0.0, x1), max(0.0, y1), min(float(self.image_size[0]), x2), min(float(self.image_size[1]), y2))
+        if box[0] >= box[2] or box[1] >= box[3]: return None
+        left, top = self.image_to_canvas(box[0], box[1])
+        right, bottom = self.image_to_canvas(box[2], box[3])
+        left, top = round(left), round(top)
+        size = (max(1, round(right) - left), max(1, round(bottom) - top))
+        return box, size, (left, top)
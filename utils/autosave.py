@@ -0,0 +1,158 @@
+# /utils/autosave.py
+
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+from PIL import Image
+
+# مجلد ملفات الحفظ التلقائي (ملف سجل واحد لكل محرر)
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".content_studio", "autosave")
+
+# ترويسة كل سجل: طول البيانات + CRC32 لها (لاكتشاف آخر سجل إذا انقطع أثناء الكتابة)
+RECORD_HEADER = struct.Struct("<II")
+BLOB_LENGTH = struct.Struct("<I")
+
+
+class AutosaveJournal:
+    """
+    سجل حفظ تلقائي يُضاف إليه فقط، يكتبه خيط في الخلفية.
+    أول سجل (start) يصف كيف يُفتح المستند الأصلي (مثلاً مسار الملف)، وكل سجل بعده يصف عملية واحدة
+    مع البيانات التي تغيرت فقط (مناطق بكسلات أو عينات صوت). بعد انهيار البرنامج تُقرأ السجلات بالترتيب
+    وتُعاد العمليات على المستند الأصلي.
+
+    الصور ومصفوفات numpy المرفقة بالسجل تُضغط وتُكتب في الخيط الخلفي، لذلك يجب ألا تُعدل بعد تسليمها.
+    """
+    def __init__(self, name, folder=AUTOSAVE_DIR):
+        self.path = os.path.join(folder, name + ".journal")
+        self.queue = queue.Queue()
+        self.thread = None
+        self.file = None
+        self.active = False
+
+    # --- الكتابة (من الخيط الرئيسي) ---
+    def start(self, meta, blobs=()):
+        """بدء سجل جديد لمستند جديد (يحذف السجل السابق)."""
+        self.active = True
+        self._submit('start', meta, blobs)
+
+    def record(self, meta, blobs=()):
+        """إضافة عملية للسجل الحالي. meta قاموس JSON، و blobs قائمة صور PIL أو مصفوفات numpy."""
+        if self.active:
+            self._submit('record', meta, blobs)
+
+    def discard(self):
+        """حذف السجل (بعد الحفظ أو عند الخروج بدون حفظ)."""
+        self.active = False
+        self._submit('discard', None, ())
+
+    def flush(self):
+        """انتظار كتابة كل السجلات المعلقة."""
+        if self.thread:
+            self.queue.join()
+
+    def _submit(self, command, meta, blobs):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._writer, daemon=True)
+            self.thread.start()
+        self.queue.put((command, meta, list(blobs)))
+
+    # --- الخيط الخلفي ---
+    def _writer(self):
+        while True:
+            command, meta, blobs = self.queue.get()
+            try:
+                if command == 'start':
+                    self._close()
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self.file = open(self.path, "wb")
+                    self._write(meta, blobs)
+                elif command == 'record' and self.file:
+                    self._write(meta, blobs)
+                elif command == 'discard':
+                    self._close()
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                # تثبيت البيانات على القرص بعد تفريغ كل ما في الطابور
+                if self.file and self.queue.empty():
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+            except Exception as e:
+                # فشل الحفظ التلقائي لا يجب أن يوقف البرنامج (ولا هذا الخيط، وإلا لن ينتهي flush أبداً)
+                print(f"Autosave error: {type(e).__name__}: {e}")
+                self._close()
+            finally:
+                self.queue.task_done()
+
+    def _write(self, meta, blobs):
+        descriptors, payloads = [], []
+        for blob in blobs:
+            descriptor, data = encode_blob(blob)
+            descriptors.append(descriptor)
+            payloads.append(zlib.compress(data, 1))
+        meta_bytes = json.dumps({**meta, 'blobs': descriptors}, ensure_ascii=False).encode('utf-8')
+
+        parts = [BLOB_LENGTH.pack(len(meta_bytes)), meta_bytes]
+        for payload in payloads:
+            parts += [BLOB_LENGTH.pack(len(payload)), payload]
+        data = b"".join(parts)
+        self.file.write(RECORD_HEADER.pack(len(data), zlib.crc32(data)))
+        self.file.write(data)
+
+    def _close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    # --- الاسترجاع ---
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        """
+        قراءة كل السجلات السليمة: قائمة (meta, blobs).
+        القراءة تتوقف عند أول سجل ناقص أو تالف (آخر كتابة قبل الانهيار).
+        """
+        records = []
+        with open(self.path, "rb") as f:
+            data = f.read()
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, position)
+            position += RECORD_HEADER.size
+            body = data[position:position + length]
+            if len(body) < length or zlib.crc32(body) != crc: break
+            position += length
+            records.append(decode_record(body))
+        return records
+
+
+def encode_blob(blob):
+    """تحويل صورة أو مصفوفة إلى (وصف JSON, بايتات)."""
+    if isinstance(blob, Image.Image):
+        return {'type': 'image', 'mode': blob.mode, 'size': list(blob.size)}, blob.tobytes()
+    array = np.ascontiguousarray(blob)
+    return {'type': 'array', 'dtype': array.dtype.str, 'shape': list(array.shape)}, array.tobytes()
+
+
+def decode_blob(descriptor, data):
+    if descriptor['type'] == 'image':
+        return Image.frombytes(descriptor['mode'], tuple(descriptor['size']), data)
+    return np.frombuffer(data, dtype=descriptor['dtype']).reshape(descriptor['shape']).copy()
+
+
+def decode_record(body):
+    (meta_length,) = BLOB_LENGTH.unpack_from(body, 0)
+    position = BLOB_LENGTH.size
+    meta = json.loads(body[position:position + meta_length].decode('utf-8'))
+    position += meta_length
+    blobs = []
+    for descriptor in meta.pop('blobs'):
+        (length,) = BLOB_LENGTH.unpack_from(body, position)
+        position += BLOB_LENGTH.size
+        blobs.append(decode_blob(descriptor, zlib.decompress(body[position:position + length])))
+        position += length
+    return meta, blobs